@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app import make_app  # noqa: E402
+
+
+def temporary_app(**config):
+    return make_app('benchmark', instance_path=tempfile.mkdtemp(prefix='billing-bench-'), **config)
+
+
+def random_positions(count: int, files: int = 200, start: date = date(2015, 1, 1), days: int = 3000, seed: int = 1):
+    rng = random.Random(seed)
+    file_names = [f'EP{rng.randint(1000000, 9999999)}' for _ in range(files)]
+    for _ in range(count):
+        hourly_rate = rng.choice((250.0, 300.0, 350.0))
+        billed_hours = round(rng.uniform(0.1, 8.0), 1)
+        billed_cents = round(hourly_rate * billed_hours * 100)
+        yield (
+            int((start + timedelta(days=rng.randrange(days))).strftime('%Y%m%d')),
+            rng.choice(file_names),
+            hourly_rate,
+            billed_hours,
+            billed_cents,
+            round(billed_cents * rng.choice((0.3, 0.35, 0.4)))
+        )
+
+
+def seed_positions(connection, count: int, **kwargs) -> None:
+    connection.executemany('''
+        INSERT INTO billing_positions (date, file, hourly_rate, billed_hours, billed_cents, earned_cents)
+        VALUES (?, ?, ?, ?, ?, ?);
+    ''', random_positions(count, **kwargs))
+    connection.commit()
+
+
+def timed(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def summarize(samples: list[float]) -> dict:
+    samples = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return samples[min(len(samples) - 1, int(round(p * (len(samples) - 1))))] * 1000
+
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def report(name: str, results: dict) -> None:
+    print(json.dumps({'benchmark': name, 'results': results}, indent=2))
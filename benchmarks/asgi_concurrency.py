@@ -0,0 +1,127 @@
+import argparse
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from _common import summarize, report
+from route_load import SRC, HTTPDriver, copy_instance, free_port, start_gunicorn, wait_for_port
+from synthetic import SIZES, parse_size, ensure_dataset
+
+# Full exports keep a request (and, without the DB executor, its SQLite calls) busy for a long
+# time; the fast routes show how the remaining capacity degrades while they run.
+SLOW_PATH = '/export/billing_positions.csv'
+FAST_PATHS = ('/api/v1/billing_positions?limit=20', '/billing/', '/search/files?q=EP12')
+
+
+def start_uvicorn(instance: str, threads: int, executor_readers: int) -> tuple[subprocess.Popen, int]:
+    # executor_readers=0 runs the SQLite calls on the request threads.
+    port = free_port()
+    script = (
+        'import sys, uvicorn; sys.path.insert(0, sys.argv[1]);'
+        'from app import make_app; from app.asgi import WSGIToASGI;'
+        'app = WSGIToASGI(make_app("benchmark", sys.argv[2], DB_EXECUTOR=sys.argv[4] != "0", DB_EXECUTOR_READERS=int(sys.argv[4]) or 1), int(sys.argv[3]));'
+        'uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[5]), log_level="warning", access_log=False)'
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-c', script, SRC, instance, str(threads), str(executor_readers), str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wait_for_port(process, port)
+    return process, port
+
+
+def load(port: int, clients: int, slow_clients: int, seconds: float) -> dict:
+    driver = HTTPDriver(port)
+    deadline = time.perf_counter() + seconds
+    samples = []
+    slow_samples = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(index: int, slow: bool) -> None:
+        local = []
+        local_errors = 0
+        n = index
+        while time.perf_counter() < deadline:
+            path = SLOW_PATH if slow else FAST_PATHS[n % len(FAST_PATHS)]
+            n += 1
+            start = time.perf_counter()
+            try:
+                status = driver.request('GET', path, None)
+            except Exception:
+                status = None
+            local.append(time.perf_counter() - start)
+            if status is None or status >= 500:
+                local_errors += 1
+        with lock:
+            (slow_samples if slow else samples).extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client, args=(i, False)) for i in range(clients)]
+    threads += [threading.Thread(target=client, args=(i, True)) for i in range(slow_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = summarize(samples) if samples else {'count': 0}
+    results['requests_per_second'] = len(samples) / elapsed
+    results['slow_requests'] = len(slow_samples)
+    results['errors'] = errors[0]
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Latency of fast routes under rising concurrency and slow exports, WSGI versus ASGI.')
+    parser.add_argument('--size', default='100k', help=f'number of positions or one of {", ".join(SIZES)}')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--slow-clients', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--gunicorn-workers', type=int, default=1)
+    parser.add_argument('--gunicorn-threads', type=int, default=3)
+    parser.add_argument('--asgi-threads', type=int, default=32)
+    parser.add_argument('--executor-readers', type=int, default=4)
+    parser.add_argument('--p99-limit-ms', type=float, default=250.0, help='p99 above which a concurrency level counts as saturated')
+    args = parser.parse_args()
+
+    dataset = ensure_dataset(parse_size(args.size))
+    servers = {
+        f'wsgi (gunicorn {args.gunicorn_workers}x{args.gunicorn_threads} threads)':
+            lambda instance: start_gunicorn(instance, args.gunicorn_workers, args.gunicorn_threads),
+        f'asgi (uvicorn, {args.asgi_threads} threads)':
+            lambda instance: start_uvicorn(instance, args.asgi_threads, 0),
+        f'asgi (uvicorn, {args.asgi_threads} threads, DB executor with {args.executor_readers} readers)':
+            lambda instance: start_uvicorn(instance, args.asgi_threads, args.executor_readers),
+    }
+
+    results = {}
+    for name, start_server in servers.items():
+        instance = copy_instance(dataset)
+        process, port = start_server(instance)
+        try:
+            levels = {}
+            for clients in args.clients:
+                levels[clients] = load(port, clients, args.slow_clients, args.seconds)
+                print(f'{name:45} {clients:4} clients  p99 {levels[clients].get("p99_ms", 0):9.2f} ms  '
+                      f'{levels[clients]["requests_per_second"]:8.1f} req/s', file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(instance, ignore_errors=True)
+
+        saturated = [c for c, r in levels.items() if r['errors'] or r.get('p99_ms', float('inf')) > args.p99_limit_ms]
+        results[name] = {
+            'levels': levels,
+            # Highest tested number of concurrent clients that stayed below the p99 limit without errors.
+            'concurrency_limit': max((c for c in levels if c not in saturated and all(s > c for s in saturated)), default=0),
+        }
+
+    report('asgi_concurrency', {'size': args.size, 'slow_clients': args.slow_clients, 'servers': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import time
+from datetime import datetime
+
+from _common import temporary_app, seed_positions, report
+
+from app.db import DB
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Invoicing N positions: per-row commits versus one batch transaction.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    app = temporary_app()
+    results = {}
+    with app.app_context():
+        database = DB(app)
+        seed_positions(database.connection, 2 * sum(args.sizes))
+        ids = iter(range(1, 2 * sum(args.sizes) + 1))
+
+        for size in args.sizes:
+            invoice_id = database.add_invoice(datetime.now())
+
+            start = time.perf_counter()
+            for _ in range(size):
+                database.invoice_billing_position(next(ids), 10.0, invoice_id)
+            per_row = time.perf_counter() - start
+
+            invoiced_amounts = [(next(ids), 10.0) for _ in range(size)]
+            start = time.perf_counter()
+            database.invoice_billing_positions(invoiced_amounts, invoice_id)
+            batch = time.perf_counter() - start
+
+            results[size] = {
+                'per_row_ms': per_row * 1000,
+                'batch_ms': batch * 1000,
+                'speedup': per_row / batch,
+            }
+
+    report('bulk_invoicing', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import argparse
+import subprocess
+import time
+
+from _common import summarize, report
+from route_load import SRC, HTTPDriver, copy_instance, free_port
+from synthetic import SIZES, parse_size, ensure_dataset
+
+# Pages whose templates are compiled on their first hit unless the master precompiled them.
+PATHS = ('/', '/billing/', '/invoicing/', '/files/', '/dashboard/', '/billing/add', '/invoicing/add')
+
+# preload: gunicorn_conf.py as deployed (preload_app, templates precompiled in the master).
+# lazy: every worker imports the app itself and compiles templates on first use.
+# The bytecode variants restart on the same instance folder, so instance/jinja_cache is already filled.
+CONFIGURATIONS = {
+    'lazy': (False, False),
+    'lazy_bytecode': (False, True),
+    'preload': (True, False),
+    'preload_bytecode': (True, True),
+}
+
+
+def start(instance: str, preload: bool, workers: int, threads: int) -> tuple[subprocess.Popen, int]:
+    port = free_port()
+    config = ['--conf', os.path.join(SRC, 'gunicorn_conf.py')] if preload else []
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn', '--chdir', SRC, *config,
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads),
+            '--access-logfile', '/dev/null', f'app:make_app("benchmark", {instance!r})',
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, port
+
+
+def first_response(process: subprocess.Popen, driver: HTTPDriver, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            if driver.request('GET', '/', None) == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f'no response within {timeout}s')
+
+
+def run(dataset: str, preload: bool, bytecode: bool, workers: int, threads: int) -> dict:
+    instance = copy_instance(dataset)
+    if bytecode:
+        # A first start fills instance/jinja_cache (and instance/assets) for the measured one.
+        process, port = start(instance, True, workers, threads)
+        try:
+            first_response(process, HTTPDriver(port))
+        finally:
+            process.terminate()
+            process.wait()
+
+    started = time.perf_counter()
+    process, port = start(instance, preload, workers, threads)
+    try:
+        driver = HTTPDriver(port)
+        first_response(process, driver)
+        ready = time.perf_counter() - started
+
+        # Every worker serves each page once, the first hits include any template compilation.
+        samples = []
+        for path in PATHS:
+            for _ in range(workers):
+                # A new connection per request, so the requests spread over the workers.
+                driver = HTTPDriver(port)
+                start_request = time.perf_counter()
+                driver.request('GET', path, None)
+                samples.append(time.perf_counter() - start_request)
+        return {'first_response_ms': ready * 1000, 'first_hits': summarize(samples)}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time from starting gunicorn to the first response, and the first hit of each page.')
+    parser.add_argument('--size', default='10k', help=f'number of positions or one of {", ".join(SIZES)}')
+    parser.add_argument('--configurations', nargs='+', choices=list(CONFIGURATIONS), default=list(CONFIGURATIONS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=3)
+    args = parser.parse_args()
+
+    dataset = ensure_dataset(parse_size(args.size))
+    results = {}
+    for name in args.configurations:
+        preload, bytecode = CONFIGURATIONS[name]
+        runs = [run(dataset, preload, bytecode, args.workers, args.threads) for _ in range(args.runs)]
+        results[name] = {
+            'first_response': summarize([r['first_response_ms'] / 1000 for r in runs]),
+            'first_hit_mean_ms': sum(r['first_hits']['mean_ms'] for r in runs) / len(runs),
+            'first_hit_p95_ms': sum(r['first_hits']['p95_ms'] for r in runs) / len(runs),
+        }
+
+    report('cold_start', results)
+
+
+if __name__ == '__main__':
+    main()
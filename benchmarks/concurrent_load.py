@@ -0,0 +1,70 @@
+import argparse
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from _common import temporary_app, seed_positions, report
+
+from app.db import DB
+
+
+def worker(app, role: str, deadline: float, counters: dict, lock: threading.Lock) -> None:
+    operations = errors = 0
+    while time.perf_counter() < deadline:
+        try:
+            with app.app_context():
+                database = DB(app)
+                if role == 'reader':
+                    database.get_billing_positions_page(50)
+                    database.get_statistics()
+                else:
+                    database.add_billing_position(datetime.now(), 'EP1000000', 300.0, 1.0, 300.0, 120.0)
+            operations += 1
+        except sqlite3.OperationalError:
+            errors += 1
+
+    with lock:
+        counters[f'{role}_operations'] += operations
+        counters[f'{role}_errors'] += errors
+
+
+def run(profile: str, readers: int, writers: int, seconds: float, positions: int) -> dict:
+    app = temporary_app(DB_PROFILE=profile)
+    with app.app_context():
+        seed_positions(DB(app).connection, positions)
+
+    counters = {'reader_operations': 0, 'reader_errors': 0, 'writer_operations': 0, 'writer_errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=worker, args=(app, role, deadline, counters, lock))
+        for role in ['reader'] * readers + ['writer'] * writers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counters['reads_per_second'] = counters['reader_operations'] / seconds
+    counters['writes_per_second'] = counters['writer_operations'] / seconds
+    return counters
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Multi-threaded read/write throughput per connection profile.')
+    parser.add_argument('--readers', type=int, default=3)
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--positions', type=int, default=10000)
+    parser.add_argument('--profiles', nargs='+', default=['default', 'wal'])
+    args = parser.parse_args()
+
+    report('concurrent_load', {
+        profile: run(profile, args.readers, args.writers, args.seconds, args.positions)
+        for profile in args.profiles
+    })
+
+
+if __name__ == '__main__':
+    main()
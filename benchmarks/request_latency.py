@@ -0,0 +1,57 @@
+import os
+import argparse
+import sqlite3
+
+from _common import temporary_app, seed_positions, timed, report
+
+import app as app_module
+from app import billing, invoicing
+from app.db import DB
+
+
+LEGACY_SCHEMA = (
+    ('invoices', 'id integer PRIMARY KEY, date integer NOT NULL'),
+    ('billing_positions', 'id integer PRIMARY KEY, date integer NOT NULL, file text NOT NULL, hourly_rate real, '
+        'billed_hours real, billed_amount real, earned_amount real NOT NULL, invoiced_amount real, invoice_id integer, '
+        'FOREIGN KEY(invoice_id) REFERENCES invoices(id)'),
+)
+
+
+class UnpooledDB(DB):
+    # Behaviour before connection pooling: a fresh connection and schema bootstrap per instance.
+    def __init__(self, app, connection=None) -> None:
+        super().__init__(app, sqlite3.connect(os.path.join(app.instance_path, 'db.sqlite')))
+        for table, columns in LEGACY_SCHEMA:
+            self.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns});', commit=True)
+
+
+def use_db_class(db_class) -> None:
+    for module in (app_module, billing, invoicing):
+        module.DB = db_class
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Request latency with and without pooled connections.')
+    parser.add_argument('--positions', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    app = temporary_app()
+    with app.app_context():
+        seed_positions(DB(app).connection, args.positions)
+    client = app.test_client()
+
+    results = {}
+    for name, db_class in (('unpooled', UnpooledDB), ('pooled', DB)):
+        use_db_class(db_class)
+        results[name] = {
+            route: timed(lambda: client.get(route), args.repeat)
+            for route in ('/', '/billing/', '/invoicing/', '/billing/edit/1')
+        }
+    use_db_class(DB)
+
+    report('request_latency', results)
+
+
+if __name__ == '__main__':
+    main()
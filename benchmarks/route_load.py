@@ -0,0 +1,403 @@
+import argparse
+import hashlib
+import http.client
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, NamedTuple
+from urllib.parse import urlencode
+
+from _common import summarize, report
+from synthetic import SIZES, parse_size, ensure_dataset
+
+from app import make_app
+from app.jobs import run_job
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+class Scenario(NamedTuple):
+    name: str
+    endpoint: str
+    method: str
+    # Both take the running request number, so mutations can pick a different target each time.
+    path: Callable[[int], str]
+    body: Callable[[int], tuple[bytes, str]] | None = None
+    mutates: bool = False
+
+
+def form(fields: list[tuple[str, str]]) -> tuple[bytes, str]:
+    return urlencode(fields).encode('utf-8'), 'application/x-www-form-urlencoded'
+
+def json_body(value) -> tuple[bytes, str]:
+    return json.dumps(value).encode('utf-8'), 'application/json'
+
+def multipart(field: str, filename: str, content: bytes) -> tuple[bytes, str]:
+    boundary = 'billing-benchmark-boundary'
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: text/csv\r\n\r\n'
+    ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def sample_data(db_path: str, pool: int) -> dict:
+    connection = sqlite3.connect(db_path)
+    try:
+        def column(sql: str) -> list:
+            return [row[0] for row in connection.execute(sql)]
+
+        open_ids = column(f'SELECT id FROM billing_positions WHERE invoice_id IS NULL ORDER BY id DESC LIMIT {3 * pool + 1};')
+        middle = connection.execute(
+            'SELECT date, id FROM billing_positions ORDER BY date, id LIMIT 1 OFFSET (SELECT count(*) / 2 FROM billing_positions);'
+        ).fetchone()
+        return {
+            'position_id': open_ids[0],
+            # Disjoint pools, so removing positions does not hit ids another scenario edits.
+            'edit_ids': open_ids[1:pool + 1],
+            'remove_ids': open_ids[pool + 1:2 * pool + 1],
+            'api_remove_ids': open_ids[2 * pool + 1:],
+            'invoice_id': column('''
+                SELECT invoice_id FROM billing_positions WHERE invoice_id IS NOT NULL
+                GROUP BY invoice_id ORDER BY count(*) DESC, invoice_id LIMIT 1;
+            ''')[0],
+            'remove_invoice_ids': column(f'SELECT id FROM invoices ORDER BY id DESC LIMIT {pool};'),
+            'file': column('SELECT file FROM billing_files ORDER BY count_positions DESC LIMIT 1;')[0],
+            'year': column('SELECT max(date) / 10000 FROM billing_positions;')[0],
+            'cursor': f'{middle[0]}-{middle[1]}',
+        }
+    finally:
+        connection.close()
+
+
+def fingerprinted_asset(filename: str) -> str:
+    # The name assets.py serves a static file under.
+    with open(os.path.join(SRC, 'app', 'static', filename), 'rb') as asset_file:
+        digest = hashlib.sha256(asset_file.read()).hexdigest()[:12]
+    stem, extension = os.path.splitext(filename)
+    return f'{stem}.{digest}{extension}'
+
+
+def seed_export_job(instance: str, year: int) -> int:
+    # A finished export job for jobs.status and jobs.download; no job worker runs in client mode.
+    app = make_app('benchmark', instance_path=instance)
+    queue = app.extensions['jobs']
+    arguments = {'kind': 'invoices', 'format': 'csv', 'year': year}
+    job_id = queue.submit('export', arguments)
+    queue.finish(job_id, result=run_job(app, job_id, 'export', None, arguments))
+    return job_id
+
+
+def scenarios(data: dict) -> list[Scenario]:
+    def pick(ids: list[int]) -> Callable[[int], int]:
+        return lambda n: ids[n % len(ids)]
+
+    position_id = data['position_id']
+    invoice_id = data['invoice_id']
+    file = data['file']
+    year = data['year']
+    edit_id = pick(data['edit_ids'])
+    remove_id = pick(data['remove_ids'])
+    api_remove_id = pick(data['api_remove_ids'])
+    remove_invoice_id = pick(data['remove_invoice_ids'])
+    position = {'date': '2023-06-01', 'file': 'EP1000001', 'hourly_rate': '300', 'billed_hours': '1.5', 'earned_percentage': '35'}
+    csv_content = ('date,file,earned_amount\n' + ''.join(f'2023-06-{day:02d},EP1000002,100.0\n' for day in range(1, 29))).encode('utf-8')
+
+    def get(name: str, endpoint: str, path: str) -> Scenario:
+        return Scenario(name, endpoint, 'GET', lambda n: path)
+
+    return [
+        get('home', 'home', '/'),
+        get('cache_stats', 'cache_stats', '/cache/stats'),
+        get('backup_status', 'backup_status', '/backup/status'),
+        get('write_queue_stats', 'write_queue_stats', '/write-queue/stats'),
+        get('static', 'static', '/static/style.css'),
+        get('assets.asset', 'assets.asset', f"/assets/{fingerprinted_asset('style.css')}"),
+        get('billing.home', 'billing.home', '/billing/'),
+        get('billing.home?file', 'billing.home', f'/billing/?file={file}'),
+        get('billing.home?before', 'billing.home', f'/billing/?before={data["cursor"]}'),
+        get('billing.edit', 'billing.edit', f'/billing/edit/{position_id}'),
+        get('billing.remove', 'billing.remove', f'/billing/remove/{position_id}'),
+        get('billing.add', 'billing.add', '/billing/add'),
+        get('billing.import_csv', 'billing.import_csv', '/billing/import'),
+        get('invoicing.home', 'invoicing.home', '/invoicing/'),
+        get('invoicing.add', 'invoicing.add', '/invoicing/add'),
+        get('invoicing.invoice', 'invoicing.invoice', f'/invoicing/invoice/{invoice_id}'),
+        Scenario('invoicing.invoice[file]', 'invoicing.invoice', 'POST', lambda n: f'/invoicing/invoice/{invoice_id}', lambda n: form([('file', file)])),
+        get('invoicing.edit', 'invoicing.edit', f'/invoicing/edit/{invoice_id}'),
+        get('invoicing.remove', 'invoicing.remove', f'/invoicing/remove/{invoice_id}'),
+        get('export.billing_positions.csv', 'export.export', f'/export/billing_positions.csv?year={year}'),
+        get('export.invoices.ndjson', 'export.export', f'/export/invoices.ndjson?year={year}'),
+        get('export.invoice_items.csv', 'export.export', f'/export/invoice_items.csv?year={year}'),
+        get('files.home', 'files.home', '/files/'),
+        get('files.home?activity', 'files.home', '/files/?order=activity&open=1&page=3'),
+        get('files.ledger', 'files.ledger', f'/files/{file}'),
+        get('dashboard.home', 'dashboard.home', '/dashboard/'),
+        get('search.files', 'search.files', f'/search/files?q={file[:4]}'),
+        get('search.files[fuzzy]', 'search.files', f'/search/files?q={file[:3]}{file[4:]}'),
+        get('api.list_billing_positions', 'api.list_billing_positions', f'/api/v1/billing_positions?limit=100&file={file}'),
+        get('api.get_billing_position', 'api.get_billing_position', f'/api/v1/billing_positions/{position_id}'),
+        get('api.list_invoices', 'api.list_invoices', '/api/v1/invoices'),
+        get('api.get_invoice', 'api.get_invoice', f'/api/v1/invoices/{invoice_id}'),
+        get('jobs.recent', 'jobs.recent', '/jobs/'),
+        get('jobs.status', 'jobs.status', f'/jobs/{data["job_id"]}'),
+        get('jobs.download', 'jobs.download', f'/jobs/{data["job_id"]}/download'),
+
+        # Mutations run after all reads, on a copy of the dataset.
+        Scenario('billing.add[post]', 'billing.add', 'POST', lambda n: '/billing/add', lambda n: form(list(position.items())), True),
+        Scenario('billing.edit[post]', 'billing.edit', 'POST', lambda n: f'/billing/edit/{edit_id(n)}', lambda n: form(list(position.items())), True),
+        Scenario('billing.import_csv[post]', 'billing.import_csv', 'POST', lambda n: '/billing/import', lambda n: multipart('csv_file', 'positions.csv', csv_content), True),
+        Scenario('invoicing.add[post]', 'invoicing.add', 'POST', lambda n: '/invoicing/add', lambda n: form([('date', '2023-06-30')]), True),
+        Scenario('invoicing.invoice[post]', 'invoicing.invoice', 'POST', lambda n: f'/invoicing/invoice/{invoice_id}',
+                 lambda n: form([('billing_position_id[]', str(edit_id(n))), ('invoice_amount', '100.0')]), True),
+        Scenario('invoicing.edit[post]', 'invoicing.edit', 'POST', lambda n: f'/invoicing/edit/{invoice_id}',
+                 lambda n: form([('date', '2023-06-30'), ('billing_position_ids[]', str(edit_id(n))), ('billing_position_invoiced_amounts[]', '50.0')]), True),
+        Scenario('api.create_billing_position', 'api.create_billing_position', 'POST', lambda n: '/api/v1/billing_positions', lambda n: json_body(position), True),
+        Scenario('api.update_billing_position', 'api.update_billing_position', 'PUT', lambda n: f'/api/v1/billing_positions/{edit_id(n)}', lambda n: json_body(position), True),
+        Scenario('api.create_billing_positions', 'api.create_billing_positions', 'POST', lambda n: '/api/v1/billing_positions/batch', lambda n: json_body([position] * 50), True),
+        Scenario('api.update_billing_positions', 'api.update_billing_positions', 'PUT', lambda n: '/api/v1/billing_positions/batch',
+                 lambda n: json_body([dict(position, id=edit_id(n + i)) for i in range(10)]), True),
+        Scenario('api.invoice_billing_positions', 'api.invoice_billing_positions', 'POST', lambda n: f'/api/v1/invoices/{invoice_id}/billing_positions',
+                 lambda n: json_body([{'id': edit_id(n), 'invoiced_amount': 10.0}]), True),
+        Scenario('api.create_invoice', 'api.create_invoice', 'POST', lambda n: '/api/v1/invoices', lambda n: json_body({'date': '2023-06-30'}), True),
+        Scenario('api.update_invoice', 'api.update_invoice', 'PUT', lambda n: f'/api/v1/invoices/{invoice_id}', lambda n: json_body({'date': '2023-06-30'}), True),
+        Scenario('api.create_invoices', 'api.create_invoices', 'POST', lambda n: '/api/v1/invoices/batch', lambda n: json_body([{'date': '2023-06-30'}] * 10), True),
+        # Queues an export; with gunicorn the job workers run them while the remaining mutations are measured.
+        Scenario('jobs.submit', 'jobs.submit', 'POST', lambda n: '/jobs/',
+                 lambda n: json_body({'kind': 'export', 'arguments': {'kind': 'invoices', 'format': 'ndjson', 'year': year}}), True),
+        # Removals that hit an already removed id are answered with 404 by the API, which still exercises the route.
+        Scenario('billing.remove[post]', 'billing.remove', 'POST', lambda n: f'/billing/remove/{remove_id(n)}', lambda n: form([('confirmation', 'yes')]), True),
+        Scenario('api.remove_billing_position', 'api.remove_billing_position', 'DELETE', lambda n: f'/api/v1/billing_positions/{api_remove_id(2 * n)}', None, True),
+        Scenario('api.remove_billing_positions', 'api.remove_billing_positions', 'DELETE', lambda n: '/api/v1/billing_positions/batch',
+                 lambda n: json_body([api_remove_id(2 * n + 1)]), True),
+        Scenario('invoicing.remove[post]', 'invoicing.remove', 'POST', lambda n: f'/invoicing/remove/{remove_invoice_id(3 * n)}', lambda n: form([('confirmation', 'yes')]), True),
+        Scenario('api.remove_invoice', 'api.remove_invoice', 'DELETE', lambda n: f'/api/v1/invoices/{remove_invoice_id(3 * n + 1)}', None, True),
+        Scenario('api.remove_invoices', 'api.remove_invoices', 'DELETE', lambda n: '/api/v1/invoices/batch', lambda n: json_body([remove_invoice_id(3 * n + 2)]), True),
+    ]
+
+# Routes that are deliberately not driven, with the reason reported in the results.
+SKIPPED = {
+    'backup': 'starts a background backup and is rate limited by BACKUP_INTERVAL',
+    'metrics': 'only registered with METRICS enabled',
+}
+
+
+class TestClientDriver:
+
+    def __init__(self, app) -> None:
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, body: tuple[bytes, str] | None) -> int:
+        data, content_type = body if body is not None else (None, None)
+        response = self.client.open(path, method=method, data=data, content_type=content_type)
+        # Consume streamed responses (exports) like a real client would.
+        for _ in response.iter_encoded():
+            pass
+        return response.status_code
+
+
+class HTTPDriver:
+    # One keep-alive connection per client thread.
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, method: str, path: str, body: tuple[bytes, str] | None) -> int:
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        connection = self.local.connection
+        data, content_type = body if body is not None else (None, None)
+        try:
+            connection.request(method, path, body=data, headers={'Content-Type': content_type} if content_type else {})
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            del self.local.connection
+            raise
+        if response.will_close:
+            connection.close()
+            del self.local.connection
+        return response.status
+
+
+def run_scenario(driver, scenario: Scenario, clients: int, repeat: int) -> dict:
+    counter = itertools.count()
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def client() -> None:
+        local_samples = []
+        local_errors = 0
+        for _ in range(repeat):
+            n = next(counter)
+            body = scenario.body(n) if scenario.body is not None else None
+            start = time.perf_counter()
+            try:
+                status = driver.request(scenario.method, scenario.path(n), body)
+            except Exception:
+                status = None
+            local_samples.append(time.perf_counter() - start)
+            if status is None or status >= 500:
+                local_errors += 1
+        with lock:
+            samples.extend(local_samples)
+            errors.append(local_errors)
+
+    start = time.perf_counter()
+    if clients == 1:
+        client()
+    else:
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = summarize(samples)
+    results['requests_per_second'] = len(samples) / elapsed
+    results['errors'] = sum(errors)
+    return results
+
+
+def copy_instance(dataset: str) -> str:
+    path = tempfile.mkdtemp(prefix='billing-bench-')
+    shutil.copy(os.path.join(dataset, 'db.sqlite'), os.path.join(path, 'db.sqlite'))
+    return path
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(instance: str, workers: int, threads: int) -> tuple[subprocess.Popen, int]:
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn', '--chdir', SRC, '--conf', os.path.join(SRC, 'gunicorn_conf.py'),
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads),
+            '--access-logfile', '/dev/null', f'app:make_app("benchmark", {instance!r})',
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wait_for_port(process, port)
+    return process, port
+
+
+def wait_for_port(process: subprocess.Popen, port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'server did not start listening within {timeout}s')
+
+
+def run_mode(mode: str, dataset: str, args) -> dict:
+    instance = copy_instance(dataset)
+    data = sample_data(os.path.join(instance, 'db.sqlite'), args.repeat * args.clients)
+    data['job_id'] = seed_export_job(instance, data['year'])
+    selected = [s for s in scenarios(data) if not args.routes or any(s.name.startswith(prefix) for prefix in args.routes)]
+    selected = [s for s in selected if args.mutations or not s.mutates]
+
+    results = {}
+    process = None
+    try:
+        if mode == 'client':
+            app = make_app('benchmark', instance_path=instance)
+            driver = TestClientDriver(app)
+            clients = 1
+        else:
+            process, port = start_gunicorn(instance, args.workers, args.threads)
+            driver = HTTPDriver(port)
+            clients = args.clients
+
+        for scenario in selected:
+            if args.warmup:
+                run_scenario(driver, scenario, 1, args.warmup)
+            results[scenario.name] = run_scenario(driver, scenario, clients, args.repeat)
+            print(f'{mode:7} {scenario.name:40} p50 {results[scenario.name]["p50_ms"]:8.2f} ms  '
+                  f'{results[scenario.name]["requests_per_second"]:8.1f} req/s', file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(instance, ignore_errors=True)
+    return results
+
+
+def coverage() -> dict:
+    # Every endpoint of make_app should be driven by a scenario or listed in SKIPPED.
+    app = make_app('benchmark', instance_path=tempfile.mkdtemp(prefix='billing-bench-'))
+    try:
+        endpoints = {rule.endpoint for rule in app.url_map.iter_rules()}
+    finally:
+        shutil.rmtree(app.instance_path, ignore_errors=True)
+    data = {'position_id': 1, 'edit_ids': [1], 'remove_ids': [1], 'api_remove_ids': [1], 'invoice_id': 1,
+            'remove_invoice_ids': [1], 'file': 'EP1', 'year': 2023, 'cursor': '20230101-1', 'job_id': 1}
+    driven = {scenario.endpoint for scenario in scenarios(data)}
+    return {
+        'skipped': {endpoint: reason for endpoint, reason in SKIPPED.items() if endpoint in endpoints},
+        'not_covered': sorted(endpoints - driven - set(SKIPPED)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Latency and throughput of every route on synthetic datasets.')
+    parser.add_argument('--sizes', nargs='+', default=['10k'], help=f'numbers of positions or {", ".join(SIZES)}')
+    parser.add_argument('--modes', nargs='+', choices=['client', 'gunicorn'], default=['client', 'gunicorn'])
+    parser.add_argument('--repeat', type=int, default=50, help='requests per route (per client with gunicorn)')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients against gunicorn')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=3)
+    parser.add_argument('--routes', nargs='*', help='only run scenarios whose name starts with one of these')
+    parser.add_argument('--no-mutations', dest='mutations', action='store_false')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'arguments': vars(args),
+        },
+        'coverage': coverage(),
+        'sizes': {},
+    }
+    for size in args.sizes:
+        positions = parse_size(size)
+        dataset = ensure_dataset(positions, seed=args.seed)
+        results['sizes'][size] = {mode: run_mode(mode, dataset, args) for mode in args.modes}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    report('route_load', results)
+
+
+if __name__ == '__main__':
+    main()
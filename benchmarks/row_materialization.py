@@ -0,0 +1,90 @@
+import argparse
+import time
+from datetime import datetime
+
+from _common import temporary_app, seed_positions, report
+
+from app.db import DB, BillingPosition, BILLING_POSITION_COLUMNS
+
+
+def optional_float(number):
+    if number == '':
+        return None
+    try:
+        return float(number)
+    except:
+        return None
+
+
+def optional_int(number):
+    if number == '':
+        return None
+    try:
+        return int(number)
+    except:
+        return None
+
+
+def format_billing_position(**kwargs) -> dict:
+    # The dict/match pipeline DB used before BillingPosition rows, kept here as the baseline.
+    formatted_billing_position = {}
+    for key, value in kwargs.items():
+        match key:
+            case 'id':
+                formatted_billing_position[key] = int(value)
+            case 'date':
+                formatted_billing_position[key] = datetime.strptime(f'{value}', '%Y%m%d').date()
+            case 'file':
+                formatted_billing_position[key] = str(value)
+            case 'hourly_rate' | 'billed_hours' | 'billed_amount':
+                formatted_billing_position[key] = optional_float(value)
+            case 'earned_amount':
+                formatted_billing_position[key] = float(value)
+            case 'invoiced_amount' | 'invoice_id':
+                formatted_billing_position[key] = optional_int(value)
+    return formatted_billing_position
+
+
+def legacy_fetch(database: DB) -> list:
+    database.execute('SELECT * FROM billing_positions ORDER BY date;')
+    billing_positions = [dict(zip(database.row_keys, row_value)) for row_value in database.row_values]
+    return [format_billing_position(**b) for b in billing_positions]
+
+
+def row_fetch(database: DB) -> list:
+    return database.fetch(BillingPosition, f'SELECT {database.columns(BILLING_POSITION_COLUMNS)} FROM billing_positions ORDER BY date;')
+
+
+def raw_fetch(database: DB) -> list:
+    return database.connection.execute('SELECT * FROM billing_positions ORDER BY date;').fetchall()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='List-fetch throughput of the row materialisation strategies.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        app = temporary_app()
+        with app.app_context():
+            database = DB(app)
+            seed_positions(database.connection, size, files=max(size // 50, 1))
+
+            results[size] = {}
+            for name, fetch in (('raw_tuples', raw_fetch), ('legacy_dicts', legacy_fetch), ('billing_position_rows', row_fetch)):
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    rows = fetch(database)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                assert len(rows) == size
+                results[size][name] = {'seconds': best, 'rows_per_second': size / best}
+
+    report('row_materialization', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+from _common import report
+
+from app import make_app
+from app.db import DB
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+
+PREFIXES = (('EP', 0.55), ('DE', 0.25), ('US', 0.12), ('WO', 0.08))
+HOURLY_RATES = ((250.0, 0.3), (300.0, 0.4), (350.0, 0.2), (450.0, 0.1))
+EARNED_PERCENTAGES = (30.0, 35.0, 40.0)
+
+
+def parse_size(size: str) -> int:
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def file_sizes(positions: int, mean: float, rng: random.Random) -> list[int]:
+    # Positions per file follow a log-normal distribution: most files have a handful of
+    # positions, a few long running ones have hundreds.
+    sigma = 1.0
+    mu = math.log(mean) - sigma ** 2 / 2
+    sizes = []
+    remaining = positions
+    while remaining > 0:
+        size = min(remaining, max(1, int(rng.lognormvariate(mu, sigma))))
+        sizes.append(size)
+        remaining -= size
+    return sizes
+
+
+def file_name(rng: random.Random, used: set) -> str:
+    prefixes, weights = zip(*PREFIXES)
+    while True:
+        name = f'{rng.choices(prefixes, weights)[0]}{rng.randint(1000000, 9999999)}'
+        if name not in used:
+            used.add(name)
+            return name
+
+
+def generate(connection: sqlite3.Connection, positions: int, years: int = 8, mean_per_file: float = 20.0,
+             invoiced_share: float = 0.85, today: date = date(2023, 6, 30), seed: int = 1) -> dict:
+    # Fills an empty, migrated database. Every file is worked on over a window within the last
+    # years; positions older than three months are invoiced with probability invoiced_share,
+    # grouped per file and quarter into one invoice, with the amount on the group's last position
+    # (as the invoicing form books it).
+    rng = random.Random(seed)
+    start = today - timedelta(days=365 * years)
+    rates, rate_weights = zip(*HOURLY_RATES)
+    cutoff = today - timedelta(days=90)
+    used = set()
+
+    billing_positions = []
+    groups = {}
+    for size in file_sizes(positions, mean_per_file, rng):
+        file = file_name(rng, used)
+        first = start + timedelta(days=rng.randrange((today - start).days))
+        span = max(1, min((today - first).days, int(rng.expovariate(1 / 400))))
+        for _ in range(size):
+            day = first + timedelta(days=rng.randrange(span + 1))
+            if day.weekday() >= 5:
+                day -= timedelta(days=day.weekday() - 4)
+            hourly_rate = rng.choices(rates, rate_weights)[0]
+            billed_hours = round(min(12.0, rng.lognormvariate(0.3, 0.8)), 1) or 0.1
+            billed_cents = round(hourly_rate * billed_hours * 100)
+            earned_cents = round(billed_cents * rng.choice(EARNED_PERCENTAGES) / 100)
+            billing_positions.append([int(day.strftime('%Y%m%d')), file, hourly_rate, billed_hours, billed_cents, earned_cents, None, None])
+
+            if day < cutoff and rng.random() < invoiced_share:
+                groups.setdefault((file, day.year, (day.month - 1) // 3), []).append(len(billing_positions) - 1)
+
+    # Invoice ids are assigned in date order, which is the order they are inserted in below.
+    invoices = []
+    for (file, year, quarter), members in sorted(groups.items(), key=lambda item: (item[0][1], item[0][2], item[0][0])):
+        invoices.append(int(date(year, 3 * quarter + 3, 1).strftime('%Y%m%d')))
+        members.sort(key=lambda index: billing_positions[index][0])
+        for index in members:
+            billing_positions[index][6] = 0
+            billing_positions[index][7] = len(invoices)
+        billing_positions[members[-1]][6] = sum(billing_positions[index][5] for index in members)
+    billing_positions.sort(key=lambda b: b[0])
+
+    with connection:
+        connection.executemany('INSERT INTO invoices (date) VALUES (?);', ((d, ) for d in invoices))
+        connection.executemany('''
+            INSERT INTO billing_positions (date, file, hourly_rate, billed_hours, billed_cents, earned_cents, invoiced_cents, invoice_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        ''', billing_positions)
+    connection.execute('PRAGMA optimize;')
+    connection.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+
+    return {
+        'positions': len(billing_positions),
+        'files': len(used),
+        'invoices': len(invoices),
+        'invoiced_positions': sum(1 for b in billing_positions if b[7] is not None),
+    }
+
+
+def instance_path(positions: int, seed: int = 1) -> str:
+    return os.path.join(tempfile.gettempdir(), f'billing-bench-data-{positions}-{seed}')
+
+
+def ensure_dataset(positions: int, seed: int = 1, **kwargs) -> str:
+    # Generated databases are kept in the temp folder and reused by later runs with the same size and seed.
+    path = instance_path(positions, seed)
+    if os.path.exists(os.path.join(path, 'db.sqlite')):
+        return path
+
+    os.makedirs(path, exist_ok=True)
+    app = make_app('benchmark', instance_path=path)
+    with app.app_context():
+        try:
+            generate(DB(app).connection, positions, seed=seed, **kwargs)
+        except BaseException:
+            os.remove(os.path.join(path, 'db.sqlite'))
+            raise
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Generate a synthetic instance folder with a populated db.sqlite.')
+    parser.add_argument('size', help=f'number of positions or one of {", ".join(SIZES)}')
+    parser.add_argument('--instance', help='instance folder to create (default: a reusable one in the temp folder)')
+    parser.add_argument('--years', type=int, default=8)
+    parser.add_argument('--mean-per-file', type=float, default=20.0)
+    parser.add_argument('--invoiced-share', type=float, default=0.85)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    positions = parse_size(args.size)
+    path = args.instance or instance_path(positions, args.seed)
+    os.makedirs(path, exist_ok=True)
+    app = make_app('benchmark', instance_path=path)
+    with app.app_context():
+        start = time.perf_counter()
+        counts = generate(
+            DB(app).connection, positions, years=args.years, mean_per_file=args.mean_per_file,
+            invoiced_share=args.invoiced_share, seed=args.seed
+        )
+    counts['seconds'] = time.perf_counter() - start
+    counts['instance'] = path
+    report('synthetic', counts)
+
+
+if __name__ == '__main__':
+    main()
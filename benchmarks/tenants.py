@@ -0,0 +1,98 @@
+import argparse
+import multiprocessing
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from _common import summarize, report
+
+from flask import g
+from app import make_app
+from app.db import DB
+
+CONFIG = {'MULTI_USER': True}
+
+
+def worker_process(instance: str, pragmas: str, tenants: int, offset: int, threads: int, writes: int, results) -> None:
+    # One process per gunicorn worker; its threads write for users spread over the tenants.
+    app = make_app('benchmark', instance_path=instance, DB_PRAGMAS=pragmas, **CONFIG)
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(tenant: str) -> None:
+        local = []
+        local_errors = 0
+        with app.app_context():
+            g.tenant = tenant
+            database = DB(app)
+            for _ in range(writes):
+                start = time.perf_counter()
+                try:
+                    database.add_billing_position(datetime.now(), 'EP1000000', 300.0, 1.0, 300.0, 120.0)
+                except sqlite3.OperationalError:
+                    local_errors += 1
+                local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+            errors[0] += local_errors
+
+    clients = [threading.Thread(target=client, args=(f'user{(offset + index) % tenants}', )) for index in range(threads)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    results.put((samples, errors[0], app.extensions['write_queue'].stats()['writers']))
+
+
+def run(tenants: int, processes: int, threads: int, writes: int, pragmas: str) -> dict:
+    instance = tempfile.mkdtemp(prefix='billing-bench-')
+    app = make_app('benchmark', instance_path=instance, **CONFIG)
+    for index in range(tenants):
+        app.extensions['users'].add(f'user{index}', 'benchmark')
+        with app.app_context():
+            g.tenant = f'user{index}'
+            DB(app)
+
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=worker_process, args=(instance, pragmas, tenants, index * threads, threads, writes, results))
+        for index in range(processes)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    collected = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+
+    samples = [sample for worker_samples, _, _ in collected for sample in worker_samples]
+    summary = summarize(samples)
+    summary['writes_per_second'] = len(samples) / elapsed
+    summary['errors'] = sum(errors for _, errors, _ in collected)
+    summary['writers_per_process'] = max(writers for _, _, writers in collected)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Write throughput in multi-user mode as the same writes spread over more tenant databases.')
+    parser.add_argument('--tenants', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=200, help='writes per thread')
+    parser.add_argument('--synchronous', default='FULL', help='FULL makes every commit wait for fsync, the cost tenants no longer share')
+    args = parser.parse_args()
+
+    pragmas = f'synchronous={args.synchronous}'
+    report('tenants', {
+        f'{tenants}_tenants': run(tenants, args.processes, args.threads, args.writes, pragmas)
+        for tenants in args.tenants
+    })
+
+
+if __name__ == '__main__':
+    main()
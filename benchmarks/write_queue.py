@@ -0,0 +1,95 @@
+import argparse
+import multiprocessing
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from _common import summarize, report
+
+from app import make_app
+from app.db import DB
+
+
+def worker_process(instance: str, config: dict, threads: int, writes: int, results) -> None:
+    # One process per gunicorn worker, each with its own app (and write queue).
+    app = make_app('benchmark', instance_path=instance, **config)
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client() -> None:
+        local = []
+        local_errors = 0
+        with app.app_context():
+            database = DB(app)
+            for _ in range(writes):
+                start = time.perf_counter()
+                try:
+                    database.add_billing_position(datetime.now(), 'EP1000000', 300.0, 1.0, 300.0, 120.0)
+                except sqlite3.OperationalError:
+                    local_errors += 1
+                local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+            errors[0] += local_errors
+
+    clients = [threading.Thread(target=client) for _ in range(threads)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    queue = app.extensions['write_queue']
+    results.put((samples, errors[0], queue.stats() if queue is not None else None))
+
+
+def run(config: dict, processes: int, threads: int, writes: int) -> dict:
+    instance = tempfile.mkdtemp(prefix='billing-bench-')
+    make_app('benchmark', instance_path=instance)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=worker_process, args=(instance, config, threads, writes, results))
+        for _ in range(processes)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    collected = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+
+    samples = [sample for worker_samples, _, _ in collected for sample in worker_samples]
+    batches = sum(stats['batches'] for _, _, stats in collected if stats)
+    summary = summarize(samples)
+    summary['writes_per_second'] = len(samples) / elapsed
+    summary['errors'] = sum(errors for _, errors, _ in collected)
+    summary['transactions'] = batches or len(samples)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Write bursts from several processes, per-call commits versus the group-commit write queue.')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=3)
+    parser.add_argument('--writes', type=int, default=200, help='writes per thread')
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 2, 10], help='WRITE_QUEUE_WINDOW_MS values to compare')
+    parser.add_argument('--busy-timeout', type=int, default=5000)
+    parser.add_argument('--synchronous', default='NORMAL', help='FULL makes every commit wait for fsync, which group commit amortises')
+    args = parser.parse_args()
+
+    pragmas = f'busy_timeout={args.busy_timeout}, synchronous={args.synchronous}'
+    configurations = {'direct': {'WRITE_QUEUE': False, 'DB_PRAGMAS': pragmas}}
+    for window in args.windows:
+        configurations[f'write_queue_{window:g}ms'] = {'WRITE_QUEUE': True, 'WRITE_QUEUE_WINDOW_MS': window, 'DB_PRAGMAS': pragmas}
+
+    report('write_queue', {
+        name: run(config, args.processes, args.threads, args.writes)
+        for name, config in configurations.items()
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,105 @@
 import os
-from flask import Flask, render_template, current_app, request, redirect, url_for, flash
+import json
+from flask import Flask, render_template, current_app, request, redirect, url_for, flash, jsonify, g
+from . import db, backup, caching, instrumentation, write_queue, analytics, assets, jobs, auth
+from .utils import format_money
+from .caching import conditional
 from .db import DB
+from .backup import get_backup_manager
 
-def make_app(secret_key: str) -> Flask:
+def make_app(secret_key: str, instance_path: str | None = None, **config) -> Flask:
 
-    app = Flask(__name__)
+    app = Flask(__name__, instance_path=instance_path)
     app.secret_key = secret_key.encode('utf-8')
+    # FLASK_DB_PROFILE=wal becomes app.config['DB_PROFILE'], values are parsed as JSON where possible.
+    app.config.from_prefixed_env()
+    app.config.update(config)
 
     if not os.path.exists(app.instance_path):
         os.mkdir(app.instance_path)
 
+    db.init_app(app)
+    auth.init_app(app)
+    write_queue.init_app(app)
+    backup.init_app(app)
+    caching.init_app(app)
+    instrumentation.init_app(app)
+    analytics.init_app(app)
+    jobs.init_app(app)
+    app.add_template_filter(format_money, 'money')
+    assets.init_app(app)
+
+    from . import commands
+    commands.register(app)
+
     from . import billing
     billing.register(app)
 
     from . import invoicing
     invoicing.register(app)
 
+    from . import files
+    files.register(app)
+
+    from . import dashboard
+    dashboard.register(app)
+
+    from . import export
+    export.register(app)
+
+    from . import search
+    search.register(app)
+
+    from . import api
+    api.register(app)
+
     @app.route('/')
+    @conditional(key=lambda: json.dumps(get_backup_manager(current_app).status(), sort_keys=True))
     def home():
         database = DB(current_app)
 
         return render_template(
             'home.html.jinja2',
-            statistics=database.get_statistics()
+            load_statistics=database.get_statistics,
+            backup_status=get_backup_manager(current_app).status()
         )
 
-    @app.route('/backup', methods=['GET', 'POST'])
-    def backup():
+    @app.route('/backup', methods=['GET', 'POST'], endpoint='backup')
+    def start_backup():
         if request.method == 'POST':
-            database = DB(current_app)
-            if not database.backup():
-                flash(('error', 'DB backup failed (you can only backup every 30 minutes).'))
+            backup_manager = get_backup_manager(current_app)
+            job_queue = current_app.extensions['jobs']
+            # With job workers running the backup runs there instead of in a thread of this worker.
+            if job_queue.available():
+                job_queue.submit('backup', tenant=g.get('tenant'))
+                flash(('info', 'DB backup queued.'))
+            elif backup_manager.start():
+                flash(('info', 'DB backup started.'))
+            else:
+                flash(('error', f'DB backup failed (a backup is running or you can only backup every {backup_manager.interval // 60} minutes).'))
         return redirect(url_for('home'))
-        
+
+    @app.route('/cache/stats')
+    def cache_stats():
+        store = current_app.extensions['fragment_cache']
+        if store is None:
+            return jsonify({'enabled': False})
+        return jsonify({'enabled': True, 'entries': len(store), **store.stats.as_dict()})
+
+    @app.route('/backup/status')
+    def backup_status():
+        return jsonify(get_backup_manager(current_app).status())
+
+    @app.route('/write-queue/stats')
+    def write_queue_stats():
+        queue = current_app.extensions['write_queue']
+        if queue is None:
+            return jsonify({'enabled': False})
+        return jsonify({'enabled': True, **queue.stats()})
+
+    # Compiled once in the (preloaded) master rather than on the first request of every worker;
+    # after all filters and globals are registered, which Jinja resolves at compile time.
+    if app.config.get('PRECOMPILE_TEMPLATES', False):
+        assets.precompile_templates(app)
 
     return app
@@ -0,0 +1,172 @@
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+import numpy as np
+from flask import Flask
+from .db import DB
+
+# Months covered by the rolling trends.
+ROLLING_MONTHS = 12
+# Files listed in the invoicing gap ranking.
+GAP_FILES = 20
+
+
+class PositionColumns(NamedTuple):
+    # The billing positions as one array per column, amounts in cents. files holds the distinct
+    # files in order, file_index the position of each row's file in it.
+    files: np.ndarray
+    file_index: np.ndarray
+    month: np.ndarray
+    billed_hours: np.ndarray
+    billed: np.ndarray
+    earned: np.ndarray
+    invoiced: np.ndarray
+    is_billed: np.ndarray
+    is_invoiced: np.ndarray
+
+
+def load_columns(database: DB) -> PositionColumns:
+    files, months, billed_hours, billed, earned, invoiced, is_billed, is_invoiced = list(zip(*database.get_analytics_rows())) or [()] * 8
+    files = np.array(files, dtype=object)
+    # Rows are ordered by file, a new file starts wherever it differs from the previous row.
+    starts = np.concatenate((np.ones(min(len(files), 1), dtype=bool), files[1:] != files[:-1]))
+    months = np.array(months, dtype=np.int64)
+    return PositionColumns(
+        files=files[starts],
+        file_index=np.cumsum(starts) - 1,
+        # Consecutive month numbers (YYYYMM → year * 12 + month - 1), so months can index arrays.
+        month=months // 100 * 12 + months % 100 - 1,
+        billed_hours=np.array(billed_hours, dtype=np.float64),
+        billed=np.array(billed, dtype=np.int64),
+        earned=np.array(earned, dtype=np.int64),
+        invoiced=np.array(invoiced, dtype=np.int64),
+        is_billed=np.array(is_billed, dtype=bool),
+        is_invoiced=np.array(is_invoiced, dtype=bool),
+    )
+
+
+def ratio(numerator: np.ndarray, denominator: np.ndarray) -> list[float | None]:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = numerator / denominator
+    return [float(value) if np.isfinite(value) else None for value in values]
+
+
+def rolling(values: np.ndarray, window: int) -> np.ndarray:
+    # Sum over the current and the window - 1 preceding months, from a running total.
+    totals = np.concatenate(([0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    return totals[ends] - totals[np.maximum(ends - window, 0)]
+
+
+def monthly_metrics(columns: PositionColumns) -> list[dict]:
+    # One row per calendar month from the first to the last position, months without positions included.
+    if not len(columns.month):
+        return []
+    first = columns.month.min()
+    count = columns.month.max() - first + 1
+    index = columns.month - first
+
+    def per_month(weights: np.ndarray | None = None) -> np.ndarray:
+        return np.bincount(index, weights=weights, minlength=count)
+
+    positions = per_month()
+    billed_hours = per_month(columns.billed_hours)
+    billed = per_month(columns.billed)
+    earned = per_month(columns.earned)
+    invoiced = per_month(columns.invoiced)
+    # The realization rate only compares positions that were billed, fixed fees have nothing to compare to.
+    earned_billed = per_month(np.where(columns.is_billed, columns.earned, 0))
+
+    rolling_billed = rolling(billed, ROLLING_MONTHS)
+    rolling_earned = rolling(earned, ROLLING_MONTHS)
+    months = first + np.arange(count)
+    return [
+        {
+            'month': f'{month // 12:04d}-{month % 12 + 1:02d}',
+            'count_positions': int(count_positions),
+            'billed_hours': float(hours),
+            'total_billed': float(billed_cents) / 100,
+            'total_earned': float(earned_cents) / 100,
+            'total_invoiced': float(invoiced_cents) / 100,
+            'realization_rate': realization_rate,
+            'rolling_billed': float(rolling_billed_cents) / 100,
+            'rolling_earned': float(rolling_earned_cents) / 100,
+            'rolling_realization_rate': rolling_realization_rate,
+        }
+        for month, count_positions, hours, billed_cents, earned_cents, invoiced_cents, realization_rate,
+            rolling_billed_cents, rolling_earned_cents, rolling_realization_rate in zip(
+            months, positions, billed_hours, billed, earned, invoiced, ratio(earned_billed, billed),
+            rolling_billed, rolling_earned, ratio(rolling(earned_billed, ROLLING_MONTHS), rolling_billed)
+        )
+    ]
+
+
+def file_gaps(columns: PositionColumns, limit: int = GAP_FILES) -> list[dict]:
+    # Per file, the invoiced amount against the amount earned on invoiced positions, and what is
+    # earned but not invoiced yet. Files invoiced furthest below their earnings come first.
+    if not len(columns.files):
+        return []
+    count = len(columns.files)
+
+    def per_file(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(columns.file_index, weights=weights, minlength=count)
+
+    earned_invoiced = per_file(np.where(columns.is_invoiced, columns.earned, 0))
+    invoiced = per_file(columns.invoiced)
+    open_earned = per_file(np.where(columns.is_invoiced, 0, columns.earned))
+    gap = invoiced - earned_invoiced
+
+    order = np.lexsort((columns.files, -open_earned, gap))[:limit]
+    return [
+        {
+            'file': columns.files[index],
+            'earned_invoiced': float(earned_invoiced[index]) / 100,
+            'total_invoiced': float(invoiced[index]) / 100,
+            'gap': float(gap[index]) / 100,
+            'open_earned': float(open_earned[index]) / 100,
+        }
+        for index in order
+    ]
+
+
+class Analytics:
+    # Per-process cache of the position columns and the metrics computed from them, valid as long as
+    # the database change version is unchanged. Kept for the max_databases most recently used databases.
+
+    def __init__(self, max_databases: int = 8) -> None:
+        self.max_databases = max_databases
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.loads = 0
+
+    def entry(self, database: DB) -> dict:
+        # The version is read before the rows: a change committed in between only causes one more reload.
+        version = database.get_change_version()
+        with self._lock:
+            entry = self._entries.pop(database.db_path, None)
+            if entry is None or entry['version'] != version:
+                entry = {'version': version, 'columns': load_columns(database), 'metrics': None}
+                self.loads += 1
+            self._entries[database.db_path] = entry
+            while len(self._entries) > self.max_databases:
+                self._entries.popitem(last=False)
+            return entry
+
+    def columns(self, database: DB) -> PositionColumns:
+        return self.entry(database)['columns']
+
+    def metrics(self, database: DB) -> dict:
+        entry = self.entry(database)
+        with self._lock:
+            if entry['metrics'] is None:
+                columns = entry['columns']
+                entry['metrics'] = {
+                    'count_positions': len(columns.month),
+                    'months': monthly_metrics(columns),
+                    'file_gaps': file_gaps(columns),
+                }
+            return entry['metrics']
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['analytics'] = Analytics()
@@ -0,0 +1,326 @@
+import gzip
+from datetime import datetime
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, url_for
+from werkzeug.exceptions import HTTPException
+from .db import DB, BillingPosition, Invoice
+from .caching import conditional
+from .billing import PAGE_SIZE, MAX_PAGE_SIZE, parse_cursor, format_cursor, parse_date_filter, parse_billing_position
+from .utils import optional_decimal, optional_int
+
+# Responses smaller than this are sent uncompressed, gzip would barely save anything.
+GZIP_MIN_SIZE = 1024
+MAX_BATCH_SIZE = 10000
+# parse_billing_position takes form values: text fields must be strings, amounts may also be numbers.
+TEXT_FIELDS = ('date', 'file')
+NUMBER_FIELDS = ('hourly_rate', 'billed_hours', 'earned_percentage', 'earned_amount')
+
+class APIError(Exception):
+
+    def __init__(self, status: int, message: str, errors: list | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.errors = errors
+
+def billing_position_json(billing_position: BillingPosition) -> dict:
+    values = billing_position._asdict()
+    values['date'] = billing_position.date.isoformat()
+    return values
+
+def invoice_json(invoice: Invoice) -> dict:
+    values = invoice._asdict()
+    values['date'] = invoice.date.isoformat()
+    return values
+
+def json_body(kind: type = dict):
+    body = request.get_json(silent=True)
+    if not isinstance(body, kind):
+        raise APIError(400, f'Expected a JSON {"array" if kind is list else "object"} as request body')
+    if kind is list and len(body) > MAX_BATCH_SIZE:
+        raise APIError(400, f'A batch may contain at most {MAX_BATCH_SIZE} items')
+    return body
+
+def parse_id(value) -> int | None:
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+def field_type_error(item: dict) -> str | None:
+    for name in TEXT_FIELDS:
+        if item.get(name) is not None and not isinstance(item[name], str):
+            return f'The {name} must be a string'
+    for name in NUMBER_FIELDS:
+        if item.get(name) is not None and (isinstance(item[name], bool) or not isinstance(item[name], (str, int, float))):
+            return f'The {name} must be a number'
+    return None
+
+def parse_billing_positions(items: list, with_id: bool = False) -> list[dict]:
+    # Validates the whole batch before anything is written, so errors are reported for every item at once.
+    billing_positions = []
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': 'Expected a JSON object'})
+            continue
+        error = field_type_error(item)
+        if error is not None:
+            errors.append({'index': index, 'error': error})
+            continue
+        billing_position, error = parse_billing_position(item)
+        if error is None and with_id:
+            billing_position['id'] = parse_id(item.get('id'))
+            if billing_position['id'] is None:
+                error = 'The id is missing'
+        if error is not None:
+            errors.append({'index': index, 'error': error})
+            continue
+        billing_positions.append(billing_position)
+
+    if errors:
+        raise APIError(400, 'Invalid billing positions', errors)
+    return billing_positions
+
+def parse_ids(items: list) -> list[int]:
+    ids = [parse_id(item) for item in items]
+    errors = [{'index': index, 'error': 'Expected an integer id'} for index, id in enumerate(ids) if id is None]
+    if errors:
+        raise APIError(400, 'Invalid ids', errors)
+    return ids
+
+def require_billing_positions(database: DB, ids: list[int]) -> None:
+    found = {billing_position.id for billing_position in database.get_billing_positions(ids)}
+    missing = [id for id in ids if id not in found]
+    if missing:
+        raise APIError(404, 'Billing positions not found', [{'id': id} for id in missing])
+
+def parse_date(value) -> datetime:
+    try:
+        return datetime.strptime(value if isinstance(value, str) else '', '%Y-%m-%d')
+    except ValueError:
+        raise APIError(400, f'The date of {value} is incorrect')
+
+def register(app: Flask) -> Blueprint:
+    bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+    @bp.errorhandler(APIError)
+    def api_error(error: APIError):
+        body = {'error': error.message}
+        if error.errors is not None:
+            body['errors'] = error.errors
+        return jsonify(body), error.status
+
+    @bp.errorhandler(HTTPException)
+    def http_error(error: HTTPException):
+        return jsonify(error=error.description), error.code
+
+    @bp.after_request
+    def compress(response: Response) -> Response:
+        if (
+            response.direct_passthrough
+            or 'gzip' not in request.accept_encodings
+            or 'Content-Encoding' in response.headers
+            or response.content_length is None
+            or response.content_length < GZIP_MIN_SIZE
+        ):
+            return response
+
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    # BILLING POSITIONS
+
+    @bp.route('/billing_positions', methods=['GET'])
+    @conditional
+    def list_billing_positions():
+        database = DB(current_app)
+
+        limit = optional_int(request.args.get('limit', ''))
+        limit = min(max(limit or PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        billing_positions, older, newer = database.get_billing_positions_page(
+            limit,
+            after=parse_cursor(request.args.get('after')),
+            before=parse_cursor(request.args.get('before')),
+            file=request.args.get('file', '').replace(' ', '') or None,
+            date_from=parse_date_filter(request.args.get('date_from')),
+            date_to=parse_date_filter(request.args.get('date_to'))
+        )
+        return jsonify(
+            billing_positions=[billing_position_json(b) for b in billing_positions],
+            before=format_cursor(older),
+            after=format_cursor(newer)
+        )
+
+    @bp.route('/billing_positions', methods=['POST'])
+    def create_billing_position():
+        database = DB(current_app)
+
+        billing_position, = parse_billing_positions([json_body()])
+        id = database.add_billing_position(**billing_position)
+        response = jsonify(billing_position_json(database.get_billing_position(id)))
+        response.status_code = 201
+        response.headers['Location'] = url_for('.get_billing_position', billing_position_id=id)
+        return response
+
+    @bp.route('/billing_positions/<int:billing_position_id>', methods=['GET'])
+    @conditional
+    def get_billing_position(billing_position_id: int):
+        billing_position = DB(current_app).get_billing_position(billing_position_id)
+        if billing_position is None:
+            raise APIError(404, 'Billing position not found')
+        return jsonify(billing_position_json(billing_position))
+
+    @bp.route('/billing_positions/<int:billing_position_id>', methods=['PUT'])
+    def update_billing_position(billing_position_id: int):
+        database = DB(current_app)
+
+        billing_position, = parse_billing_positions([json_body()])
+        with database.transaction():
+            require_billing_positions(database, [billing_position_id])
+            database.update_billing_position(billing_position_id, **billing_position)
+        return jsonify(billing_position_json(database.get_billing_position(billing_position_id)))
+
+    @bp.route('/billing_positions/<int:billing_position_id>', methods=['DELETE'])
+    def remove_billing_position(billing_position_id: int):
+        database = DB(current_app)
+
+        with database.transaction():
+            require_billing_positions(database, [billing_position_id])
+            database.remove_billing_position(billing_position_id)
+        return '', 204
+
+    @bp.route('/billing_positions/batch', methods=['POST'])
+    def create_billing_positions():
+        database = DB(current_app)
+
+        billing_positions = parse_billing_positions(json_body(list))
+        with database.transaction():
+            ids = [database.add_billing_position(**billing_position) for billing_position in billing_positions]
+        return jsonify(ids=ids), 201
+
+    @bp.route('/billing_positions/batch', methods=['PUT'])
+    def update_billing_positions():
+        database = DB(current_app)
+
+        billing_positions = parse_billing_positions(json_body(list), with_id=True)
+        with database.transaction():
+            require_billing_positions(database, [billing_position['id'] for billing_position in billing_positions])
+            updated = database.update_billing_positions(billing_positions)
+        return jsonify(updated=updated)
+
+    @bp.route('/billing_positions/batch', methods=['DELETE'])
+    def remove_billing_positions():
+        database = DB(current_app)
+
+        ids = parse_ids(json_body(list))
+        with database.transaction():
+            require_billing_positions(database, ids)
+            removed = database.remove_billing_positions(ids)
+        return jsonify(removed=removed)
+
+    # INVOICES
+
+    @bp.route('/invoices', methods=['GET'])
+    @conditional
+    def list_invoices():
+        return jsonify(invoices=[invoice_json(invoice) for invoice in DB(current_app).get_all_invoices()])
+
+    @bp.route('/invoices', methods=['POST'])
+    def create_invoice():
+        database = DB(current_app)
+
+        id = database.add_invoice(parse_date(json_body().get('date')))
+        response = jsonify(invoice_json(database.get_invoice(id)))
+        response.status_code = 201
+        response.headers['Location'] = url_for('.get_invoice', invoice_id=id)
+        return response
+
+    @bp.route('/invoices/<int:invoice_id>', methods=['GET'])
+    @conditional
+    def get_invoice(invoice_id: int):
+        database = DB(current_app)
+
+        invoice = database.get_invoice(invoice_id)
+        if invoice is None:
+            raise APIError(404, 'Invoice not found')
+        return jsonify(
+            **invoice_json(invoice),
+            billing_positions=[billing_position_json(b) for b in database.get_invoiced_billing_positions(invoice_id)]
+        )
+
+    @bp.route('/invoices/<int:invoice_id>', methods=['PUT'])
+    def update_invoice(invoice_id: int):
+        database = DB(current_app)
+
+        date = parse_date(json_body().get('date'))
+        with database.transaction():
+            if database.get_invoice(invoice_id) is None:
+                raise APIError(404, 'Invoice not found')
+            if database.get_invoice_archive(invoice_id) is not None:
+                raise APIError(409, 'Invoice is archived')
+            database.update_invoice(invoice_id, date)
+        return jsonify(invoice_json(database.get_invoice(invoice_id)))
+
+    @bp.route('/invoices/<int:invoice_id>', methods=['DELETE'])
+    def remove_invoice(invoice_id: int):
+        database = DB(current_app)
+
+        if database.get_invoice(invoice_id) is None:
+            raise APIError(404, 'Invoice not found')
+        if database.get_invoice_archive(invoice_id) is not None:
+            raise APIError(409, 'Invoice is archived')
+        database.remove_invoice(invoice_id)
+        return '', 204
+
+    @bp.route('/invoices/<int:invoice_id>/billing_positions', methods=['POST'])
+    def invoice_billing_positions(invoice_id: int):
+        # Takes [{"id": ..., "invoiced_amount": ...}, ...] and books all amounts on the invoice at once.
+        database = DB(current_app)
+
+        invoiced_amounts = []
+        errors = []
+        for index, item in enumerate(json_body(list)):
+            id = parse_id(item.get('id')) if isinstance(item, dict) else None
+            invoiced_amount = optional_decimal(item.get('invoiced_amount')) if isinstance(item, dict) else None
+            if id is None or invoiced_amount is None:
+                errors.append({'index': index, 'error': 'Expected an integer id and a numeric invoiced_amount'})
+                continue
+            invoiced_amounts.append((id, invoiced_amount))
+        if errors:
+            raise APIError(400, 'Invalid invoiced amounts', errors)
+
+        with database.transaction():
+            if database.get_invoice(invoice_id) is None:
+                raise APIError(404, 'Invoice not found')
+            if database.get_invoice_archive(invoice_id) is not None:
+                raise APIError(409, 'Invoice is archived')
+            require_billing_positions(database, [id for id, _ in invoiced_amounts])
+            database.invoice_billing_positions(invoiced_amounts, invoice_id)
+        return jsonify(invoice_json(database.get_invoice(invoice_id)))
+
+    @bp.route('/invoices/batch', methods=['POST'])
+    def create_invoices():
+        database = DB(current_app)
+
+        dates = [parse_date(item.get('date') if isinstance(item, dict) else None) for item in json_body(list)]
+        with database.transaction():
+            ids = [database.add_invoice(date) for date in dates]
+        return jsonify(ids=ids), 201
+
+    @bp.route('/invoices/batch', methods=['DELETE'])
+    def remove_invoices():
+        database = DB(current_app)
+
+        ids = parse_ids(json_body(list))
+        with database.transaction():
+            missing = [id for id in ids if database.get_invoice(id) is None]
+            if missing:
+                raise APIError(404, 'Invoices not found', [{'id': id} for id in missing])
+            archived = [id for id in ids if database.get_invoice_archive(id) is not None]
+            if archived:
+                raise APIError(409, 'Invoices are archived', [{'id': id} for id in archived])
+            for id in ids:
+                database.remove_invoice(id)
+        return jsonify(removed=len(ids))
+
+    app.register_blueprint(bp)
+    return bp
@@ -0,0 +1,170 @@
+import os
+import time
+import sqlite3
+from datetime import date
+from urllib.parse import quote
+from .db import DB
+from . import migrations
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE invoices (
+        id integer PRIMARY KEY,
+        date integer NOT NULL
+    );
+    CREATE TABLE billing_positions (
+        id integer PRIMARY KEY,
+        date integer NOT NULL,
+        file text NOT NULL,
+        hourly_rate real,
+        billed_hours real,
+        billed_cents integer,
+        earned_cents integer NOT NULL,
+        invoiced_cents integer,
+        invoice_id integer,
+        FOREIGN KEY(invoice_id) REFERENCES invoices(id)
+    );
+'''
+
+TOTALS = '''
+    SELECT count(id), IFNULL(sum(billed_cents), 0), IFNULL(sum(earned_cents), 0), IFNULL(sum(invoiced_cents), 0),
+        count(DISTINCT invoice_id)
+    FROM {schema}billing_positions
+    WHERE date BETWEEN ? AND ?;
+'''
+
+
+def check_closed(database: DB, year: int, first: int, last: int) -> None:
+    # A year is closed once it is over and every position is booked on an invoice that only holds
+    # positions of that year. Years are archived oldest first, so all hot positions stay newer.
+    if year >= date.today().year:
+        raise ValueError(f'{year} is not over yet')
+    _, rows = database.execute('SELECT 1 FROM archives WHERE year = ?;', (year, ))
+    if rows:
+        raise ValueError(f'{year} is already archived')
+    _, rows = database.execute('SELECT min(date) FROM billing_positions;')
+    if rows[0][0] is None or rows[0][0] > last:
+        raise ValueError(f'There are no billing positions in {year}')
+    if rows[0][0] < first:
+        raise ValueError(f'{rows[0][0] // 10000} has to be archived before {year}')
+
+    _, rows = database.execute('''
+        SELECT count(id)
+        FROM billing_positions
+        WHERE date BETWEEN ? AND ? AND invoice_id IS NULL;
+    ''', (first, last))
+    if rows[0][0]:
+        raise ValueError(f'{rows[0][0]} billing position(s) of {year} are not invoiced')
+    _, rows = database.execute('''
+        SELECT count(id)
+        FROM billing_positions
+        WHERE invoice_id IN (SELECT invoice_id FROM billing_positions WHERE date BETWEEN ? AND ?) AND date > ?;
+    ''', (first, last, last))
+    if rows[0][0]:
+        raise ValueError(f'Invoices of {year} also hold {rows[0][0]} billing position(s) of later years')
+
+
+def write_archive(database: DB, path: str, first: int, last: int) -> tuple:
+    # Copies the year into a new file next to path through a second connection, which reads the hot
+    # database's last commit; the caller's transaction holds the write lock, so nothing changes meanwhile.
+    partial_path = f'{path}.partial'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    archive = sqlite3.connect(partial_path, uri=True)
+    try:
+        archive.executescript(ARCHIVE_SCHEMA)
+        cursor = archive.cursor()
+        migrations.add_indexes(cursor)
+        migrations.add_file_index(cursor)
+        migrations.drop_open_index(cursor)
+        cursor.execute(f'PRAGMA user_version = {len(migrations.MIGRATIONS)};')
+
+        cursor.execute('ATTACH DATABASE ? AS hot;', (f'file:{quote(database.db_path)}?mode=ro', ))
+        cursor.execute('''
+            INSERT INTO invoices (id, date)
+            SELECT id, date
+            FROM hot.invoices
+            WHERE id IN (SELECT invoice_id FROM hot.billing_positions WHERE date BETWEEN ? AND ?)
+            ORDER BY id;
+        ''', (first, last))
+        cursor.execute('''
+            INSERT INTO billing_positions (id, date, file, hourly_rate, billed_hours, billed_cents, earned_cents, invoiced_cents, invoice_id)
+            SELECT id, date, file, hourly_rate, billed_hours, billed_cents, earned_cents, invoiced_cents, invoice_id
+            FROM hot.billing_positions
+            WHERE date BETWEEN ? AND ?
+            ORDER BY id;
+        ''', (first, last))
+        archive.commit()
+
+        expected = cursor.execute(TOTALS.format(schema='hot.'), (first, last)).fetchone()
+        archived = cursor.execute(TOTALS.format(schema=''), (first, last)).fetchone()
+        count_invoices, = cursor.execute('SELECT count(id) FROM invoices;').fetchone()
+        cursor.execute('DETACH DATABASE hot;')
+        if archived != expected or count_invoices != archived[4]:
+            raise sqlite3.IntegrityError(f'Archive does not match the hot database: {archived} != {expected}')
+        if cursor.execute('PRAGMA foreign_key_check;').fetchall():
+            raise sqlite3.IntegrityError('Archive references missing invoices')
+    except BaseException:
+        archive.close()
+        os.remove(partial_path)
+        raise
+    archive.close()
+
+    # The archive is attached with immutable=1 later on, so it has to be complete and final on disk.
+    with open(partial_path, 'rb') as archive_file:
+        os.fsync(archive_file.fileno())
+    os.chmod(partial_path, 0o444)
+    os.replace(partial_path, path)
+    directory = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    return archived
+
+
+def archive_year(database: DB, year: int) -> dict:
+    # Moves the positions of a closed year and their invoices into instance/archive/<year>.sqlite and
+    # records the year's totals and invoices in the hot database, where statistics and invoice
+    # listings read them without attaching the archive. Raises ValueError if the year is not closed.
+    first, last = year * 10000, year * 10000 + 9999
+    path = database.archive_path(year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with database.transaction():
+        check_closed(database, year, first, last)
+        # A file left over by an earlier attempt is not listed in archives and simply replaced.
+        if os.path.exists(path):
+            os.remove(path)
+        count_positions, billed, earned, invoiced, count_invoices = write_archive(database, path, first, last)
+
+        database.invalidate('statistics', 'billing', 'invoices')
+        database.execute('''
+            INSERT INTO archives (year, count_positions, count_invoices, max_position_id, max_invoice_id, created)
+            VALUES (?, ?, ?, (SELECT max(id) FROM billing_positions), (SELECT max(id) FROM invoices), ?);
+        ''', (year, count_positions, count_invoices, round(time.time())))
+        database.execute('''
+            INSERT INTO archived_statistics (year, count_positions, billed_cents, earned_cents, invoiced_cents)
+            VALUES (?, ?, ?, ?, ?);
+        ''', (year, count_positions, billed, earned, invoiced))
+        database.execute('''
+            INSERT INTO archived_invoices (id, year, date, total_cents)
+            SELECT invoices.id, ?, invoices.date, (
+                SELECT IFNULL(sum(billing_positions.invoiced_cents), 0)
+                FROM billing_positions
+                WHERE billing_positions.invoice_id = invoices.id
+            )
+            FROM invoices
+            WHERE invoices.id IN (SELECT invoice_id FROM billing_positions WHERE date BETWEEN ? AND ?);
+        ''', (year, first, last))
+        # The billing_summaries_* triggers take the year out of billing_statistics and billing_files.
+        database.execute('DELETE FROM billing_positions WHERE date BETWEEN ? AND ?;', (first, last))
+        database.execute('DELETE FROM invoices WHERE id IN (SELECT id FROM archived_invoices WHERE year = ?);', (year, ), commit=True)
+
+    return {
+        'year': year,
+        'file': path,
+        'count_positions': count_positions,
+        'count_invoices': count_invoices,
+        'size': os.path.getsize(path),
+    }
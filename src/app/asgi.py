@@ -0,0 +1,116 @@
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from flask import Flask
+
+# Request bodies above this size are spooled to disk while they are received.
+MAX_MEMORY_BODY = 64 * 1024
+
+class WSGIToASGI:
+    # Serves the Flask app under an ASGI server. Connections, request bodies and sending the
+    # response are handled by the event loop; the view runs on one of `threads` request threads,
+    # which with DB_EXECUTOR only wait for the DB executor, so they can be plentiful.
+    # Unlike asgiref's WsgiToAsgi, requests are not funnelled through a single thread and the
+    # response iterable is closed, which ends stream_with_context exports on disconnects.
+
+    def __init__(self, app: Flask, threads: int = 32) -> None:
+        self.app = app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope {scope["type"]}')
+
+        with SpooledTemporaryFile(max_size=MAX_MEMORY_BODY) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.run_wsgi, loop, scope, body, send)
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                executor = self.app.extensions.get('db_executor')
+                if executor is not None:
+                    executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run_wsgi(self, loop: asyncio.AbstractEventLoop, scope: dict, body, send) -> None:
+        def send_sync(message: dict) -> None:
+            # Blocks the request thread until the event loop has handed the chunk to the transport.
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start = {}
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info=None) -> None:
+            if exc_info is not None and start.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            start['message'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+            }
+
+        iterable = self.app.wsgi_app(environ(scope, body), start_response)
+        try:
+            for chunk in iterable:
+                if not chunk:
+                    continue
+                if not start.get('sent'):
+                    send_sync(start['message'])
+                    start['sent'] = True
+                send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not start.get('sent'):
+                send_sync(start['message'])
+            send_sync({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+
+def environ(scope: dict, body) -> dict:
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
@@ -0,0 +1,121 @@
+import os
+import gzip
+import json
+import hashlib
+import mimetypes
+from jinja2 import FileSystemBytecodeCache
+from flask import Flask, Blueprint, current_app, request, send_from_directory, url_for, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Fingerprinted assets never change under their name, browsers may keep them for a year.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Variants tried in order of preference, by Accept-Encoding token.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class AssetManifest:
+    # Copies every file of the static folder to instance/assets/<name>.<hash>.<ext> together with
+    # gzip and (if the brotli module is installed) brotli compressed variants, and maps the original
+    # names to the fingerprinted ones. Files that already exist are kept, so a restart only hashes.
+
+    def __init__(self, static_folder: str, asset_folder: str) -> None:
+        self.static_folder = static_folder
+        self.asset_folder = asset_folder
+        self.files = {}
+        self.names = set()
+
+    def build(self) -> dict:
+        os.makedirs(self.asset_folder, exist_ok=True)
+        files = {}
+        for root, _, names in os.walk(self.static_folder):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as asset_file:
+                    content = asset_file.read()
+                stem, extension = os.path.splitext(filename)
+                fingerprinted = f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+                self.write(fingerprinted, content)
+                files[filename] = fingerprinted
+
+        self.files = files
+        self.names = set(files.values())
+        self.write('manifest.json', json.dumps(files, indent=2, sort_keys=True).encode('utf-8'), compress=False, replace=True)
+        return files
+
+    def write(self, name: str, content: bytes, compress: bool = True, replace: bool = False) -> None:
+        path = os.path.join(self.asset_folder, name)
+        variants = [(path, content)]
+        if compress:
+            variants.append((f'{path}.gz', gzip.compress(content, compresslevel=9, mtime=0)))
+            if brotli is not None:
+                variants.append((f'{path}.br', brotli.compress(content)))
+
+        for variant_path, variant in variants:
+            if os.path.exists(variant_path) and not replace:
+                continue
+            os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+            # Written under a temporary name first, several workers may build at the same time.
+            partial_path = f'{variant_path}.{os.getpid()}'
+            with open(partial_path, 'wb') as variant_file:
+                variant_file.write(variant)
+            os.replace(partial_path, variant_path)
+
+    def url(self, filename: str) -> str:
+        # Falls back to the plain static route for files added after the manifest was built.
+        if filename in self.files:
+            return url_for('assets.asset', name=self.files[filename])
+        return url_for('static', filename=filename)
+
+
+def precompile_templates(app: Flask) -> int:
+    # Compiles every template once: into Jinja's in-memory cache (inherited by workers forked from a
+    # preloaded master) and, with the bytecode cache enabled, into instance/jinja_cache for the next start.
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.jinja2'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def register(app: Flask) -> Blueprint:
+    bp = Blueprint('assets', __name__, url_prefix='/assets')
+
+    @bp.route('/<path:name>')
+    def asset(name: str):
+        manifest = current_app.extensions['assets']
+        if name not in manifest.names:
+            abort(404)
+
+        accepted = request.accept_encodings
+        for encoding, suffix in ENCODINGS:
+            if accepted[encoding] and os.path.exists(os.path.join(manifest.asset_folder, name + suffix)):
+                response = send_from_directory(manifest.asset_folder, name + suffix, mimetype=mimetypes.guess_type(name)[0], etag=True)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(manifest.asset_folder, name, etag=True)
+
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.register_blueprint(bp)
+    return bp
+
+
+def init_app(app: Flask) -> None:
+    if app.config.get('TEMPLATE_BYTECODE_CACHE', True):
+        cache_folder = os.path.join(app.instance_path, 'jinja_cache')
+        os.makedirs(cache_folder, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_folder)
+
+    manifest = AssetManifest(app.static_folder, os.path.join(app.instance_path, 'assets'))
+    if app.config.get('STATIC_ASSETS', True):
+        manifest.build()
+    app.extensions['assets'] = manifest
+    app.add_template_global(manifest.url, 'asset_url')
+    register(app)
@@ -0,0 +1,144 @@
+import os
+import re
+import time
+import sqlite3
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from flask import Flask, Blueprint, current_app, request, session, g, render_template, redirect, url_for, flash, jsonify
+from .db import database_path
+from .utils import hash_password, check_password
+
+# User names double as the name of the user's folder in instance/tenants.
+USER_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+# Reachable without signing in.
+PUBLIC_ENDPOINTS = {'auth.login', 'static', 'assets.asset', 'metrics'}
+# Answer 401 instead of redirecting to the login page.
+JSON_BLUEPRINTS = {'api', 'jobs'}
+# The signing key of launch.py and launch_asgi.py without FLASK_SECRET; it is public, so anyone could
+# sign a session for any user with it.
+DEFAULT_SECRET = '_DEFAULT_SECRET_'
+
+
+class UserStore:
+    # The users of multi-user mode in instance/users.sqlite, with short-lived connections like the
+    # job queue. Each user's billing data lives in their own database, see db.database_path.
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with self.connection() as connection:
+            connection.execute('PRAGMA journal_mode = WAL;')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    name text PRIMARY KEY,
+                    password text NOT NULL,
+                    created real NOT NULL
+                );
+            ''')
+
+    @contextmanager
+    def connection(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def add(self, name: str, password: str) -> None:
+        if not USER_NAME.match(name):
+            raise ValueError('User names consist of lower case letters, digits, "_" and "-"')
+        try:
+            with self.connection() as connection:
+                connection.execute('INSERT INTO users (name, password, created) VALUES (?, ?, ?);', (name, hash_password(password), time.time()))
+        except sqlite3.IntegrityError:
+            raise ValueError(f'User "{name}" already exists')
+
+    def set_password(self, name: str, password: str) -> None:
+        with self.connection() as connection:
+            if connection.execute('UPDATE users SET password = ? WHERE name = ?;', (hash_password(password), name)).rowcount == 0:
+                raise ValueError(f'Unknown user "{name}"')
+
+    def verify(self, name: str, password: str) -> bool:
+        with self.connection() as connection:
+            row = connection.execute('SELECT password FROM users WHERE name = ?;', (name, )).fetchone()
+        if row is None:
+            # Hashed anyway, so unknown names take as long as wrong passwords.
+            hash_password(password)
+            return False
+        return check_password(row[0], password)
+
+    def names(self) -> list[str]:
+        with self.connection() as connection:
+            return [name for name, in connection.execute('SELECT name FROM users ORDER BY name;')]
+
+
+def local_target(target: str) -> bool:
+    # Only paths of this site: browsers read "/\evil.com" as "//evil.com", so backslashes are refused too.
+    parts = urlsplit(target)
+    return target.startswith('/') and '\\' not in target and not parts.scheme and not parts.netloc
+
+
+def open_tenant(app: Flask) -> None:
+    # Creates and migrates the signed in user's database, so their folder exists for backups too.
+    app.extensions['db_pools'].get(database_path(app))
+
+
+def select_tenant():
+    user = session.get('user')
+    if user is not None:
+        g.tenant = user
+        return None
+    if request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    if request.blueprint in JSON_BLUEPRINTS:
+        return jsonify(error='Sign in required'), 401
+    return redirect(url_for('auth.login', next=request.full_path.rstrip('?')))
+
+
+def register(app: Flask) -> Blueprint:
+    bp = Blueprint('auth', __name__)
+
+    @bp.route('/login', methods=['GET', 'POST'])
+    def login():
+        if request.method == 'POST':
+            values = request.get_json(silent=True) if request.is_json else request.form
+            name = str((values or {}).get('name', '')).strip().lower()
+            password = str((values or {}).get('password', ''))
+            if current_app.extensions['users'].verify(name, password):
+                session.clear()
+                session['user'] = g.tenant = name
+                open_tenant(current_app)
+                if request.is_json:
+                    return jsonify(user=name)
+                # Only local paths, the login page must not redirect to other sites.
+                target = request.args.get('next', '')
+                return redirect(target if local_target(target) else url_for('home'))
+
+            if request.is_json:
+                return jsonify(error='Unknown user or wrong password'), 401
+            flash(('error', 'Unknown user or wrong password.'))
+        return render_template('login.html.jinja2')
+
+    @bp.route('/logout', methods=['POST'])
+    def logout():
+        session.clear()
+        return redirect(url_for('auth.login'))
+
+    app.register_blueprint(bp)
+    return bp
+
+
+def init_app(app: Flask) -> None:
+    # Multi-user mode: every request needs a signed in user and works on that user's database.
+    if not app.config.get('MULTI_USER', False):
+        return
+
+    # The session names the tenant, so it has to be signed with a key only this deployment knows.
+    if not app.secret_key or app.secret_key in (DEFAULT_SECRET, DEFAULT_SECRET.encode('utf-8')):
+        raise ValueError('Multi-user mode requires FLASK_SECRET to be set to a secret key')
+    # The forms have no CSRF tokens; Lax keeps the session cookie off cross-site POSTs.
+    if app.config.get('SESSION_COOKIE_SAMESITE') is None:
+        app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    app.extensions['users'] = UserStore(os.path.join(app.instance_path, 'users.sqlite'))
+    app.before_request(select_tenant)
+    register(app)
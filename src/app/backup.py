@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import gzip
+import fcntl
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from flask import Flask
+from .db import database_path
+
+BACKUP_NAME = re.compile(r'^db\.sqlite\.backup-(\d+)(\.gz)?$')
+
+
+class IncrementalCopyAborted(Exception):
+    pass
+
+
+class BackupManager:
+
+    def __init__(self,
+        db_path: str,
+        interval: int = 1800,
+        keep: int | None = None,
+        max_age_days: float | None = None,
+        compress: bool = False,
+        pages: int = 256,
+        max_restarts: int = 3,
+        max_seconds: float = 60
+        ) -> None:
+
+        self.db_path = db_path
+        self.backup_dir = os.path.dirname(db_path)
+        self.state_path = os.path.join(self.backup_dir, 'backup.json')
+        self.interval = interval
+        self.keep = keep
+        self.max_age_days = max_age_days
+        self.compress = compress
+        self.pages = pages
+        self.max_restarts = max_restarts
+        self.max_seconds = max_seconds
+        self.last_state_write = 0.0
+
+    @contextmanager
+    def locked_state(self):
+        # The state file is shared by all gunicorn workers, so every read-modify-write holds an exclusive lock.
+        with open(f'{self.state_path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self.read_state()
+                yield state
+                self.write_state(state)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_state(self) -> dict:
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write_state(self, state: dict) -> None:
+        partial_path = f'{self.state_path}.{os.getpid()}.{threading.get_ident()}'
+        with open(partial_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(partial_path, self.state_path)
+
+    def status(self) -> dict:
+        state = self.read_state()
+        if state.get('status') == 'running' and not self.is_alive(state):
+            state['status'] = 'failed'
+            state['error'] = 'Backup process died'
+        return state
+
+    @staticmethod
+    def is_alive(state: dict) -> bool:
+        try:
+            os.kill(state['pid'], 0)
+        except (KeyError, ProcessLookupError):
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def start(self, background: bool = True) -> bool:
+        now = round(time.time())
+        with self.locked_state() as state:
+            if state.get('status') == 'running' and self.is_alive(state):
+                return False
+            if state.get('last_backup') is not None and state['last_backup'] + self.interval > now:
+                return False
+
+            state.clear()
+            state.update({
+                'status': 'running',
+                'pid': os.getpid(),
+                'last_backup': now,
+                'started': now,
+                'progress': 0.0,
+            })
+
+        if background:
+            threading.Thread(target=self.run, args=(now, ), name='db-backup', daemon=True).start()
+        else:
+            self.run(now)
+        return True
+
+    def run(self, timestamp: int) -> None:
+        backup_path = os.path.join(self.backup_dir, f'db.sqlite.backup-{timestamp}')
+        partial_path = f'{backup_path}.partial'
+        try:
+            source = sqlite3.connect(self.db_path)
+            target = sqlite3.connect(partial_path)
+            try:
+                self.copy(source, target)
+            finally:
+                target.close()
+                source.close()
+
+            if self.compress:
+                with open(partial_path, 'rb') as raw_file, gzip.open(f'{backup_path}.gz', 'wb') as compressed_file:
+                    shutil.copyfileobj(raw_file, compressed_file)
+                os.remove(partial_path)
+                backup_path = f'{backup_path}.gz'
+            else:
+                os.replace(partial_path, backup_path)
+
+            removed = self.apply_retention(keep_path=backup_path)
+        except Exception as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            with self.locked_state() as state:
+                state.update({'status': 'failed', 'error': str(e), 'finished': round(time.time())})
+            return
+
+        with self.locked_state() as state:
+            state.update({
+                'status': 'done',
+                'progress': 1.0,
+                'file': os.path.basename(backup_path),
+                'size': os.path.getsize(backup_path),
+                'removed': removed,
+                'finished': round(time.time()),
+            })
+
+    def copy(self, source: sqlite3.Connection, target: sqlite3.Connection) -> None:
+        # Copies a consistent snapshot in batches of pages, releasing the database between batches.
+        # A write from another connection restarts the copy from the first page, so under steady writes
+        # it might never finish: after max_restarts restarts or max_seconds the copy is done again in
+        # a single step, which holds a read transaction (writers go on in WAL mode) until it is complete.
+        deadline = time.monotonic() + self.max_seconds
+        last_remaining = None
+        restarts = 0
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            nonlocal last_remaining, restarts
+            if last_remaining is not None and remaining > last_remaining:
+                restarts += 1
+            last_remaining = remaining
+            self.report_progress(status, remaining, total)
+            if restarts > self.max_restarts or time.monotonic() > deadline:
+                raise IncrementalCopyAborted()
+
+        try:
+            source.backup(target, pages=self.pages, progress=progress, sleep=0)
+        except IncrementalCopyAborted:
+            source.backup(target, pages=-1)
+
+    def report_progress(self, status: int, remaining: int, total: int) -> None:
+        now = time.monotonic()
+        if now - self.last_state_write < 0.5:
+            return
+        self.last_state_write = now
+        with self.locked_state() as state:
+            state['progress'] = (total - remaining) / total if total else 1.0
+
+    def backups(self) -> list[tuple[int, str]]:
+        backups = []
+        for name in os.listdir(self.backup_dir):
+            match = BACKUP_NAME.match(name)
+            if match:
+                backups.append((int(match.group(1)), os.path.join(self.backup_dir, name)))
+        return sorted(backups, reverse=True)
+
+    def apply_retention(self, keep_path: str | None = None) -> list[str]:
+        backups = self.backups()
+        expired = []
+        if self.keep is not None:
+            expired += backups[self.keep:]
+        if self.max_age_days is not None:
+            oldest = time.time() - self.max_age_days * 86400
+            expired += [backup for backup in backups if backup[0] < oldest]
+
+        removed = []
+        for _, path in sorted(set(expired)):
+            if path != keep_path and os.path.exists(path):
+                os.remove(path)
+                removed.append(os.path.basename(path))
+        return removed
+
+
+def get_backup_manager(app: Flask) -> BackupManager:
+    # The manager of the current database; its backups and state file sit next to it, so every tenant
+    # has its own backups and interval.
+    return app.extensions['backup'](database_path(app))
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['backup'] = partial(
+        BackupManager,
+        interval=app.config.get('BACKUP_INTERVAL', 1800),
+        keep=app.config.get('BACKUP_KEEP'),
+        max_age_days=app.config.get('BACKUP_MAX_AGE_DAYS'),
+        compress=app.config.get('BACKUP_COMPRESS', False),
+        pages=app.config.get('BACKUP_PAGES', 256),
+        max_restarts=app.config.get('BACKUP_MAX_RESTARTS', 3),
+        max_seconds=app.config.get('BACKUP_MAX_SECONDS', 60)
+    )
@@ -1,19 +1,123 @@
+import io
 from datetime import datetime
+from typing import Mapping
 from flask import Flask, Blueprint, render_template, request, redirect, url_for, flash, current_app
 from .db import DB
-from .utils import optional_float
+from .caching import conditional
+from .utils import optional_decimal, optional_int, date_to_int, out_of_range, MAX_AMOUNT
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def parse_cursor(cursor: str | None) -> tuple[int, int] | None:
+    if not cursor:
+        return None
+    try:
+        date, id = cursor.split('-')
+        return int(date), int(id)
+    except ValueError:
+        return None
+
+def format_cursor(cursor: tuple[int, int] | None) -> str | None:
+    if cursor is None:
+        return None
+    return f'{cursor[0]}-{cursor[1]}'
+
+def parse_date_filter(date: str | None) -> int | None:
+    if not date:
+        return None
+    try:
+        return date_to_int(datetime.strptime(date, '%Y-%m-%d'))
+    except ValueError:
+        return None
+
+def parse_billing_position(values: Mapping[str, str]) -> tuple[dict | None, str | None]:
+    # Shared by the add/edit forms and the CSV importer: returns the keyword arguments for
+    # DB.add_billing_position or an error message.
+    date = values.get('date')
+
+    try:
+        date = datetime.strptime(date or '', '%Y-%m-%d')
+    except ValueError:
+        return None, f'The date of {date} is incorrect'
+
+    file = (values.get('file') or '').replace(' ', '')
+    if not file:
+        return None, 'The file is missing'
+
+    for name in ('hourly_rate', 'billed_hours', 'earned_percentage', 'earned_amount'):
+        if out_of_range(values.get(name)):
+            return None, f"The {name.replace('_', ' ')} is out of range"
+
+    # Decimal keeps amounts such as 0.1 exact until DB rounds them to cents.
+    hourly_rate = optional_decimal(values.get('hourly_rate'))
+    billed_hours = optional_decimal(values.get('billed_hours'))
+    billed_amount = None
+    earned_percentage = optional_decimal(values.get('earned_percentage'))
+    earned_amount = optional_decimal(values.get('earned_amount'))
+
+    if earned_amount is None:
+        if not all([v is not None for v in (hourly_rate, billed_hours, earned_percentage)]):
+            return None, 'The entry contains errors. Please provice either an Earned Amount or the combination of Rate, Hours and Percentage.'
+
+        billed_amount = hourly_rate * billed_hours
+        earned_amount = billed_amount * earned_percentage / 100
+        if abs(billed_amount) >= MAX_AMOUNT or abs(earned_amount) >= MAX_AMOUNT:
+            return None, 'The billed amount is out of range'
+
+    return {
+        'date': date,
+        'file': file,
+        'hourly_rate': hourly_rate,
+        'billed_hours': billed_hours,
+        'billed_amount': billed_amount,
+        'earned_amount': earned_amount,
+    }, None
 
 def register(app: Flask) -> None:
 
+    from .importer import import_billing_positions
+
     bp = Blueprint('billing', __name__, url_prefix='/billing')
 
     @bp.route('/')
+    @conditional
     def home():
         database = DB(current_app)
 
+        page_size = optional_int(request.args.get('size', ''))
+        page_size = min(max(page_size or PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        filters = {
+            'file': request.args.get('file', '').replace(' ', ''),
+            'date_from': request.args.get('date_from', ''),
+            'date_to': request.args.get('date_to', ''),
+        }
+
+        # Only carry non-default query parameters over into the pagination links.
+        link_args = {key: value for key, value in filters.items() if value}
+        if page_size != PAGE_SIZE:
+            link_args['size'] = page_size
+
+        def load_page() -> dict:
+            billing_positions, older, newer = database.get_billing_positions_page(
+                page_size,
+                after=parse_cursor(request.args.get('after')),
+                before=parse_cursor(request.args.get('before')),
+                file=filters['file'] or None,
+                date_from=parse_date_filter(filters['date_from']),
+                date_to=parse_date_filter(filters['date_to'])
+            )
+            return {
+                'billing_positions': billing_positions,
+                'older_url': url_for('.home', before=format_cursor(older), **link_args) if older else None,
+                'newer_url': url_for('.home', after=format_cursor(newer), **link_args) if newer else None,
+            }
+
         return render_template(
             'billing/home.html.jinja2',
-            billing_positions = database.get_all_billing_positions()
+            filters = filters,
+            page_size = page_size,
+            load_page = load_page
             )
 
     @bp.route('/edit/<int:billing_position_id>', methods=['GET', 'POST'])
@@ -26,31 +130,13 @@ def register(app: Flask) -> None:
                 billing_position=database.get_billing_position(billing_position_id)
             )
         
-        date = request.form.get('date')
-
-        try:
-            date = datetime.strptime(date, '%Y-%m-%d')
-        except ValueError as e: 
-            flash(('error', f'The date of {date} is incorrect'))
-            return redirect(url_for('.edit'))
-
-        file = request.form.get('file').replace(' ', '')
-        hourly_rate = optional_float(request.form.get('hourly_rate'))
-        billed_hours = optional_float(request.form.get('billed_hours'))
-        billed_amount = None
-        earned_percentage = optional_float(request.form.get('earned_percentage'))
-        earned_amount = optional_float(request.form.get('earned_amount'))
-        
-        if not isinstance(earned_amount, float):
-            if not all([v is not None for v in (hourly_rate, billed_hours, earned_percentage)]):
-                flash(('error', 'The entry contains errors. Please provice either an Earned Amount or the combination of Rate, Hours and Percentage.'))
-                return redirect(url_for('.edit', billing_position_id=billing_position_id))
-            
-            billed_amount = hourly_rate * billed_hours
-            earned_amount = billed_amount * earned_percentage / 100.0
+        billing_position, error = parse_billing_position(request.form)
+        if error is not None:
+            flash(('error', error))
+            return redirect(url_for('.edit', billing_position_id=billing_position_id))
 
-        database = DB(current_app)
-        database.update_billing_position(billing_position_id, date, file, hourly_rate, billed_hours, billed_amount, earned_amount)
+        file = billing_position['file']
+        database.update_billing_position(billing_position_id, **billing_position)
 
         flash(('info', f'Sucessfully edited billing position for file {file}.'))
         return redirect(url_for('.edit', billing_position_id=billing_position_id))
@@ -78,34 +164,34 @@ def register(app: Flask) -> None:
         if request.method == 'GET':
             return render_template('billing/add.html.jinja2')
         
-        date = request.form.get('date')
-
-        try:
-            date = datetime.strptime(date, '%Y-%m-%d')
-        except ValueError as e: 
-            flash(('error', f'The date of {date} is incorrect'))
+        billing_position, error = parse_billing_position(request.form)
+        if error is not None:
+            flash(('error', error))
             return redirect(url_for('.add'))
 
-        file = request.form.get('file').replace(' ', '')
-        hourly_rate = optional_float(request.form.get('hourly_rate'))
-        billed_hours = optional_float(request.form.get('billed_hours'))
-        billed_amount = None
-        earned_percentage = optional_float(request.form.get('earned_percentage'))
-        earned_amount = optional_float(request.form.get('earned_amount'))
-
-        if not isinstance(earned_amount, float):
-
-            if not all([v is not None for v in (hourly_rate, billed_hours, earned_percentage)]):
-                flash(('error', 'The entry contains errors. Please provice either an Earned Amount or the combination of Rate, Hours and Percentage.'))
-                return redirect(url_for('.add'))
-            
-            billed_amount = hourly_rate * billed_hours
-            earned_amount = billed_amount * earned_percentage / 100.0
-
+        file = billing_position['file']
         database = DB(current_app)
-        database.add_billing_position(date, file, hourly_rate, billed_hours, billed_amount, earned_amount)
+        database.add_billing_position(**billing_position)
 
         flash(('info', f'Sucessfully billed for file {file}.'))
         return redirect(url_for('.add'))
+
+    @bp.route('/import', methods=['GET', 'POST'])
+    def import_csv():
+        if request.method == 'GET':
+            return render_template('billing/import.html.jinja2')
+
+        csv_file = request.files.get('csv_file')
+        if csv_file is None or csv_file.filename == '':
+            flash(('error', 'Please select a CSV file.'))
+            return redirect(url_for('.import_csv'))
+
+        report = import_billing_positions(
+            DB(current_app),
+            io.TextIOWrapper(csv_file.stream, encoding='utf-8-sig', newline='')
+        )
+
+        flash(('info', f"Imported {report['imported']} billing position(s)."))
+        return render_template('billing/import.html.jinja2', errors=report['errors'])
     
     app.register_blueprint(bp)
@@ -0,0 +1,205 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Iterable
+from markupsafe import Markup
+from flask import Flask, Response, current_app, request, session, make_response, render_template, g
+from .db import DB
+
+def template_fingerprint(app: Flask) -> str:
+    # Changes whenever a template is deployed, so cached pages of an older release are not revalidated.
+    # Static files count too, pages link them under fingerprinted names (see assets.py).
+    digest = hashlib.sha256()
+    for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for root, _, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+def conditional(view: Callable | None = None, *, key: Callable[[], str] | None = None):
+    # Answers GET requests with 304 Not Modified while the database change version (and the
+    # templates) are unchanged, without running the view's queries or rendering its template.
+    # key can add state outside the database that the page depends on.
+    if view is None:
+        return lambda view: conditional(view, key=key)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        etag = f"{current_app.extensions['template_fingerprint']}-{DB(current_app).get_change_version()}"
+        # Tenants count their change versions independently, the same browser may sign in as another user.
+        if g.get('tenant'):
+            etag = f"{g.tenant}-{etag}"
+        if key is not None:
+            etag = f'{etag}-{hashlib.sha256(key().encode("utf-8")).hexdigest()[:12]}'
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    return wrapper
+
+class FragmentStats:
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else None,
+        }
+
+
+class MemoryFragmentStore:
+    # Per-process LRU bounded by the number of entries and their total size in characters.
+
+    def __init__(self, max_entries: int = 256, max_size: int = 16 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.stats = FragmentStats()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.stats.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_size):
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SQLiteFragmentStore:
+    # Shared by all gunicorn workers through a separate SQLite file in the instance folder.
+
+    def __init__(self, path: str, max_entries: int = 1024) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = FragmentStats()
+        self._local = threading.local()
+
+        # Set up with a short-lived connection so that no handle leaks into forked workers.
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode = WAL;')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS fragments (
+                    key text PRIMARY KEY,
+                    value text NOT NULL,
+                    accessed real NOT NULL
+                );
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS fragments_accessed ON fragments (accessed);')
+        finally:
+            connection.close()
+
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            self._local.connection.execute('PRAGMA synchronous = OFF;')
+        return self._local.connection
+
+    def get(self, key: str) -> str | None:
+        connection = self.connection()
+        row = connection.execute('SELECT value FROM fragments WHERE key = ?;', (key, )).fetchone()
+        if row is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        try:
+            connection.execute('UPDATE fragments SET accessed = ? WHERE key = ?;', (time.time(), key))
+        except sqlite3.OperationalError:
+            pass
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        connection = self.connection()
+        try:
+            connection.execute('INSERT OR REPLACE INTO fragments (key, value, accessed) VALUES (?, ?, ?);', (key, value, time.time()))
+            evicted = connection.execute('''
+                DELETE FROM fragments WHERE key IN (
+                    SELECT key FROM fragments ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                );
+            ''', (self.max_entries, )).rowcount
+        except sqlite3.OperationalError:
+            # The cache is best effort: a busy cache file must never fail the request.
+            return
+        self.stats.evictions += evicted
+
+    def __len__(self) -> int:
+        return self.connection().execute('SELECT count(*) FROM fragments;').fetchone()[0]
+
+
+def cached_render(template_name: str, tags: Iterable[str], key: str = '', **context) -> Markup:
+    # Renders a template fragment, or returns it from the fragment cache. The cache key contains the
+    # current generation of each tag; DB mutations bump the generations of the tags they affect.
+    # Callables in context are only called on a miss, so the queries behind a cached fragment are skipped too.
+    store = current_app.extensions['fragment_cache']
+    if store is None:
+        return Markup(render_fragment(template_name, context))
+
+    tags = tuple(tags)
+    generations = DB(current_app).get_cache_generations(tags)
+    cache_key = f"{g.get('tenant') or ''}|{template_name}|{key}|{','.join(f'{tag}:{generation}' for tag, generation in zip(tags, generations))}"
+
+    fragment = store.get(cache_key)
+    if fragment is None:
+        fragment = render_fragment(template_name, context)
+        store.set(cache_key, fragment)
+    return Markup(fragment)
+
+
+def render_fragment(template_name: str, context: dict) -> str:
+    return render_template(template_name, **{name: value() if callable(value) else value for name, value in context.items()})
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['template_fingerprint'] = template_fingerprint(app)
+
+    match app.config.get('FRAGMENT_CACHE', 'memory'):
+        case 'memory':
+            store = MemoryFragmentStore(app.config.get('FRAGMENT_CACHE_ENTRIES', 256), app.config.get('FRAGMENT_CACHE_SIZE', 16 * 1024 * 1024))
+        case 'sqlite':
+            store = SQLiteFragmentStore(os.path.join(app.instance_path, 'fragments.sqlite'), app.config.get('FRAGMENT_CACHE_ENTRIES', 1024))
+        case 'none':
+            store = None
+        case other:
+            raise ValueError(f'Unknown FRAGMENT_CACHE "{other}", choose one of memory, sqlite, none')
+    app.extensions['fragment_cache'] = store
+    app.add_template_global(cached_render)
@@ -0,0 +1,227 @@
+import json
+import click
+from flask import Flask, current_app
+from flask.cli import AppGroup
+from .db import DB, tenant_path
+from . import migrations
+from .importer import import_billing_positions
+from .archive import archive_year
+from .assets import precompile_templates
+from .jobs import supervise
+from .backup import get_backup_manager
+
+# Read paths of DB with representative arguments; every statement they run must be served by an index.
+QUERY_PLAN_CASES = [
+    ('get_billing_position', (1, ), {}),
+    ('get_all_billing_positions', (), {}),
+    ('get_billing_positions_page', (50, ), {}),
+    ('get_billing_positions_page', (50, ), {'before': (20230101, 1), 'date_from': 20220101}),
+    ('get_billing_positions_page', (50, ), {'after': (20230101, 1), 'file': 'EP1234567'}),
+    ('get_open_billing_positions', ('EP1234567', ), {}),
+    ('get_invoiced_billing_positions', (1, ), {}),
+    ('get_all_invoices', (), {}),
+    ('get_invoice', (1, ), {}),
+    ('get_invoice_archive', (1, ), {}),
+    ('search_files', ('EP12', ), {}),
+    ('get_files', ('open', ), {}),
+    ('get_files', ('activity', ), {'open_only': True}),
+    ('get_files', ('file', ), {'offset': 100}),
+    ('get_file_totals', ('EP1234567', ), {}),
+    ('get_file_ledger', ('EP1234567', ), {}),
+    ('get_analytics_rows', (), {}),
+]
+
+
+def query_plans(database: DB) -> list[tuple[str, str, list[str]]]:
+    plans = []
+    for method, args, kwargs in QUERY_PLAN_CASES:
+        statements = []
+        database.connection.set_trace_callback(statements.append)
+        try:
+            getattr(database, method)(*args, **kwargs)
+        finally:
+            database.connection.set_trace_callback(None)
+
+        for sql in statements:
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            # FTS5 reads its shadow tables (e.g. billing_files_fts_config) with its own statements.
+            if "'main'." in sql:
+                continue
+            details = [row[3] for row in database.connection.execute(f'EXPLAIN QUERY PLAN {sql}')]
+            plans.append((method, sql, details))
+    return plans
+
+
+def unindexed_steps(details: list[str]) -> list[str]:
+    # Scanning a subquery (e.g. the rows a window function was computed over) reads no table.
+    return [
+        detail for detail in details
+        if (detail.startswith('SCAN ') and 'INDEX' not in detail and not detail.startswith('SCAN (subquery'))
+        or detail.startswith('USE TEMP B-TREE')
+    ]
+
+
+def register(app: Flask) -> None:
+    db_cli = AppGroup('db', help='Database maintenance.')
+
+    @db_cli.command('migrate')
+    def migrate():
+        database = DB(current_app)
+        applied = migrations.migrate(database.connection)
+        for name in applied:
+            click.echo(f'Applied {name}')
+        click.echo(f'Schema version {migrations.current_version(database.connection)}')
+
+    @db_cli.command('check-plans')
+    def check_plans():
+        failures = 0
+        for method, sql, details in query_plans(DB(current_app)):
+            bad_steps = unindexed_steps(details)
+            failures += len(bad_steps)
+            click.echo(f"{'FAIL' if bad_steps else 'ok  '} {method}")
+            for detail in details:
+                click.echo(f'       {detail}')
+
+        if failures:
+            raise click.ClickException(f'{failures} query plan step(s) without an index')
+
+    @db_cli.command('rebuild-statistics')
+    @click.option('--check', is_flag=True, help='Only report drift, do not rebuild.')
+    def rebuild_statistics(check: bool):
+        database = DB(current_app)
+        drift = database.get_statistics_drift()
+        for stored, computed in drift:
+            year = (stored or computed)['year']
+            click.echo(f'{year}: stored {stored} != computed {computed}')
+        click.echo(f'{len(drift)} year(s) drifted')
+
+        if check:
+            if drift:
+                raise click.ClickException('Statistics summary is out of date')
+            return
+
+        database.rebuild_statistics()
+        click.echo('Statistics summary rebuilt')
+
+    @db_cli.command('money-conversion')
+    def money_conversion():
+        # Yearly totals recorded by the convert_money_to_cents migration, before (real) and after (cents).
+        _, rows = DB(current_app).execute('''
+            SELECT year, count_positions, real_billed, billed_cents, real_earned, earned_cents, real_invoiced, invoiced_cents
+            FROM money_conversion
+            ORDER BY year;
+        ''')
+        for year, count, *totals in rows:
+            differences = [
+                f'{name} {real:.6f} -> {cents / 100:.2f} ({cents - real * 100:+.4f} cents)'
+                for name, real, cents in zip(('billed', 'earned', 'invoiced'), totals[::2], totals[1::2])
+            ]
+            click.echo(f"{year} ({count} positions): {', '.join(differences)}")
+
+    @db_cli.command('backup')
+    def backup():
+        backup_manager = get_backup_manager(current_app)
+        if not backup_manager.start(background=False):
+            raise click.ClickException('A backup is running or the last one is too recent')
+
+        status = backup_manager.status()
+        if status['status'] != 'done':
+            raise click.ClickException(f"Backup failed: {status.get('error')}")
+        click.echo(f"Backup written to {status['file']}")
+        for name in status['removed']:
+            click.echo(f'Removed {name}')
+
+    @db_cli.command('archive-year')
+    @click.argument('year', type=int)
+    @click.option('--vacuum', is_flag=True, help='Reclaim the space freed in the hot database afterwards.')
+    def archive(year: int, vacuum: bool):
+        database = DB(current_app)
+        try:
+            report = archive_year(database, year)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Archived {report['count_positions']} billing position(s) and {report['count_invoices']} invoice(s) to {report['file']}")
+
+        if vacuum:
+            database.execute('VACUUM;')
+            click.echo('Hot database vacuumed')
+
+    @db_cli.command('import-csv')
+    @click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+    @click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+    def import_csv(csv_file, chunk_size: int):
+        report = import_billing_positions(DB(current_app), csv_file, chunk_size)
+        for line, message in report['errors']:
+            click.echo(f'Line {line}: {message}', err=True)
+        click.echo(f"Imported {report['imported']} billing position(s), {len(report['errors'])} error(s)")
+
+    app.cli.add_command(db_cli)
+
+    assets_cli = AppGroup('assets', help='Templates and static files.')
+
+    @assets_cli.command('build')
+    def build():
+        # The same work make_app does at startup, e.g. to fill the instance folder before the first deploy.
+        count = precompile_templates(current_app)
+        click.echo(f'Compiled {count} template(s)')
+        for filename, fingerprinted in current_app.extensions['assets'].build().items():
+            click.echo(f'{filename} -> {fingerprinted}')
+
+    app.cli.add_command(assets_cli)
+
+    jobs_cli = AppGroup('jobs', help='Background jobs.')
+
+    @jobs_cli.command('work')
+    @click.option('--workers', type=int, default=None, help='Job worker processes, defaults to JOB_WORKERS.')
+    def work(workers: int | None):
+        # For servers without gunicorn's when_ready hook (flask run, uvicorn); stops on Ctrl-C.
+        count = workers if workers is not None else current_app.config.get('JOB_WORKERS', 2)
+        click.echo(f'Running {count} job worker(s)')
+        supervise(current_app._get_current_object(), count)
+
+    @jobs_cli.command('list')
+    @click.option('--limit', default=20, show_default=True)
+    def list_jobs(limit: int):
+        queue = current_app.extensions['jobs']
+        for values in queue.recent(limit, current_app.config.get('TENANT')):
+            click.echo(f"{values['id']:>6} {values['kind']:<20} {values['status']:<8} {values['error'] or json.dumps(values['result'])}")
+        click.echo(f"Job workers {'running' if queue.available() else 'not running'}")
+
+    app.cli.add_command(jobs_cli)
+
+    users_cli = AppGroup('users', help='Users of multi-user mode (FLASK_MULTI_USER).')
+
+    def user_store():
+        if 'users' not in current_app.extensions:
+            raise click.ClickException('Multi-user mode is off, set FLASK_MULTI_USER=true')
+        return current_app.extensions['users']
+
+    @users_cli.command('add')
+    @click.argument('name')
+    @click.password_option()
+    def add_user(name: str, password: str):
+        try:
+            user_store().add(name, password)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        # The user's database is created right away rather than on their first sign in.
+        current_app.extensions['db_pools'].get(tenant_path(current_app, name))
+        click.echo(f'Added {name}')
+
+    @users_cli.command('password')
+    @click.argument('name')
+    @click.password_option()
+    def set_password(name: str, password: str):
+        try:
+            user_store().set_password(name, password)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Password of {name} changed')
+
+    @users_cli.command('list')
+    def list_users():
+        for name in user_store().names():
+            click.echo(name)
+
+    app.cli.add_command(users_cli)
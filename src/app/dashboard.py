@@ -0,0 +1,24 @@
+from flask import Flask, Blueprint, render_template, current_app
+from .db import DB
+from .caching import conditional
+
+# Months shown in the monthly table, the most recent ones.
+DISPLAY_MONTHS = 24
+
+def register(app: Flask) -> Blueprint:
+    bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
+
+    @bp.route('/')
+    @conditional
+    def home():
+        metrics = current_app.extensions['analytics'].metrics(DB(current_app))
+
+        return render_template(
+            'dashboard/home.html.jinja2',
+            count_positions=metrics['count_positions'],
+            months=metrics['months'][-DISPLAY_MONTHS:][::-1],
+            file_gaps=metrics['file_gaps']
+        )
+
+    app.register_blueprint(bp)
+    return bp
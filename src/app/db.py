@@ -1,308 +1,1163 @@
 import os
-import shutil
-from datetime import datetime
+import time
+import itertools
+import difflib
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from urllib.parse import quote
+from typing import Iterator, NamedTuple, Callable
+from datetime import datetime, date
+from decimal import Decimal
 import sqlite3
-from sqlite3 import Error
-from flask import Flask
-from . import utils
+from flask import Flask, g, has_app_context
+from . import utils, migrations
+
+
+# Dates are stored as YYYYMMDD integers; selecting a column as "date [yyyymmdd]" decodes it to a date.
+sqlite3.register_converter('yyyymmdd', lambda value: utils.int_to_date(int(value)))
+# Money is stored as integer cents; "[money]" decodes it to a float, "[money_decimal]" to an exact Decimal.
+# Queries write "[{money}]" and DB.columns() fills in the one selected by the MONEY_DECIMAL setting.
+sqlite3.register_converter('money', lambda value: int(value) / 100)
+sqlite3.register_converter('money_decimal', lambda value: Decimal(int(value)).scaleb(-2))
+
+Money = float | Decimal
+
+
+class BillingPosition(NamedTuple):
+    id: int
+    date: date
+    file: str
+    hourly_rate: float | None
+    billed_hours: float | None
+    billed_amount: Money | None
+    earned_amount: Money
+    invoiced_amount: Money | None
+    invoice_id: int | None
+
+BILLING_POSITION_COLUMNS = '''
+    billing_positions.id, billing_positions.date AS "date [yyyymmdd]", billing_positions.file,
+    billing_positions.hourly_rate, billing_positions.billed_hours, billing_positions.billed_cents AS "billed_amount [{money}]",
+    billing_positions.earned_cents AS "earned_amount [{money}]", billing_positions.invoiced_cents AS "invoiced_amount [{money}]",
+    billing_positions.invoice_id
+'''
+
+
+class Invoice(NamedTuple):
+    id: int
+    date: date
+    total: Money
+
+
+class FileMatch(NamedTuple):
+    file: str
+    count_positions: int
+    match: str
+
+
+class FileTotals(NamedTuple):
+    file: str
+    count_positions: int
+    count_open: int
+    total_billed: Money
+    total_earned: Money
+    total_invoiced: Money
+    open_billed: Money
+    open_earned: Money
+    last_date: date
+
+FILE_TOTALS_COLUMNS = '''
+    file, count_positions, count_open, billed_cents AS "total_billed [{money}]", earned_cents AS "total_earned [{money}]",
+    invoiced_cents AS "total_invoiced [{money}]", open_billed_cents AS "open_billed [{money}]",
+    open_earned_cents AS "open_earned [{money}]", last_date AS "last_date [yyyymmdd]"
+'''
+
+# Orderings of the /files overview, each served by an index on billing_files.
+FILE_ORDERS = {
+    'file': 'file',
+    'open': 'open_earned_cents DESC, file',
+    'activity': 'last_date DESC, file',
+}
+
+
+class LedgerEntry(NamedTuple):
+    id: int
+    date: date
+    billed_amount: Money | None
+    earned_amount: Money
+    invoiced_amount: Money | None
+    invoice_id: int | None
+    invoice_date: date | None
+    running_billed: Money
+    running_earned: Money
+    running_invoiced: Money
+    balance: Money
+
+
+# Archived years leave the hot tables, so new ids continue above the high-water marks recorded in
+# archives instead of reusing the ids of archived positions and invoices.
+NEXT_BILLING_POSITION_ID = '(SELECT max(IFNULL(max(id), 0), (SELECT IFNULL(max(max_position_id), 0) FROM archives)) + 1 FROM billing_positions)'
+NEXT_INVOICE_ID = '(SELECT max(IFNULL(max(id), 0), (SELECT IFNULL(max(max_invoice_id), 0) FROM archives)) + 1 FROM invoices)'
+
+# SQLite attaches at most 10 databases per connection; the oldest attached archive is detached beyond this.
+MAX_ATTACHED_ARCHIVES = 8
+
+
+def row_factory(row_type: type) -> Callable:
+    make = tuple.__new__
+    return lambda cursor, row: make(row_type, row)
+
+
+# Connection setup applied to every new connection, selected through the DB_PROFILE setting.
+PRAGMA_PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON',
+    },
+}
+
+def parse_pragmas(pragmas: str) -> dict:
+    # Parses overrides such as "cache_size=-64000, mmap_size=0".
+    parsed = {}
+    for pragma in pragmas.split(','):
+        if not pragma.strip():
+            continue
+        name, _, value = pragma.partition('=')
+        name, value = name.strip().lower(), value.strip()
+        if not name.isidentifier() or not value.lstrip('-').isalnum():
+            raise ValueError(f'Invalid PRAGMA setting "{pragma.strip()}"')
+        parsed[name] = value
+    return parsed
+
+def pragma_settings(profile: str = 'wal', overrides: str = '') -> dict:
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f'Unknown DB profile "{profile}", choose one of {", ".join(PRAGMA_PROFILES)}')
+    return {**PRAGMA_PROFILES[profile], **parse_pragmas(overrides)}
+
+
+class ConnectionPool:
+
+    def __init__(self, db_path: str, max_idle: int = 4, pragmas: dict | None = None) -> None:
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.pragmas = pragmas or {}
+        self.closed = False
+        self.last_used = time.monotonic()
+        self._idle = deque()
+        self._close_callbacks = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        # uri=True lets DB.attach_archive() open the year archives read-only and immutable.
+        connection = sqlite3.connect(self.db_path, check_same_thread=False, detect_types=sqlite3.PARSE_COLNAMES, uri=True)
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value};')
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        if connection.in_transaction:
+            connection.rollback()
+
+        with self._lock:
+            if not self.closed and len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def on_close(self, callback: Callable) -> None:
+        # Runs callback once the pool is closed (evicted), right away if it already is.
+        with self._lock:
+            if not self.closed:
+                self._close_callbacks.append(callback)
+                return
+        callback()
+
+    def close(self) -> None:
+        # Connections still in use are closed when they are released.
+        with self._lock:
+            self.closed = True
+            callbacks, self._close_callbacks = self._close_callbacks, []
+        self.close_all()
+        for callback in callbacks:
+            callback()
+
+
+class ConnectionPools:
+    # One ConnectionPool per database file (a tenant in multi-user mode), least recently used first.
+    # At most max_pools are kept and pools unused for idle_timeout seconds are closed, so a worker
+    # holds idle connections for the active tenants only. A database is migrated when it is first used.
+
+    def __init__(self, max_pools: int = 32, idle_timeout: float = 300.0, max_idle: int = 4, pragmas: dict | None = None) -> None:
+        self.max_pools = max_pools
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.pragmas = pragmas or {}
+        self.evictions = 0
+        self._pools = OrderedDict()
+        self._migrated = set()
+        self._lock = threading.Lock()
+        self._migrate_lock = threading.Lock()
+
+    def get(self, db_path: str) -> ConnectionPool:
+        now = time.monotonic()
+        with self._lock:
+            pool = self._pools.pop(db_path, None)
+            evicted = []
+            while self._pools and next(iter(self._pools.values())).last_used < now - self.idle_timeout:
+                evicted.append(self._pools.popitem(last=False)[1])
+            while len(self._pools) >= self.max_pools:
+                evicted.append(self._pools.popitem(last=False)[1])
+            if pool is None:
+                pool = ConnectionPool(db_path, self.max_idle, self.pragmas)
+            pool.last_used = now
+            self._pools[db_path] = pool
+            self.evictions += len(evicted)
+
+        for evicted_pool in evicted:
+            evicted_pool.close()
+        if db_path not in self._migrated:
+            self.migrate(pool)
+        return pool
+
+    def migrate(self, pool: ConnectionPool) -> None:
+        with self._migrate_lock:
+            if pool.db_path in self._migrated:
+                return
+            os.makedirs(os.path.dirname(pool.db_path), exist_ok=True)
+            # A short-lived connection, none is left open in a master that forks workers afterwards.
+            connection = pool.connect()
+            try:
+                migrations.migrate(connection)
+            finally:
+                connection.close()
+            self._migrated.add(pool.db_path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'open_pools': len(self._pools), 'evictions': self.evictions}
+
+    def close_all(self) -> None:
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+class DBExecutor:
+    # Runs the SQLite calls of all request threads on dedicated threads (DB_EXECUTOR): one writer and
+    # a few readers, so a slow listing only occupies a reader while writes go on. Writers are
+    # serialised by write_lock in the request thread for the whole transaction; waiting for
+    # SQLite's lock on the writer thread would stall the transaction holding it.
+
+    def __init__(self, readers: int = 4) -> None:
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix='db-reader')
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix='db-writer')
+        self.write_lock = threading.RLock()
+
+    def read(self, fn: Callable, *args):
+        return self.readers.submit(fn, *args).result()
+
+    def write(self, fn: Callable, *args):
+        with self.write_lock:
+            return self.writer.submit(fn, *args).result()
+
+    def shutdown(self) -> None:
+        self.readers.shutdown()
+        self.writer.shutdown()
+
+
+def mutation(method: Callable) -> Callable:
+    # Marks DB methods that write. With the write queue enabled they run on its writer thread,
+    # grouped with other pending mutations; inside a caller's own transaction they run directly.
+    @wraps(method)
+    def wrapper(self: 'DB', *args, **kwargs):
+        if self.write_queue is None or self.transaction_depth > 0:
+            return method(self, *args, **kwargs)
+        return self.write_queue.submit(self.db_path, method, args, kwargs)
+    return wrapper
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['db_pools'] = ConnectionPools(
+        app.config.get('DB_MAX_POOLS', 32),
+        app.config.get('DB_POOL_IDLE_TIMEOUT', 300),
+        app.config.get('DB_POOL_SIZE', 4),
+        pragma_settings(app.config.get('DB_PROFILE', 'wal'), app.config.get('DB_PRAGMAS', ''))
+    )
+    app.extensions['db_executor'] = DBExecutor(app.config.get('DB_EXECUTOR_READERS', 4)) if app.config.get('DB_EXECUTOR', False) else None
+
+    # Tenant databases are migrated when they are first used.
+    if not app.config.get('MULTI_USER', False):
+        app.extensions['db_pools'].get(database_path(app))
+
+    app.teardown_appcontext(release_connection)
+
+
+def database_path(app: Flask) -> str:
+    # instance/db.sqlite, or in multi-user mode the database of the signed in user (g.tenant, see
+    # auth.py) or of FLASK_TENANT for commands: instance/tenants/<user>/db.sqlite.
+    if not app.config.get('MULTI_USER', False):
+        return os.path.join(app.instance_path, 'db.sqlite')
+
+    tenant = (g.get('tenant') if has_app_context() else None) or app.config.get('TENANT')
+    if not tenant:
+        raise RuntimeError('No user selected: sign in, or set FLASK_TENANT for commands')
+    return tenant_path(app, tenant)
+
+
+def tenant_path(app: Flask, tenant: str) -> str:
+    return os.path.join(app.instance_path, 'tenants', tenant, 'db.sqlite')
+
+
+def get_connection(app: Flask, db_path: str) -> sqlite3.Connection:
+    if 'db_connection' not in g:
+        g.db_pool = app.extensions['db_pools'].get(db_path)
+        g.db_connection = g.db_pool.acquire()
+    return g.db_connection
+
+
+def release_connection(exception: BaseException | None = None) -> None:
+    connection = g.pop('db_connection', None)
+    if connection is not None:
+        g.pop('db_pool').release(connection)
+
 
 class DB:
-    last_backup = None
 
-    def __init__(self, app: Flask) -> None:
-        self.db_path = os.path.join(app.instance_path, 'db.sqlite')
-        
-        self.connection = None
-        try:
-            self.connection = sqlite3.connect(self.db_path)
-        except Error as e:
-            print(e)
-            return
-        
+    def __init__(self, app: Flask, connection: sqlite3.Connection | None = None, db_path: str | None = None) -> None:
+        self.db_path = db_path if db_path is not None else database_path(app)
+
+        self.connection = connection if connection is not None else get_connection(app, self.db_path)
         self.cursor = self.connection.cursor()
-        
-        self.create_table('invoices', [
-            'id integer PRIMARY KEY',
-            'date integer NOT NULL'
-        ])
-
-        self.create_table('billing_positions', [
-            'id integer PRIMARY KEY',
-            'date integer NOT NULL',
-            'file text NOT NULL',
-            'hourly_rate real',
-            'billed_hours real',
-            'billed_amount real',
-            'earned_amount real NOT NULL',
-            'invoiced_amount real',
-            'invoice_id integer',
-            'FOREIGN KEY(invoice_id) REFERENCES invoices(id)'
-        ])
+        self.transaction_depth = 0
+        # None unless instrumentation is enabled, statements are only timed then.
+        self.instrumentation = app.extensions.get('instrumentation')
+        self.executor = app.extensions.get('db_executor')
+        self.write_queue = app.extensions.get('write_queue')
+        self.money = 'money_decimal' if app.config.get('MONEY_DECIMAL') else 'money'
+
+    @contextmanager
+    def transaction(self):
+        # Groups several statements into one commit; commits requested by execute() inside are deferred
+        # to the outermost transaction, and any exception rolls the whole transaction back.
+        if self.transaction_depth > 0:
+            self.transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self.transaction_depth -= 1
+            return
+
+        with self.executor.write_lock if self.executor is not None else nullcontext():
+            # IMMEDIATE takes the write lock up front (waiting up to busy_timeout); a deferred transaction that
+            # reads before it writes fails with SQLITE_BUSY when another connection committed in between.
+            if not self.connection.in_transaction:
+                self.run(True, self.connection.execute, 'BEGIN IMMEDIATE;')
+            self.transaction_depth = 1
+            try:
+                yield self
+            except BaseException:
+                self.run(True, self.connection.rollback)
+                raise
+            else:
+                self.run(True, self.connection.commit)
+            finally:
+                self.transaction_depth = 0
+
+    def columns(self, columns: str) -> str:
+        # Fills in the money converter of column lists such as BILLING_POSITION_COLUMNS.
+        return columns.format(money=self.money)
+
+    @staticmethod
+    def number(value: float | Decimal | None) -> float | None:
+        # sqlite3 cannot bind Decimal; rates and hours are not money and stay real.
+        return float(value) if value is not None else None
+
+    def run(self, write: bool, fn: Callable, *args):
+        # Calls fn directly, or on the DB executor's writer (inside transactions) or reader threads.
+        if self.executor is None:
+            return fn(*args)
+        if write or self.transaction_depth > 0:
+            return self.executor.write(fn, *args)
+        return self.executor.read(fn, *args)
+
+    @staticmethod
+    def is_read(sql: str) -> bool:
+        return sql.lstrip()[:6].upper() in ('SELECT', 'WITH')
 
     def execute(self, sql: str, parameters: tuple = (), commit: bool = False) -> tuple[int | None, list]:
+        return self.run(commit or not self.is_read(sql), self._execute, sql, parameters, commit)
+
+    def _execute(self, sql: str, parameters: tuple, commit: bool) -> tuple[int | None, list]:
+        start = time.perf_counter() if self.instrumentation is not None else None
         self.cursor.execute(sql, parameters)
-        if commit:
+        if commit and self.transaction_depth == 0:
             self.connection.commit()
         self.last_row_id = self.cursor.lastrowid
         self.row_values = self.cursor.fetchall()
+        if start is not None:
+            rows = len(self.row_values) if self.cursor.description is not None else self.cursor.rowcount
+            self.instrumentation.observe_sql(sql, time.perf_counter() - start, rows)
         if self.cursor.description is not None:
             self.row_keys = [d[0] for d in self.cursor.description]
         else:
             self.row_keys = None
+        return self.last_row_id, self.row_values
 
-    def backup(self) -> bool:
-        if DB.last_backup is not None and DB.last_backup + 1800 > round(datetime.timestamp(datetime.now())):
-            return False
-        
-        DB.last_backup = round(datetime.timestamp(datetime.now()))
-        shutil.copyfile(self.db_path, f"{self.db_path}.backup-{DB.last_backup}")
-        return True
-
-    def create_table(self, table_name: str, columns: list[str]) -> None:
-        column_placeholders = ', '.join(columns)
-        sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({column_placeholders});'
+    def fetch(self, row_type: type, sql: str, parameters: tuple = ()) -> list:
+        return self.run(False, self._fetch, row_type, sql, parameters)
 
+    def _fetch(self, row_type: type, sql: str, parameters: tuple) -> list:
+        start = time.perf_counter() if self.instrumentation is not None else None
+        cursor = self.connection.cursor()
+        cursor.row_factory = row_factory(row_type)
         try:
-            self.execute(sql, commit=True)
-        except Error as e:
-            print(e)
+            rows = cursor.execute(sql, parameters).fetchall()
+        finally:
+            cursor.close()
+        if start is not None:
+            self.instrumentation.observe_sql(sql, time.perf_counter() - start, len(rows))
+        return rows
 
-    def get_statistics(self) -> list | None:
-        sql = '''
+    def stream(self, sql: str, parameters: tuple = (), batch_size: int = 500) -> tuple[list[str], Iterator[tuple]]:
+        # Runs the query on its own cursor and yields rows in fetchmany batches instead of materialising them.
+        start = time.perf_counter() if self.instrumentation is not None else None
+        cursor = self.connection.cursor()
+        self.run(False, cursor.execute, sql, parameters)
+        keys = [d[0] for d in cursor.description]
+        if start is not None:
+            # Only the time to the first row, the rows are fetched while the response streams.
+            self.instrumentation.observe_sql(sql, time.perf_counter() - start, 0)
+
+        def rows() -> Iterator[tuple]:
+            try:
+                while batch := self.run(False, cursor.fetchmany, batch_size):
+                    yield from batch
+            finally:
+                cursor.close()
+
+        return keys, rows()
+
+    def execute_many(self, sql: str, parameters: list[tuple], commit: bool = False) -> int:
+        return self.run(True, self._execute_many, sql, parameters, commit)
+
+    def _execute_many(self, sql: str, parameters: list[tuple], commit: bool) -> int:
+        start = time.perf_counter() if self.instrumentation is not None else None
+        self.cursor.executemany(sql, parameters)
+        if commit and self.transaction_depth == 0:
+            self.connection.commit()
+        if start is not None:
+            self.instrumentation.observe_sql(sql, time.perf_counter() - start, self.cursor.rowcount)
+        return self.cursor.rowcount
+
+    # FRAGMENT CACHE TAGS
+
+    def invalidate(self, *tags: str) -> None:
+        # Called by every mutation inside its transaction, so the bump commits together with the change.
+        placeholders = ', '.join('?' * len(tags))
+        self.execute(f'UPDATE cache_tags SET generation = generation + 1 WHERE tag IN ({placeholders});', tags)
+
+    def get_cache_generations(self, tags: tuple[str, ...]) -> tuple[int, ...]:
+        placeholders = ', '.join('?' * len(tags))
+        _, rows = self.execute(f'SELECT tag, generation FROM cache_tags WHERE tag IN ({placeholders});', tags)
+        generations = dict(rows)
+        return tuple(generations.get(tag, 0) for tag in tags)
+
+    def get_change_version(self) -> int:
+        # Bumped by triggers on every change to billing_positions or invoices, from any connection.
+        _, rows = self.execute('SELECT version FROM change_counter WHERE id = 1;')
+        return rows[0][0]
+
+    def get_statistics(self, archived: bool = True) -> list | None:
+        # Reads the per-year summary kept up to date by the billing_summaries_* triggers, together with
+        # the totals recorded for archived years (archived=False leaves those out).
+        archived_statistics = '''
+            UNION ALL
+            SELECT year, count_positions, billed_cents, earned_cents, invoiced_cents
+            FROM archived_statistics
+        ''' if archived else ''
+        sql = f'''
+            WITH statistics AS (
+                SELECT year, count_positions, billed_cents, earned_cents, invoiced_cents
+                FROM billing_statistics
+                {archived_statistics}
+            )
             SELECT
                 NULL AS year,
-                count(id) AS count_positions,
-                IFNULL(sum(billed_amount), 0) AS total_billed,
-                IFNULL(sum(earned_amount), 0) AS total_earned,
-                IFNULL(sum(invoiced_amount), 0) AS total_invoiced
-            FROM billing_positions
-            UNION
+                IFNULL(sum(count_positions), 0) AS count_positions,
+                IFNULL(sum(billed_cents), 0) AS "total_billed [{self.money}]",
+                IFNULL(sum(earned_cents), 0) AS "total_earned [{self.money}]",
+                IFNULL(sum(invoiced_cents), 0) AS "total_invoiced [{self.money}]"
+            FROM statistics
+            UNION ALL
+            SELECT year, count_positions, billed_cents, earned_cents, invoiced_cents
+            FROM statistics
+            ORDER BY year;
+        '''
+        _, rows = self.execute(sql)
+
+        return [self.format_statistic(row) for row in rows]
+
+    @staticmethod
+    def format_statistic(row: tuple) -> dict:
+        return {
+            'year': row[0],
+            'count_positions': row[1],
+            'total_billed': row[2],
+            'total_earned': row[3],
+            'total_invoiced': row[4]
+        }
+
+    def compute_statistics(self) -> list:
+        sql = f'''
             SELECT
                 date / 10000 AS year,
                 count(id) AS count_positions,
-                IFNULL(sum(billed_amount), 0) AS total_billed,
-                IFNULL(sum(earned_amount), 0) AS total_earned,
-                IFNULL(sum(invoiced_amount), 0) AS total_invoiced
+                IFNULL(sum(billed_cents), 0) AS "total_billed [{self.money}]",
+                IFNULL(sum(earned_cents), 0) AS "total_earned [{self.money}]",
+                IFNULL(sum(invoiced_cents), 0) AS "total_invoiced [{self.money}]"
             FROM billing_positions
             GROUP BY year
             ORDER BY year;
         '''
         _, rows = self.execute(sql)
 
-        statistics = []
-        try:
-            for row in rows:
-                statistics.append({
-                    'year': row[0],
-                    'count_positions': row[1],
-                    'total_billed': round(row[2], 2),
-                    'total_earned': round(row[3], 2),
-                    'total_invoiced': round(row[4], 2)
-                })
-        except:
-            return None
-        
-        return statistics
+        return [self.format_statistic(row) for row in rows]
+
+    def get_statistics_drift(self) -> list[tuple[dict | None, dict | None]]:
+        # Archived years are no longer in billing_positions, so only the hot summary is compared.
+        stored = {statistic['year']: statistic for statistic in self.get_statistics(archived=False) if statistic['year'] is not None}
+        computed = {statistic['year']: statistic for statistic in self.compute_statistics()}
+
+        return [
+            (stored.get(year), computed.get(year))
+            for year in sorted(stored.keys() | computed.keys())
+            if stored.get(year) != computed.get(year)
+        ]
+
+    @mutation
+    def rebuild_statistics(self) -> None:
+        sql = '''
+            INSERT INTO billing_statistics (year, count_positions, billed_cents, earned_cents, invoiced_cents)
+            SELECT date / 10000, count(id), IFNULL(sum(billed_cents), 0), IFNULL(sum(earned_cents), 0), IFNULL(sum(invoiced_cents), 0)
+            FROM billing_positions
+            GROUP BY date / 10000;
+        '''
+        with self.transaction():
+            self.invalidate('statistics')
+            self.execute('DELETE FROM billing_statistics;')
+            self.execute(sql, commit=True)
 
     # BILLABLE POSITIONS
 
-    @staticmethod
-    def format_billing_position(**kwargs) -> dict:
-        formatted_billing_position = {}
-        for key, value in kwargs.items():
-            match key:
-                case 'id':
-                    formatted_billing_position[key] = int(value)
-                case 'date':
-                    formatted_billing_position[key] = utils.int_to_date(value)
-                case 'file':
-                    formatted_billing_position[key] = str(value)
-                case 'hourly_rate':
-                    formatted_billing_position[key] = utils.optional_float(value)
-                case 'billed_hours':
-                    formatted_billing_position[key] = utils.optional_float(value)
-                case 'billed_amount':
-                    formatted_billing_position[key] = utils.optional_float(value)
-                case 'earned_amount':
-                    formatted_billing_position[key] = float(value)
-                case 'invoiced_amount':
-                    formatted_billing_position[key] = utils.optional_int(value)
-                case 'invoice_id':
-                    formatted_billing_position[key] = utils.optional_int(value)
-        return formatted_billing_position
-        
+    @mutation
     def add_billing_position(self,
         date: datetime,
         file: str,
         hourly_rate: float,
         billed_hours: float,
-        billed_amount: float,
-        earned_amount: float,
+        billed_amount: Money,
+        earned_amount: Money,
         ) -> int:
 
-        sql = '''
-            INSERT INTO billing_positions (date, file, hourly_rate, billed_hours, billed_amount, earned_amount)
-            VALUES (?, ?, ?, ?, ?, ?);
+        sql = f'''
+            INSERT INTO billing_positions (id, date, file, hourly_rate, billed_hours, billed_cents, earned_cents)
+            VALUES ({NEXT_BILLING_POSITION_ID}, ?, ?, ?, ?, ?, ?);
         '''
-        self.execute(sql, (utils.date_to_int(date), file, hourly_rate, billed_hours, billed_amount, earned_amount), commit=True)
+        with self.transaction():
+            self.invalidate('statistics', 'billing')
+            self.execute(sql, (
+                utils.date_to_int(date), file, self.number(hourly_rate), self.number(billed_hours),
+                utils.to_cents(billed_amount), utils.to_cents(earned_amount)
+            ), commit=True)
         return self.last_row_id
 
+    @mutation
+    def add_billing_positions(self, billing_positions: list[dict]) -> int:
+        sql = f'''
+            INSERT INTO billing_positions (id, date, file, hourly_rate, billed_hours, billed_cents, earned_cents)
+            VALUES ({NEXT_BILLING_POSITION_ID}, ?, ?, ?, ?, ?, ?);
+        '''
+        parameters = [(
+            utils.date_to_int(b['date']), b['file'], self.number(b['hourly_rate']), self.number(b['billed_hours']),
+            utils.to_cents(b['billed_amount']), utils.to_cents(b['earned_amount'])
+        ) for b in billing_positions]
+
+        with self.transaction():
+            self.invalidate('statistics', 'billing')
+            return self.execute_many(sql, parameters)
+
+    @mutation
     def remove_billing_position(self, id: int):
         sql = '''
             DELETE FROM billing_positions
             WHERE id = ?
         '''
 
-        self.execute(sql, (id, ), commit=True)
+        with self.transaction():
+            self.invalidate('statistics', 'billing', 'invoices')
+            self.execute(sql, (id, ), commit=True)
     
+    @mutation
     def update_billing_position(self,
         id: int,
         date: datetime,
         file: str,
         hourly_rate: float,
         billed_hours: float,
-        billed_amount: float,
-        earned_amount: float
+        billed_amount: Money,
+        earned_amount: Money
         ) -> None:
         sql = '''
             UPDATE billing_positions
-            SET date = ?, file = ?, hourly_rate = ?, billed_hours = ?, billed_amount = ?, earned_amount = ?
+            SET date = ?, file = ?, hourly_rate = ?, billed_hours = ?, billed_cents = ?, earned_cents = ?
             WHERE id = ?;
         '''
 
-        self.execute(sql, (utils.date_to_int(date), file, hourly_rate, billed_hours, billed_amount, earned_amount, id), commit=True)
+        with self.transaction():
+            self.invalidate('statistics', 'billing')
+            self.execute(sql, (
+                utils.date_to_int(date), file, self.number(hourly_rate), self.number(billed_hours),
+                utils.to_cents(billed_amount), utils.to_cents(earned_amount), id
+            ), commit=True)
 
-    def get_billing_position(self, id: int) -> dict | None:
+    @mutation
+    def update_billing_positions(self, billing_positions: list[dict]) -> int:
         sql = '''
-            SELECT *
-            FROM billing_positions
+            UPDATE billing_positions
+            SET date = ?, file = ?, hourly_rate = ?, billed_hours = ?, billed_cents = ?, earned_cents = ?
+            WHERE id = ?;
+        '''
+        parameters = [(
+            utils.date_to_int(b['date']), b['file'], self.number(b['hourly_rate']), self.number(b['billed_hours']),
+            utils.to_cents(b['billed_amount']), utils.to_cents(b['earned_amount']), b['id']
+        ) for b in billing_positions]
+
+        with self.transaction():
+            self.invalidate('statistics', 'billing')
+            return self.execute_many(sql, parameters)
+
+    @mutation
+    def remove_billing_positions(self, ids: list[int]) -> int:
+        sql = '''
+            DELETE FROM billing_positions
             WHERE id = ?
-            ORDER BY date;
         '''
-        self.execute(sql, (id, ))
-        
-        if len(self.row_values) != 1:
+
+        with self.transaction():
+            self.invalidate('statistics', 'billing', 'invoices')
+            return self.execute_many(sql, [(id, ) for id in ids])
+
+    def get_billing_position(self, id: int) -> BillingPosition | None:
+        sql = f'''
+            SELECT {self.columns(BILLING_POSITION_COLUMNS)}
+            FROM billing_positions
+            WHERE id = ?;
+        '''
+        billing_positions = self.fetch(BillingPosition, sql, (id, ))
+
+        if len(billing_positions) != 1:
             return None
-        
-        billing_position = dict(zip(self.row_keys, self.row_values[0]))
-        return self.format_billing_position(**billing_position)
+        return billing_positions[0]
 
-    def get_all_billing_positions(self) -> list:
-        sql = '''
-            SELECT *
+    def get_billing_positions(self, ids: list[int]) -> list[BillingPosition]:
+        # Looked up in chunks to stay below SQLite's limit on bound parameters.
+        billing_positions = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            sql = f'''
+                SELECT {self.columns(BILLING_POSITION_COLUMNS)}
+                FROM billing_positions
+                WHERE id IN ({', '.join('?' * len(chunk))});
+            '''
+            billing_positions += self.fetch(BillingPosition, sql, tuple(chunk))
+        return billing_positions
+
+    def get_all_billing_positions(self) -> list[BillingPosition]:
+        sql = f'''
+            SELECT {self.columns(BILLING_POSITION_COLUMNS)}
             FROM billing_positions
             ORDER BY date;
             '''
-        self.execute(sql)
-
-        billing_positions = [dict(zip(self.row_keys, row_value)) for row_value in self.row_values]
-        billing_positions = [self.format_billing_position(**b) for b in billing_positions]
-        return billing_positions
+        return self.fetch(BillingPosition, sql)
     
-    def get_open_billing_positions(self, file: str) -> list:
+    def get_billing_positions_page(self,
+        limit: int,
+        after: tuple[int, int] | None = None,
+        before: tuple[int, int] | None = None,
+        file: str | None = None,
+        date_from: int | None = None,
+        date_to: int | None = None
+        ) -> tuple[list[BillingPosition], tuple[int, int] | None, tuple[int, int] | None]:
+        # Keyset pagination over (date, id): returns the page in ascending order together with
+        # the cursors of the neighbouring older and newer pages (None if there is no such page).
+        conditions = []
+        parameters = []
+        if file:
+            conditions.append('file = ?')
+            parameters.append(file)
+        if date_from is not None:
+            conditions.append('date >= ?')
+            parameters.append(date_from)
+        if date_to is not None:
+            conditions.append('date <= ?')
+            parameters.append(date_to)
 
-        sql = '''
-            SELECT *
+        if after is not None:
+            conditions.append('(date, id) > (?, ?)')
+            parameters.extend(after)
+            order = 'ASC'
+        else:
+            if before is not None:
+                conditions.append('(date, id) < (?, ?)')
+                parameters.extend(before)
+            order = 'DESC'
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        sql = f'''
+            SELECT {self.columns(BILLING_POSITION_COLUMNS)}
             FROM billing_positions
-            WHERE invoice_id IS NULL AND file = ?
-            ORDER BY date;
+            {where}
+            ORDER BY date {order}, id {order}
+            LIMIT ?;
         '''
-        self.execute(sql, (file, ))
+        billing_positions = self.fetch(BillingPosition, sql, (*parameters, limit + 1))
 
-        billing_positions = [dict(zip(self.row_keys, row_value)) for row_value in self.row_values]
-        billing_positions = [self.format_billing_position(**b) for b in billing_positions]
-        return billing_positions
+        has_more = len(billing_positions) > limit
+        billing_positions = billing_positions[:limit]
+        if order == 'DESC':
+            billing_positions.reverse()
 
-    def get_invoiced_billing_positions(self, invoice_id: int) -> list:
-        
-        sql = '''
-            SELECT *
+        if not billing_positions:
+            return billing_positions, None, None
+
+        first = (utils.date_to_int(billing_positions[0].date), billing_positions[0].id)
+        last = (utils.date_to_int(billing_positions[-1].date), billing_positions[-1].id)
+        if order == 'ASC':
+            return billing_positions, first, last if has_more else None
+        return billing_positions, first if has_more else None, last if before is not None else None
+
+    def get_open_billing_positions(self, file: str) -> list[BillingPosition]:
+
+        sql = f'''
+            SELECT {self.columns(BILLING_POSITION_COLUMNS)}
             FROM billing_positions
+            WHERE invoice_id IS NULL AND file = ?
+            ORDER BY date;
+        '''
+        return self.fetch(BillingPosition, sql, (file, ))
+
+    def get_invoiced_billing_positions(self, invoice_id: int) -> list[BillingPosition]:
+        # The positions of an archived invoice are read from its year's archive.
+        year = self.get_invoice_archive(invoice_id)
+        schema = 'main' if year is None else self.attach_archive(year)
+        sql = f'''
+            SELECT {self.columns(BILLING_POSITION_COLUMNS)}
+            FROM {schema}.billing_positions AS billing_positions
             WHERE invoice_id = ?
             ORDER BY file, date;
         '''
-        self.execute(sql, (invoice_id, ))
-
-        billing_positions = [dict(zip(self.row_keys, row_value)) for row_value in self.row_values]
-        billing_positions = [self.format_billing_position(**b) for b in billing_positions]
-        return billing_positions
+        return self.fetch(BillingPosition, sql, (invoice_id, ))
 
+    @mutation
     def invoice_billing_position(self,
         id: int, 
-        invoiced_amount: float,
+        invoiced_amount: Money,
         invoice_id: int
         ) -> None:
 
         sql = '''
             UPDATE billing_positions
-            SET invoiced_amount = ?, invoice_id = ?
+            SET invoiced_cents = ?, invoice_id = ?
             WHERE id = ?;
         '''
 
-        self.execute(sql, (invoiced_amount, invoice_id, id), commit=True)
-    
+        with self.transaction():
+            self.invalidate('statistics', 'invoices')
+            self.execute(sql, (utils.to_cents(invoiced_amount), invoice_id, id), commit=True)
 
-    # INVOICES
+    @mutation
+    def invoice_billing_positions(self,
+        invoiced_amounts: list[tuple[int, Money]],
+        invoice_id: int
+        ) -> None:
+
+        sql = '''
+            UPDATE billing_positions
+            SET invoiced_cents = ?, invoice_id = ?
+            WHERE id = ?;
+        '''
+
+        with self.transaction():
+            self.invalidate('statistics', 'invoices')
+            self.execute_many(sql, [(utils.to_cents(invoiced_amount), invoice_id, id) for id, invoiced_amount in invoiced_amounts])
+
+    # FILE SEARCH
 
     @staticmethod
-    def format_invoice(**kwargs) -> dict:
-        invoice = {}
-        for key, value in kwargs.items():
-            match key:
-                case 'id':
-                    invoice[key] = int(value)
-                case 'date':
-                    invoice[key] = utils.int_to_date(value)
-                case 'total':
-                    invoice[key] = float(value)
-        return invoice
+    def fts_phrase(text: str) -> str:
+        return '"' + text.replace('"', '""') + '"'
 
-    def add_invoice(self, date: datetime) -> int:
-        sql = 'INSERT INTO invoices (date) VALUES (?);'
-        self.execute(sql, (date.date().strftime('%Y%m%d'), ), commit=True)
-        return self.last_row_id
-    
-    def remove_invoice(self, id: int) -> None:
+    def search_files(self, query: str, limit: int = 10) -> list[FileMatch]:
+        # Prefix matches first (case-insensitive range on billing_files_nocase), then substrings
+        # through the trigram index and, if that is still short of limit, fuzzy matches that share
+        # trigrams with the query, reranked by similarity.
+        query = query.replace(' ', '')
+        if not query:
+            return []
+
+        # NOCASE folds to lower case, so the exclusive upper bound is computed on the folded prefix.
+        prefix = query.lower()
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
         sql = '''
-            UPDATE billing_positions
-            SET invoiced_amount = NULL, invoice_id = NULL
-            WHERE invoice_id = ?;
+            SELECT file, count_positions, 'prefix'
+            FROM billing_files
+            WHERE file >= ? COLLATE NOCASE AND file < ? COLLATE NOCASE
+            ORDER BY file COLLATE NOCASE
+            LIMIT ?;
         '''
-    
-        self.execute(sql, (id, ))
+        matches = self.fetch(FileMatch, sql, (prefix, upper, limit))
+        # The trigram tokenizer needs at least three characters to match anything.
+        if len(matches) >= limit or len(query) < 3:
+            return matches
 
+        seen = {match.file for match in matches}
         sql = '''
-            DELETE FROM invoices
-            WHERE id = ?
+            SELECT billing_files.file, billing_files.count_positions, 'substring'
+            FROM billing_files_fts
+            JOIN billing_files ON billing_files.id = billing_files_fts.rowid
+            WHERE billing_files_fts MATCH ?
+            LIMIT ?;
         '''
+        substrings = [
+            match for match in self.fetch(FileMatch, sql, (self.fts_phrase(query), limit + len(seen)))
+            if match.file not in seen
+        ]
+        substrings.sort(key=lambda match: (match.file.lower().find(prefix), match.file))
+        matches += substrings[:limit - len(matches)]
+        if len(matches) >= limit:
+            return matches
 
-        self.execute(sql, (id, ), commit=True)
+        seen = {match.file for match in matches}
+        trigrams = {prefix[i:i + 3] for i in range(len(prefix) - 2)}
+        sql = '''
+            SELECT billing_files.file, billing_files.count_positions, 'fuzzy'
+            FROM billing_files_fts
+            JOIN billing_files ON billing_files.id = billing_files_fts.rowid
+            WHERE billing_files_fts MATCH ?
+            ORDER BY billing_files_fts.rank
+            LIMIT ?;
+        '''
+        candidates = self.fetch(FileMatch, sql, (' OR '.join(map(self.fts_phrase, sorted(trigrams))), 5 * limit))
+        scored = [
+            (difflib.SequenceMatcher(None, prefix, match.file.lower()).ratio(), match)
+            for match in candidates if match.file not in seen
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1].file))
+        matches += [match for ratio, match in scored if ratio >= 0.6][:limit - len(matches)]
+        return matches
+
+    # FILE LEDGER
 
-    def get_all_invoices(self) -> list:
+    def get_files(self, order: str = 'open', limit: int = 100, offset: int = 0, open_only: bool = False) -> list[FileTotals]:
+        # Reads the per-file totals kept up to date by the billing_summaries_* triggers.
+        sql = f'''
+            SELECT {self.columns(FILE_TOTALS_COLUMNS)}
+            FROM billing_files
+            {'WHERE open_earned_cents > 0' if open_only else ''}
+            ORDER BY {FILE_ORDERS[order]}
+            LIMIT ? OFFSET ?;
+        '''
+        return self.fetch(FileTotals, sql, (limit, offset))
+
+    def get_file_totals(self, file: str) -> FileTotals | None:
+        sql = f'''
+            SELECT {self.columns(FILE_TOTALS_COLUMNS)}
+            FROM billing_files
+            WHERE file = ?;
+        '''
+        files = self.fetch(FileTotals, sql, (file, ))
+
+        if len(files) != 1:
+            return None
+        return files[0]
+
+    def get_file_ledger(self, file: str) -> list[LedgerEntry]:
+        # The positions of one file in date order with running totals; balance is billed minus invoiced so far.
+        sql = f'''
+            SELECT
+                billing_positions.id, billing_positions.date AS "date [yyyymmdd]",
+                billing_positions.billed_cents AS "billed_amount [{self.money}]",
+                billing_positions.earned_cents AS "earned_amount [{self.money}]",
+                billing_positions.invoiced_cents AS "invoiced_amount [{self.money}]", billing_positions.invoice_id,
+                invoices.date AS "invoice_date [yyyymmdd]",
+                sum(IFNULL(billing_positions.billed_cents, 0)) OVER ledger AS "running_billed [{self.money}]",
+                sum(billing_positions.earned_cents) OVER ledger AS "running_earned [{self.money}]",
+                sum(IFNULL(billing_positions.invoiced_cents, 0)) OVER ledger AS "running_invoiced [{self.money}]",
+                sum(IFNULL(billing_positions.billed_cents, 0) - IFNULL(billing_positions.invoiced_cents, 0)) OVER ledger AS "balance [{self.money}]"
+            FROM billing_positions
+            LEFT OUTER JOIN invoices ON invoices.id = billing_positions.invoice_id
+            WHERE billing_positions.file = ?
+            WINDOW ledger AS (ORDER BY billing_positions.date, billing_positions.id)
+            ORDER BY billing_positions.date, billing_positions.id;
+        '''
+        return self.fetch(LedgerEntry, sql, (file, ))
+
+    # ANALYTICS
+
+    def get_analytics_rows(self) -> list[tuple]:
+        # One bulk read of the columns analytics.py aggregates: file, month (YYYYMM), billed hours, billed,
+        # earned and invoiced cents and whether the position is billed and on an invoice. Ordered by file,
+        # so files are numbered by comparing neighbours instead of a lookup per row.
         sql = '''
-            SELECT invoices.id, invoices.date, IFNULL(sum(billing_positions.invoiced_amount), 0) AS total
+            SELECT file, date / 100, IFNULL(billed_hours, 0), IFNULL(billed_cents, 0), earned_cents, IFNULL(invoiced_cents, 0),
+                billed_cents IS NOT NULL, invoice_id IS NOT NULL
+            FROM billing_positions
+            ORDER BY file;
+        '''
+        _, rows = self.execute(sql)
+        return rows
+
+    # INVOICES
+
+    @mutation
+    def add_invoice(self, date: datetime) -> int:
+        sql = f'INSERT INTO invoices (id, date) VALUES ({NEXT_INVOICE_ID}, ?);'
+        with self.transaction():
+            self.invalidate('invoices')
+            self.execute(sql, (date.date().strftime('%Y%m%d'), ), commit=True)
+        return self.last_row_id
+    
+    @mutation
+    def update_invoice(self, id: int, date: datetime) -> None:
+        sql = 'UPDATE invoices SET date = ? WHERE id = ?;'
+        with self.transaction():
+            self.invalidate('invoices')
+            self.execute(sql, (date.date().strftime('%Y%m%d'), id), commit=True)
+
+    @mutation
+    def remove_invoice(self, id: int) -> None:
+        with self.transaction():
+            self.invalidate('statistics', 'invoices')
+
+            sql = '''
+                UPDATE billing_positions
+                SET invoiced_cents = NULL, invoice_id = NULL
+                WHERE invoice_id = ?;
+            '''
+            self.execute(sql, (id, ))
+
+            sql = '''
+                DELETE FROM invoices
+                WHERE id = ?
+            '''
+            self.execute(sql, (id, ), commit=True)
+
+    def get_all_invoices(self) -> list[Invoice]:
+        # Archived invoices are listed from archived_invoices, which keeps their totals in the hot database.
+        sql = f'''
+            SELECT invoices.id, invoices.date AS "date [yyyymmdd]", (
+                SELECT IFNULL(sum(billing_positions.invoiced_cents), 0)
+                FROM billing_positions
+                WHERE billing_positions.invoice_id = invoices.id
+            ) AS "total [{self.money}]"
             FROM invoices
-            LEFT OUTER JOIN billing_positions ON invoices.id = billing_positions.invoice_id
-            GROUP BY invoices.id
-            ORDER BY invoices.date;
+            UNION ALL
+            SELECT id, date, total_cents
+            FROM archived_invoices
+            ORDER BY 2;
         '''
-        self.execute(sql)
-        
-        invoices = [dict(zip(self.row_keys, row_value)) for row_value in self.row_values]
-        return invoices
+        return self.fetch(Invoice, sql)
     
-    def get_invoice(self, id: int) -> dict | None:
-        sql = '''
-            SELECT invoices.id, invoices.date, sum(billing_positions.invoiced_amount) AS total
+    def get_invoice(self, id: int) -> Invoice | None:
+        sql = f'''
+            SELECT invoices.id, invoices.date AS "date [yyyymmdd]", IFNULL(sum(billing_positions.invoiced_cents), 0) AS "total [{self.money}]"
             FROM invoices
             LEFT OUTER JOIN billing_positions ON invoices.id = billing_positions.invoice_id
             WHERE invoices.id = ?
             GROUP BY invoices.id;
         '''
-        self.execute(sql, (id, ))
-        
-        if len(self.row_values) != 1:
+        invoices = self.fetch(Invoice, sql, (id, ))
+        if not invoices:
+            sql = f'''
+                SELECT id, date AS "date [yyyymmdd]", total_cents AS "total [{self.money}]"
+                FROM archived_invoices
+                WHERE id = ?;
+            '''
+            invoices = self.fetch(Invoice, sql, (id, ))
+
+        if len(invoices) != 1:
             return None
-        
-        invoice = dict(zip(self.row_keys, self.row_values[0]))
-        return self.format_invoice(**invoice)
+        return invoices[0]
+
+    # ARCHIVES
+
+    def archive_path(self, year: int) -> str:
+        return os.path.join(os.path.dirname(self.db_path), 'archive', f'{year}.sqlite')
+
+    def get_archived_years(self) -> list[int]:
+        _, rows = self.execute('SELECT year FROM archives ORDER BY year;')
+        return [year for year, in rows]
+
+    def get_invoice_archive(self, id: int) -> int | None:
+        # The year whose archive holds the invoice, None for invoices in the hot database.
+        _, rows = self.execute('SELECT year FROM archived_invoices WHERE id = ?;', (id, ))
+        return rows[0][0] if rows else None
+
+    def attach_archive(self, year: int) -> str:
+        # Archives are attached on first use as archive_<year> and stay attached to the pooled connection.
+        # They are never written again (archive.py makes them read-only), so immutable=1 skips locking.
+        schema = f'archive_{int(year)}'
+        _, rows = self.execute('PRAGMA database_list;')
+        attached = [name for _, name, _ in rows if name.startswith('archive_')]
+        if schema in attached:
+            return schema
+
+        for name in attached[:len(attached) - MAX_ATTACHED_ARCHIVES + 1]:
+            self.execute(f'DETACH DATABASE {name};')
+        path = self.archive_path(year)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'Archive of {year} is missing: {path}')
+        self.execute(f'ATTACH DATABASE ? AS {schema};', (f'file:{quote(path)}?mode=ro&immutable=1', ))
+        return schema
+
+    def stream_archives(self, years: list[int], sql: str, parameters: tuple = ()) -> tuple[list[str], Iterator[tuple]]:
+        # Streams sql over the archives of years, oldest first, and then over the hot database, with
+        # {schema} in sql naming the database. Each archive is only attached once the previous one is
+        # exhausted, so any number of years can be read.
+        schemas = [*years, 'main']
+
+        def source(schema: int | str) -> tuple[list[str], Iterator[tuple]]:
+            if schema != 'main':
+                schema = self.attach_archive(schema)
+            return self.stream(sql.replace('{schema}', schema), parameters)
+
+        keys, first = source(schemas[0])
+        return keys, itertools.chain(first, itertools.chain.from_iterable(source(schema)[1] for schema in schemas[1:]))
+
+    # EXPORTS
+
+    @staticmethod
+    def iso_date(column: str) -> str:
+        return f"printf('%04d-%02d-%02d', {column} / 10000, {column} / 100 % 100, {column} % 100)"
+
+    @staticmethod
+    def where(conditions: list[str]) -> str:
+        return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    def export_billing_positions(self, year: int | None = None, file: str | None = None, invoice_id: int | None = None) -> tuple[list[str], Iterator[tuple]]:
+        conditions = []
+        parameters = []
+        if year is not None:
+            conditions.append('billing_positions.date BETWEEN ? AND ?')
+            parameters.extend((year * 10000, year * 10000 + 9999))
+        if file:
+            conditions.append('file = ?')
+            parameters.append(file)
+        if invoice_id is not None:
+            conditions.append('invoice_id = ?')
+            parameters.append(invoice_id)
+
+        # Years are archived oldest first, so the archives' rows precede the hot ones in date order.
+        years = self.get_archived_years()
+        if year is not None:
+            years = [archived for archived in years if archived == year]
+        if invoice_id is not None:
+            invoice_year = self.get_invoice_archive(invoice_id)
+            years = [archived for archived in years if archived == invoice_year]
+
+        sql = f'''
+            SELECT id, {self.iso_date('date')} AS date, file, hourly_rate, billed_hours,
+                billed_cents / 100.0 AS billed_amount, earned_cents / 100.0 AS earned_amount,
+                invoiced_cents / 100.0 AS invoiced_amount, invoice_id
+            FROM {{schema}}.billing_positions AS billing_positions
+            {self.where(conditions)}
+            ORDER BY billing_positions.date, id;
+        '''
+        return self.stream_archives(years, sql, tuple(parameters))
+
+    def export_invoices(self, year: int | None = None, invoice_id: int | None = None) -> tuple[list[str], Iterator[tuple]]:
+        conditions = []
+        parameters = []
+        if year is not None:
+            conditions.append('invoices.date BETWEEN ? AND ?')
+            parameters.extend((year * 10000, year * 10000 + 9999))
+        if invoice_id is not None:
+            conditions.append('invoices.id = ?')
+            parameters.append(invoice_id)
+
+        # Archived invoices come from archived_invoices, no archive has to be attached.
+        sql = f'''
+            SELECT id, {self.iso_date('date')} AS date, total
+            FROM (
+                SELECT invoices.id, invoices.date, (
+                    SELECT IFNULL(sum(billing_positions.invoiced_cents), 0)
+                    FROM billing_positions
+                    WHERE billing_positions.invoice_id = invoices.id
+                ) / 100.0 AS total
+                FROM invoices
+                {self.where(conditions)}
+                UNION ALL
+                SELECT invoices.id, invoices.date, invoices.total_cents / 100.0
+                FROM archived_invoices AS invoices
+                {self.where(conditions)}
+            ) AS invoices
+            ORDER BY invoices.date, invoices.id;
+        '''
+        return self.stream(sql, tuple(parameters) * 2)
+
+    def export_invoice_items(self, year: int | None = None, file: str | None = None, invoice_id: int | None = None) -> tuple[list[str], Iterator[tuple]]:
+        conditions = []
+        parameters = []
+        if year is not None:
+            conditions.append('invoices.date BETWEEN ? AND ?')
+            parameters.extend((year * 10000, year * 10000 + 9999))
+        if invoice_id is not None:
+            conditions.append('invoices.id = ?')
+            parameters.append(invoice_id)
+
+        # Only the archives holding matching invoices are read. An archived year's invoices may be dated
+        # early in the next year, so at that boundary the order is by invoice date within each database.
+        _, rows = self.execute(f'''
+            SELECT DISTINCT year
+            FROM archived_invoices AS invoices
+            {self.where(conditions)}
+            ORDER BY year;
+        ''', tuple(parameters))
+        years = [archived for archived, in rows]
+
+        if file:
+            conditions.append('billing_positions.file = ?')
+            parameters.append(file)
+
+        sql = f'''
+            SELECT invoices.id AS invoice_id, {self.iso_date('invoices.date')} AS invoice_date,
+                billing_positions.id AS billing_position_id, {self.iso_date('billing_positions.date')} AS date,
+                billing_positions.file, billing_positions.earned_cents / 100.0 AS earned_amount,
+                billing_positions.invoiced_cents / 100.0 AS invoiced_amount
+            FROM {{schema}}.invoices AS invoices
+            JOIN {{schema}}.billing_positions AS billing_positions ON billing_positions.invoice_id = invoices.id
+            {self.where(conditions)}
+            ORDER BY invoices.date, invoices.id, billing_positions.file, billing_positions.date;
+        '''
+        return self.stream_archives(years, sql, tuple(parameters))
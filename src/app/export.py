@@ -0,0 +1,97 @@
+import io
+import os
+import csv
+import json
+from typing import Iterator
+from flask import Flask, Blueprint, Response, current_app, request, abort, stream_with_context, g
+from .db import DB
+from .jobs import job, submitted
+from .utils import optional_int
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+ROWS_PER_CHUNK = 500
+
+def csv_chunks(keys: list[str], rows: Iterator[tuple]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(keys)
+    for index, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_chunks(keys: list[str], rows: Iterator[tuple]) -> Iterator[str]:
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(keys, row)), separators=(',', ':')))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def export_chunks(database: DB, kind: str, format: str, year: int | None, file: str | None, invoice_id: int | None) -> Iterator[str]:
+    match kind:
+        case 'billing_positions':
+            keys, rows = database.export_billing_positions(year, file, invoice_id)
+        case 'invoices':
+            keys, rows = database.export_invoices(year, invoice_id)
+        case 'invoice_items':
+            keys, rows = database.export_invoice_items(year, file, invoice_id)
+        case _:
+            raise ValueError(f'Unknown export "{kind}"')
+    if format not in FORMATS:
+        raise ValueError(f'Unknown export format "{format}"')
+    return csv_chunks(keys, rows) if format == 'csv' else ndjson_chunks(keys, rows)
+
+@job('export')
+def export_job(job_id: int, kind: str, format: str, year: int | None = None, file: str | None = None, invoice_id: int | None = None) -> dict:
+    # Writes the export to the job's output folder, from where /jobs/<id>/download serves it.
+    if kind == 'invoices' and file is not None:
+        raise ValueError('Invoices cannot be filtered by file')
+    chunks = export_chunks(DB(current_app), kind, format, year, file, invoice_id)
+    queue = current_app.extensions['jobs']
+    name = f'{kind}.{format}'
+    path = queue.output_path(job_id, name)
+    partial_path = f'{path}.partial'
+    size = 0
+    with open(partial_path, 'w', encoding='utf-8', newline='') as export_file:
+        for chunk in chunks:
+            size += export_file.write(chunk)
+    os.replace(partial_path, path)
+    return {'download': os.path.basename(path), 'name': name, 'size': size}
+
+def register(app: Flask) -> None:
+    bp = Blueprint('export', __name__, url_prefix='/export')
+
+    @bp.route('/<any(billing_positions, invoices, invoice_items):kind>.<any(csv, ndjson):format>')
+    def export(kind: str, format: str):
+        database = DB(current_app)
+
+        year = optional_int(request.args.get('year', ''))
+        file = request.args.get('file', '').replace(' ', '') or None
+        invoice_id = optional_int(request.args.get('invoice_id', ''))
+
+        if kind == 'invoices' and file is not None:
+            abort(400)
+
+        # ?background=1 writes the export in a job worker and answers 202 with the job to poll;
+        # without running job workers the export is streamed as usual.
+        jobs = current_app.extensions['jobs']
+        if request.args.get('background') and jobs.available():
+            return submitted(jobs.submit('export', {'kind': kind, 'format': format, 'year': year, 'file': file, 'invoice_id': invoice_id}, g.get('tenant')))
+
+        return Response(
+            stream_with_context(export_chunks(database, kind, format, year, file, invoice_id)),
+            mimetype=FORMATS[format],
+            headers={'Content-Disposition': f'attachment; filename={kind}.{format}'}
+        )
+
+    app.register_blueprint(bp)
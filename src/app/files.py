@@ -0,0 +1,48 @@
+from flask import Flask, Blueprint, render_template, current_app, request, url_for, abort
+from .db import DB, FILE_ORDERS
+from .caching import conditional
+from .utils import optional_int
+
+PAGE_SIZE = 100
+
+def register(app: Flask) -> Blueprint:
+    bp = Blueprint('files', __name__, url_prefix='/files')
+
+    @bp.route('/')
+    @conditional
+    def home():
+        database = DB(current_app)
+
+        order = request.args.get('order', 'open')
+        if order not in FILE_ORDERS:
+            order = 'open'
+        open_only = request.args.get('open') == '1'
+        page = max(optional_int(request.args.get('page', '')) or 1, 1)
+
+        files = database.get_files(order, PAGE_SIZE + 1, (page - 1) * PAGE_SIZE, open_only)
+        link_args = {'order': order, **({'open': 1} if open_only else {})}
+        return render_template(
+            'files/home.html.jinja2',
+            files=files[:PAGE_SIZE],
+            order=order,
+            open_only=open_only,
+            previous_url=url_for('.home', page=page - 1, **link_args) if page > 1 else None,
+            next_url=url_for('.home', page=page + 1, **link_args) if len(files) > PAGE_SIZE else None
+        )
+
+    @bp.route('/<path:file>')
+    @conditional
+    def ledger(file: str):
+        database = DB(current_app)
+
+        totals = database.get_file_totals(file)
+        if totals is None:
+            abort(404)
+        return render_template(
+            'files/ledger.html.jinja2',
+            totals=totals,
+            ledger=database.get_file_ledger(file)
+        )
+
+    app.register_blueprint(bp)
+    return bp
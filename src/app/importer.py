@@ -0,0 +1,35 @@
+import csv
+from typing import Iterable
+from .db import DB
+from .billing import parse_billing_position
+
+REQUIRED_COLUMNS = ('date', 'file')
+
+def import_billing_positions(database: DB, lines: Iterable[str], chunk_size: int = 1000) -> dict:
+    # Validates every CSV row like the billing.add form and inserts the valid ones in chunked
+    # transactions. Returns the number of imported rows and a list of (line, message) errors.
+    report = {'imported': 0, 'errors': []}
+
+    reader = csv.DictReader(lines)
+    columns = [column.strip().lower() for column in reader.fieldnames or []]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        report['errors'].append((1, f"Missing column(s): {', '.join(missing)}"))
+        return report
+    reader.fieldnames = columns
+
+    chunk = []
+    for row in reader:
+        billing_position, error = parse_billing_position({key: (value or '').strip() for key, value in row.items() if key is not None})
+        if error is not None:
+            report['errors'].append((reader.line_num, error))
+            continue
+
+        chunk.append(billing_position)
+        if len(chunk) == chunk_size:
+            report['imported'] += database.add_billing_positions(chunk)
+            chunk = []
+
+    if chunk:
+        report['imported'] += database.add_billing_positions(chunk)
+    return report
@@ -0,0 +1,243 @@
+import os
+import time
+import random
+import cProfile
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from jinja2 import Template
+from flask import Flask, Response, current_app, request, g, has_request_context
+
+# Upper bounds in seconds, shared by all histograms.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    # Prometheus histogram per label set. Values are kept in this process only, so with several
+    # gunicorn workers each scrape of /metrics sees the worker that happened to answer it.
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = defaultdict(lambda: [[0] * (len(BUCKETS) + 1), 0.0])
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(BUCKETS, value)
+        with self._lock:
+            series = self.series[label_values]
+            series[0][index] += 1
+            series[1] += value
+
+    def exposition(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in sorted(self.series.items())]
+        for label_values, counts, total in series:
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'), ), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int, *label_values: str) -> None:
+        with self._lock:
+            self.series[label_values] += amount
+
+    def exposition(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self.series.items())
+        for label_values, value in series:
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def sql_operation(sql: str) -> str:
+    # Labels statements by their verb; labelling by the statement itself would explode the series.
+    words = sql.split(None, 1)
+    return words[0].upper().rstrip(';') if words else ''
+
+
+class Instrumentation:
+
+    def __init__(self, metrics: bool = False, server_timing: bool = False) -> None:
+        self.metrics = metrics
+        self.server_timing = server_timing
+        self.requests = Histogram('app_request_duration_seconds', 'Wall time of requests.', ('endpoint', 'method', 'status'))
+        self.sql = Histogram('app_sql_duration_seconds', 'Execution time of SQL statements.', ('operation', ))
+        self.sql_rows = Counter('app_sql_rows_total', 'Rows returned or changed by SQL statements.', ('operation', ))
+        self.renders = Histogram('app_template_render_seconds', 'Render time of templates.', ('template', ))
+
+    def observe_sql(self, sql: str, duration: float, rows: int) -> None:
+        operation = sql_operation(sql)
+        if self.metrics:
+            self.sql.observe(duration, operation)
+            self.sql_rows.inc(max(rows, 0), operation)
+        if has_request_context() and 'request_timing' in g:
+            g.request_timing['sql'] += duration
+            g.request_timing['sql_count'] += 1
+
+    def observe_render(self, template_name: str, duration: float) -> None:
+        if self.metrics:
+            self.renders.observe(duration, template_name or '')
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in (self.requests, self.sql, self.sql_rows, self.renders):
+            lines += metric.exposition()
+        return '\n'.join(lines) + '\n'
+
+
+class TimedTemplate(Template):
+    # Installed as the environment's template_class. Templates rendered inside another one
+    # (cached_render fragments) count towards their own histogram but not twice towards the request.
+
+    def render(self, *args, **kwargs) -> str:
+        instrumentation = current_app.extensions.get('instrumentation') if has_request_context() else None
+        if instrumentation is None:
+            return super().render(*args, **kwargs)
+
+        timing = g.get('request_timing')
+        if timing is not None:
+            timing['render_depth'] += 1
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            instrumentation.observe_render(self.name, duration)
+            if timing is not None:
+                timing['render_depth'] -= 1
+                if timing['render_depth'] == 0:
+                    timing['render'] += duration
+
+
+class SlowRequestProfiler:
+    # Profiles a sample of requests and keeps the profile of those slower than threshold.
+    # Only one request is profiled at a time, as the profiler hooks are per interpreter.
+
+    def __init__(self, directory: str, threshold: float, sample_rate: float = 0.1, keep: int = 100) -> None:
+        self.directory = directory
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def start(self) -> cProfile.Profile | None:
+        if random.random() >= self.sample_rate or not self._lock.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self._lock.release()
+            return None
+        return profile
+
+    def stop(self, profile: cProfile.Profile, duration: float, endpoint: str) -> str | None:
+        try:
+            profile.disable()
+        finally:
+            self._lock.release()
+        if duration < self.threshold:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{endpoint}-{int(duration * 1000)}ms.prof')
+        profile.dump_stats(path)
+        self.apply_retention()
+        return path
+
+    def apply_retention(self) -> None:
+        profiles = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith('.prof')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in profiles[:max(len(profiles) - self.keep, 0)]:
+            os.remove(entry.path)
+
+
+def before_request() -> None:
+    g.request_timing = {'start': time.perf_counter(), 'sql': 0.0, 'sql_count': 0, 'render': 0.0, 'render_depth': 0}
+    profiler = current_app.extensions.get('profiler')
+    g.request_profile = profiler.start() if profiler is not None else None
+
+def after_request(response: Response) -> Response:
+    timing = g.get('request_timing')
+    if timing is None:
+        return response
+    duration = time.perf_counter() - timing['start']
+    endpoint = request.endpoint or 'unmatched'
+
+    if g.request_profile is not None:
+        current_app.extensions['profiler'].stop(g.request_profile, duration, endpoint)
+        g.request_profile = None
+
+    instrumentation = current_app.extensions['instrumentation']
+    if instrumentation.metrics:
+        instrumentation.requests.observe(duration, endpoint, request.method, str(response.status_code))
+    if instrumentation.server_timing:
+        response.headers['Server-Timing'] = ', '.join((
+            f'sql;dur={timing["sql"] * 1000:.2f};desc="{timing["sql_count"]} queries"',
+            f'render;dur={timing["render"] * 1000:.2f}',
+            f'app;dur={duration * 1000:.2f}',
+        ))
+    return response
+
+def teardown_request(exception: BaseException | None = None) -> None:
+    # after_request is skipped when the view raised, the profiler must still be released.
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        current_app.extensions['profiler'].stop(profile, 0.0, request.endpoint or 'unmatched')
+
+def metrics() -> Response:
+    exposition = current_app.extensions['instrumentation'].exposition()
+    if current_app.extensions.get('write_queue') is not None:
+        exposition += current_app.extensions['write_queue'].exposition()
+    return Response(exposition, mimetype='text/plain; version=0.0.4')
+
+def init_app(app: Flask) -> None:
+    # Nothing is hooked in unless one of the features is enabled; DB only checks for the extension.
+    enabled = app.config.get('METRICS', False)
+    server_timing = app.config.get('SERVER_TIMING', False)
+    profile_slow_ms = app.config.get('PROFILE_SLOW_MS')
+
+    app.extensions['instrumentation'] = None
+    app.extensions['profiler'] = None
+    if not (enabled or server_timing or profile_slow_ms is not None):
+        return
+
+    app.extensions['instrumentation'] = Instrumentation(metrics=enabled, server_timing=server_timing)
+    if profile_slow_ms is not None:
+        app.extensions['profiler'] = SlowRequestProfiler(
+            os.path.join(app.instance_path, 'profiles'),
+            profile_slow_ms / 1000,
+            app.config.get('PROFILE_SAMPLE_RATE', 0.1),
+            app.config.get('PROFILE_KEEP', 100)
+        )
+
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    if enabled:
+        app.add_url_rule('/metrics', 'metrics', metrics)
@@ -1,18 +1,20 @@
 from datetime import datetime
 from flask import Flask, Blueprint, render_template, current_app, request, url_for, redirect, flash, abort
 from .db import DB
-from .utils import optional_float
+from .caching import conditional
+from .utils import optional_decimal, optional_int
 
 def register(app: Flask) -> Blueprint:
     bp = Blueprint('invoicing', __name__, url_prefix='/invoicing')
 
     @bp.route('/')
+    @conditional
     def home():
         database = DB(current_app)
 
         return render_template(
             'invoicing/home.html.jinja2',
-            invoices = database.get_all_invoices()
+            load_invoices = database.get_all_invoices
         )
 
     @bp.route('/add', methods=['GET', 'POST'])
@@ -35,15 +37,22 @@ def register(app: Flask) -> Blueprint:
 
     @bp.route('/invoice/<int:invoice_id>', methods=['GET', 'POST'])
     def invoice(invoice_id: int):
+        database = DB(current_app)
+        # Foreign keys are enforced, positions cannot be booked on an invoice that does not exist.
+        if database.get_invoice(invoice_id) is None:
+            abort(404)
 
         if request.method == 'GET':
             return render_template(
                 'invoicing/invoice.html.jinja2',
                 invoice_id=invoice_id
             )
-        
+
+        if database.get_invoice_archive(invoice_id) is not None:
+            flash(('error', f'Invoice {invoice_id} is archived and cannot be changed.'))
+            return redirect(url_for('.edit', invoice_id=invoice_id))
+
         file = request.form.get('file')
-        database = DB(current_app)
         if file is not None:
             open_billing_positions = database.get_open_billing_positions(file.replace(' ', ''))
             return render_template(
@@ -52,19 +61,23 @@ def register(app: Flask) -> Blueprint:
                 open_billing_positions=open_billing_positions
             )
 
-        invoice_amount = optional_float(request.form.get('invoice_amount'))
+        invoice_amount = optional_decimal(request.form.get('invoice_amount'))
 
         if invoice_amount is None:
             flash(('error', f'Amount for invoice not valid.'))
-            redirect(url_for('.invoice', invoice_id=invoice_id))
-
-        billing_position_ids_to_invoice = [int(id) for id in request.form.getlist('billing_position_id[]')]
-        for index, billing_position_id in enumerate(billing_position_ids_to_invoice):
-            if index < len(billing_position_ids_to_invoice) - 1:
-                database.invoice_billing_position(billing_position_id, 0.0, invoice_id)
-            else:
-                database.invoice_billing_position(billing_position_id, invoice_amount, invoice_id)
-                flash(('info', f'Successfully invoiced an amount of {invoice_amount}.'))
+            return redirect(url_for('.invoice', invoice_id=invoice_id))
+
+        # The whole invoiced amount is booked on the last selected position, the others are marked with 0.
+        billing_position_ids_to_invoice = [optional_int(id) for id in request.form.getlist('billing_position_id[]')]
+        if None in billing_position_ids_to_invoice:
+            flash(('error', 'The selected billing positions contain errors.'))
+            return redirect(url_for('.invoice', invoice_id=invoice_id))
+        invoiced_amounts = [(billing_position_id, 0) for billing_position_id in billing_position_ids_to_invoice[:-1]]
+        invoiced_amounts += [(billing_position_id, invoice_amount) for billing_position_id in billing_position_ids_to_invoice[-1:]]
+
+        if invoiced_amounts:
+            database.invoice_billing_positions(invoiced_amounts, invoice_id)
+            flash(('info', f'Successfully invoiced an amount of {invoice_amount}.'))
         return redirect(url_for('.invoice', invoice_id=invoice_id))
 
     @bp.route('/remove/<int:invoice_id>', methods=['GET', 'POST'])
@@ -80,24 +93,35 @@ def register(app: Flask) -> Blueprint:
         if request.form.get('confirmation') != 'yes':
             flash(('error', 'Removing not confirmed properly'))
             return redirect(url_for('.remove', invoice_id=invoice_id))
+        if database.get_invoice_archive(invoice_id) is not None:
+            flash(('error', f'Invoice {invoice_id} is archived and cannot be removed.'))
+            return redirect(url_for('.home'))
         
         database.remove_invoice(invoice_id)
         flash(('info', 'Successfully removed invoice'))
         return redirect(url_for('.home'))
 
     @bp.route('/edit/<int:invoice_id>', methods=['GET', 'POST'])
+    @conditional
     def edit(invoice_id: int):
 
         database = DB(current_app)
+        invoice = database.get_invoice(invoice_id)
+        if invoice is None:
+            abort(404)
 
         if request.method == 'GET':
-            invoice = database.get_invoice(invoice_id)
             return render_template(
                 'invoicing/edit.html.jinja2',
                 invoice=invoice,
-                invoiced_billing_positions=database.get_invoiced_billing_positions(invoice_id)
+                invoiced_billing_positions=database.get_invoiced_billing_positions(invoice_id),
+                archived=database.get_invoice_archive(invoice_id)
             )
         
+        if database.get_invoice_archive(invoice_id) is not None:
+            flash(('error', f'Invoice {invoice_id} is archived and cannot be changed.'))
+            return redirect(url_for('.edit', invoice_id=invoice_id))
+
         date = request.form.get('date')
 
         try:
@@ -109,8 +133,20 @@ def register(app: Flask) -> Blueprint:
         billing_position_ids = request.form.getlist('billing_position_ids[]')
         billing_position_invoiced_amounts = request.form.getlist('billing_position_invoiced_amounts[]')
 
-        for billing_position_id, billing_position_invoiced_amount in zip(billing_position_ids, billing_position_invoiced_amounts):
-            database.invoice_billing_position(billing_position_id, billing_position_invoiced_amount, invoice_id)
+        invoiced_amounts = [
+            (optional_int(billing_position_id), optional_decimal(billing_position_invoiced_amount))
+            for billing_position_id, billing_position_invoiced_amount in zip(billing_position_ids, billing_position_invoiced_amounts)
+        ]
+
+        if any(billing_position_id is None for billing_position_id, _ in invoiced_amounts):
+            flash(('error', 'The billing positions contain errors.'))
+            return redirect(url_for('.edit', invoice_id=invoice_id))
+
+        if any(invoiced_amount is None for _, invoiced_amount in invoiced_amounts):
+            flash(('error', 'The invoiced amounts contain errors.'))
+            return redirect(url_for('.edit', invoice_id=invoice_id))
+
+        database.invoice_billing_positions(invoiced_amounts, invoice_id)
 
         flash(('info', f'Successfully edited invoice {invoice_id}'))
         return redirect(url_for('.home'))
@@ -0,0 +1,422 @@
+import os
+import json
+import time
+import signal
+import sqlite3
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable
+from flask import Flask, Blueprint, current_app, request, jsonify, url_for, send_from_directory, abort, g
+from .db import DB
+from .backup import get_backup_manager
+
+# Job functions by kind. They run in a job worker inside an app context, are called with the job id
+# and the job's arguments as keyword arguments, and return a JSON serialisable result.
+JOB_KINDS: dict[str, Callable] = {}
+
+# Daily local times of the recurring jobs, by kind; JOB_SCHEDULE replaces it. Nightly backups are
+# opt-in, e.g. JOB_SCHEDULE = {"backup": "02:00", "rebuild_statistics": "03:00"}.
+DEFAULT_SCHEDULE = {'rebuild_statistics': '03:00'}
+
+JOB_COLUMNS = ('id', 'kind', 'tenant', 'arguments', 'status', 'result', 'error', 'created', 'started', 'finished')
+
+def job(kind: str) -> Callable:
+    def register_kind(fn: Callable) -> Callable:
+        JOB_KINDS[kind] = fn
+        return fn
+    return register_kind
+
+
+@job('backup')
+def backup_job(job_id: int) -> dict:
+    backup_manager = get_backup_manager(current_app)
+    # Jobs recur unattended, so without a configured retention they keep the newest JOB_BACKUP_KEEP.
+    if backup_manager.keep is None and backup_manager.max_age_days is None:
+        backup_manager.keep = current_app.config.get('JOB_BACKUP_KEEP', 14)
+    if not backup_manager.start(background=False):
+        return {'started': False, 'reason': 'A backup is running or the last one is too recent'}
+    status = backup_manager.status()
+    if status['status'] == 'failed':
+        raise RuntimeError(status.get('error'))
+    return {'started': True, **status}
+
+
+@job('rebuild_statistics')
+def rebuild_statistics_job(job_id: int) -> dict:
+    database = DB(current_app)
+    drift = database.get_statistics_drift()
+    if drift:
+        database.rebuild_statistics()
+    return {'drifted_years': [(stored or computed)['year'] for stored, computed in drift]}
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def next_run(at: str, now: float) -> float:
+    # The next occurrence of the local time HH:MM after now.
+    hour, minute = (int(part) for part in at.split(':'))
+    current = datetime.fromtimestamp(now)
+    run = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run.timestamp() <= now:
+        run += timedelta(days=1)
+    return run.timestamp()
+
+
+class JobQueue:
+    # Jobs live in instance/jobs.sqlite, shared by the web workers that submit them and the job
+    # workers that run them (see start_workers). Every call opens its own short-lived connection,
+    # so nothing leaks across the forks of gunicorn's master. In multi-user mode each job belongs
+    # to the user (tenant) that submitted it; scheduled jobs have none and run for every user.
+
+    def __init__(self, path: str, output_folder: str, poll_interval: float = 1.0, keep_days: float = 7, schedule: dict | None = None) -> None:
+        self.path = path
+        self.output_folder = output_folder
+        self.poll_interval = poll_interval
+        self.keep_days = keep_days
+        self.schedule = schedule if schedule is not None else DEFAULT_SCHEDULE
+        self.last_prune = 0.0
+
+        with self.connection() as connection:
+            connection.execute('PRAGMA journal_mode = WAL;')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id integer PRIMARY KEY,
+                    kind text NOT NULL,
+                    tenant text,
+                    arguments text NOT NULL,
+                    status text NOT NULL,
+                    result text,
+                    error text,
+                    created real NOT NULL,
+                    started real,
+                    finished real,
+                    worker integer
+                );
+            ''')
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (id) WHERE status = 'queued';")
+            if 'tenant' not in [column[1] for column in connection.execute('PRAGMA table_info(jobs);')]:
+                connection.execute('ALTER TABLE jobs ADD COLUMN tenant text;')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_tenant ON jobs (tenant, id);')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS schedules (
+                    kind text PRIMARY KEY,
+                    at text NOT NULL,
+                    next_run real NOT NULL
+                );
+            ''')
+            connection.execute('CREATE TABLE IF NOT EXISTS workers (pid integer PRIMARY KEY, started real NOT NULL);')
+
+    @contextmanager
+    def connection(self, immediate: bool = False):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            if immediate:
+                connection.execute('BEGIN IMMEDIATE;')
+                try:
+                    yield connection
+                except BaseException:
+                    connection.execute('ROLLBACK;')
+                    raise
+                connection.execute('COMMIT;')
+            else:
+                yield connection
+        finally:
+            connection.close()
+
+    def output_path(self, job_id: int, name: str) -> str:
+        os.makedirs(self.output_folder, exist_ok=True)
+        return os.path.join(self.output_folder, f'{job_id}-{name}')
+
+    # SUBMITTING
+
+    def submit(self, kind: str, arguments: dict | None = None, tenant: str | None = None) -> int:
+        if kind not in JOB_KINDS:
+            raise ValueError(f'Unknown job kind "{kind}"')
+        with self.connection() as connection:
+            return connection.execute(
+                "INSERT INTO jobs (kind, tenant, arguments, status, created) VALUES (?, ?, ?, 'queued', ?);",
+                (kind, tenant, json.dumps(arguments or {}), time.time())
+            ).lastrowid
+
+    def get(self, job_id: int, tenant: str | None = None) -> dict | None:
+        with self.connection() as connection:
+            row = connection.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ? AND tenant IS ?;", (job_id, tenant)).fetchone()
+        return self.format_job(row) if row is not None else None
+
+    def recent(self, limit: int = 50, tenant: str | None = None) -> list[dict]:
+        with self.connection() as connection:
+            rows = connection.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE tenant IS ? ORDER BY id DESC LIMIT ?;",
+                (tenant, limit)
+            ).fetchall()
+        return [self.format_job(row) for row in rows]
+
+    @staticmethod
+    def format_job(row: tuple) -> dict:
+        values = dict(zip(JOB_COLUMNS, row))
+        values['arguments'] = json.loads(values['arguments'])
+        values['result'] = json.loads(values['result']) if values['result'] is not None else None
+        for name in ('created', 'started', 'finished'):
+            values[name] = round(values[name]) if values[name] is not None else None
+        return values
+
+    def available(self) -> bool:
+        # True if a job worker is running, otherwise submitted jobs would only wait in the queue.
+        with self.connection() as connection:
+            pids = [pid for pid, in connection.execute('SELECT pid FROM workers;')]
+        return any(process_alive(pid) for pid in pids)
+
+    # RUNNING
+
+    def register_worker(self, pid: int) -> None:
+        with self.connection(immediate=True) as connection:
+            connection.execute('INSERT OR REPLACE INTO workers (pid, started) VALUES (?, ?);', (pid, time.time()))
+            # Jobs of workers that died are not retried, they may have done part of their work.
+            for job_id, worker in connection.execute("SELECT id, worker FROM jobs WHERE status = 'running';").fetchall():
+                if not process_alive(worker):
+                    connection.execute(
+                        "UPDATE jobs SET status = 'failed', error = 'Worker died', finished = ? WHERE id = ?;",
+                        (time.time(), job_id)
+                    )
+            for pid, in connection.execute('SELECT pid FROM workers;').fetchall():
+                if not process_alive(pid):
+                    connection.execute('DELETE FROM workers WHERE pid = ?;', (pid, ))
+
+    def unregister_worker(self, pid: int) -> None:
+        with self.connection() as connection:
+            connection.execute('DELETE FROM workers WHERE pid = ?;', (pid, ))
+
+    def sync_schedule(self) -> None:
+        now = time.time()
+        with self.connection(immediate=True) as connection:
+            stored = dict(connection.execute('SELECT kind, at FROM schedules;').fetchall())
+            for kind in stored.keys() - self.schedule.keys():
+                connection.execute('DELETE FROM schedules WHERE kind = ?;', (kind, ))
+            for kind, at in self.schedule.items():
+                if stored.get(kind) != at:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO schedules (kind, at, next_run) VALUES (?, ?, ?);',
+                        (kind, at, next_run(at, now))
+                    )
+
+    def claim(self, pid: int) -> tuple[int, str, str | None, dict] | None:
+        # Queues the recurring jobs that are due and takes the oldest queued job, in one write
+        # transaction so that two workers never run the same job or schedule.
+        now = time.time()
+        with self.connection(immediate=True) as connection:
+            for kind, at in connection.execute('SELECT kind, at FROM schedules WHERE next_run <= ?;', (now, )).fetchall():
+                connection.execute('UPDATE schedules SET next_run = ? WHERE kind = ?;', (next_run(at, now), kind))
+                connection.execute(
+                    "INSERT INTO jobs (kind, arguments, status, created) VALUES (?, '{}', 'queued', ?);",
+                    (kind, now)
+                )
+
+            row = connection.execute("SELECT id, kind, tenant, arguments FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1;").fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', started = ?, worker = ? WHERE id = ?;",
+                (now, pid, row[0])
+            )
+        return row[0], row[1], row[2], json.loads(row[3])
+
+    def finish(self, job_id: int, result: dict | None = None, error: str | None = None) -> None:
+        with self.connection() as connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?;',
+                ('failed' if error is not None else 'done', json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def prune(self) -> int:
+        # Removes finished jobs after keep_days together with the files they wrote.
+        oldest = time.time() - self.keep_days * 86400
+        with self.connection(immediate=True) as connection:
+            expired = [job_id for job_id, in connection.execute('SELECT id FROM jobs WHERE finished < ?;', (oldest, ))]
+            connection.execute('DELETE FROM jobs WHERE finished < ?;', (oldest, ))
+        if os.path.isdir(self.output_folder):
+            prefixes = tuple(f'{job_id}-' for job_id in expired)
+            for name in os.listdir(self.output_folder):
+                if prefixes and name.startswith(prefixes):
+                    os.remove(os.path.join(self.output_folder, name))
+        self.last_prune = time.time()
+        return len(expired)
+
+
+def work(app: Flask, stopping: threading.Event) -> None:
+    # One job worker: runs queued jobs one after the other until stopping is set.
+    queue = app.extensions['jobs']
+    pid = os.getpid()
+    queue.register_worker(pid)
+    try:
+        while not stopping.is_set():
+            if time.time() - queue.last_prune > 3600:
+                queue.prune()
+            claimed = queue.claim(pid)
+            if claimed is None:
+                stopping.wait(queue.poll_interval)
+                continue
+
+            job_id, kind, tenant, arguments = claimed
+            if tenant is None and app.config.get('MULTI_USER', False):
+                run_for_all_users(app, job_id, kind, arguments)
+                continue
+            try:
+                result = run_job(app, job_id, kind, tenant, arguments)
+            except Exception as e:
+                queue.finish(job_id, error=f'{type(e).__name__}: {e}')
+            else:
+                queue.finish(job_id, result=result)
+    finally:
+        queue.unregister_worker(pid)
+
+
+def run_job(app: Flask, job_id: int, kind: str, tenant: str | None, arguments: dict):
+    with app.app_context():
+        # DB(current_app) and the backups use the database of g.tenant, as in the user's requests.
+        g.tenant = tenant
+        return JOB_KINDS[kind](job_id, **arguments)
+
+
+def run_for_all_users(app: Flask, job_id: int, kind: str, arguments: dict) -> None:
+    # Scheduled jobs in multi-user mode: one user's failure does not keep the job from the others.
+    results, failed = {}, []
+    for user in app.extensions['users'].names():
+        try:
+            results[user] = run_job(app, job_id, kind, user, arguments)
+        except Exception as e:
+            results[user] = {'error': f'{type(e).__name__}: {e}'}
+            failed.append(user)
+    app.extensions['jobs'].finish(job_id, result=results, error=f"Failed for {', '.join(failed)}" if failed else None)
+
+
+def work_process(app: Flask) -> None:
+    # SIGTERM lets the current job finish before the worker exits.
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(app, stopping)
+
+
+def supervise(app: Flask, count: int, timeout: float = 120) -> None:
+    # Keeps count job worker processes running, forked from this process, and stops them on SIGTERM
+    # or SIGINT, waiting up to timeout seconds for running jobs.
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+
+    app.extensions['jobs'].sync_schedule()
+    context = multiprocessing.get_context('fork')
+    processes = [None] * count
+    while not stopping.is_set():
+        for slot, process in enumerate(processes):
+            if process is None or not process.is_alive():
+                processes[slot] = context.Process(target=work_process, args=(app, ), name=f'job-worker-{slot}', daemon=True)
+                processes[slot].start()
+        stopping.wait(1.0)
+
+    for process in processes:
+        process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(0, deadline - time.monotonic()))
+        if process.is_alive():
+            process.kill()
+
+
+def start_workers(app: Flask) -> int | None:
+    # Forks the job worker supervisor, called from gunicorn's when_ready hook in the master; with
+    # preload_app the workers share the master's imported app. Returns the supervisor's pid.
+    count = app.config.get('JOB_WORKERS', 2)
+    if not count:
+        return None
+
+    pid = os.fork()
+    if pid == 0:
+        # Gunicorn's signal handlers would wake the master, the supervisor installs its own.
+        for signum in (signal.SIGHUP, signal.SIGQUIT, signal.SIGCHLD, signal.SIGUSR1, signal.SIGUSR2, signal.SIGTTIN, signal.SIGTTOU, signal.SIGWINCH):
+            signal.signal(signum, signal.SIG_DFL)
+        try:
+            supervise(app, count)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def stop_workers(pid: int | None) -> None:
+    if pid is None:
+        return
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def job_json(values: dict) -> dict:
+    values = {**values, 'url': url_for('jobs.status', job_id=values['id'])}
+    if values['status'] == 'done' and isinstance(values['result'], dict) and 'download' in values['result']:
+        values['download_url'] = url_for('jobs.download', job_id=values['id'])
+    return values
+
+
+def submitted(job_id: int):
+    # 202 Accepted pointing to the job's status, which clients poll until it is done or failed.
+    response = jsonify(job_json(current_app.extensions['jobs'].get(job_id, g.get('tenant'))))
+    response.status_code = 202
+    response.headers['Location'] = url_for('jobs.status', job_id=job_id)
+    return response
+
+
+def register(app: Flask) -> Blueprint:
+    bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+    @bp.route('/', methods=['GET'])
+    def recent():
+        queue = current_app.extensions['jobs']
+        return jsonify(workers=queue.available(), jobs=[job_json(values) for values in queue.recent(tenant=g.get('tenant'))])
+
+    @bp.route('/', methods=['POST'])
+    def submit():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or body.get('kind') not in JOB_KINDS or not isinstance(body.get('arguments', {}), dict):
+            return jsonify(error=f"Expected {{\"kind\": ..., \"arguments\": {{...}}}} with kind one of {', '.join(sorted(JOB_KINDS))}"), 400
+        return submitted(current_app.extensions['jobs'].submit(body['kind'], body.get('arguments'), g.get('tenant')))
+
+    @bp.route('/<int:job_id>')
+    def status(job_id: int):
+        values = current_app.extensions['jobs'].get(job_id, g.get('tenant'))
+        if values is None:
+            abort(404)
+        return jsonify(job_json(values))
+
+    @bp.route('/<int:job_id>/download')
+    def download(job_id: int):
+        queue = current_app.extensions['jobs']
+        values = queue.get(job_id, g.get('tenant'))
+        if values is None or values['status'] != 'done' or 'download' not in (values['result'] or {}):
+            abort(404)
+        return send_from_directory(queue.output_folder, values['result']['download'], as_attachment=True, download_name=values['result']['name'])
+
+    app.register_blueprint(bp)
+    return bp
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['jobs'] = JobQueue(
+        os.path.join(app.instance_path, 'jobs.sqlite'),
+        os.path.join(app.instance_path, 'jobs'),
+        poll_interval=app.config.get('JOB_POLL_INTERVAL', 1.0),
+        keep_days=app.config.get('JOB_KEEP_DAYS', 7),
+        schedule=app.config.get('JOB_SCHEDULE')
+    )
+    register(app)
@@ -0,0 +1,704 @@
+import sqlite3
+from . import utils
+
+
+def create_tables(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoices (
+            id integer PRIMARY KEY,
+            date integer NOT NULL
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS billing_positions (
+            id integer PRIMARY KEY,
+            date integer NOT NULL,
+            file text NOT NULL,
+            hourly_rate real,
+            billed_hours real,
+            billed_amount real,
+            earned_amount real NOT NULL,
+            invoiced_amount real,
+            invoice_id integer,
+            FOREIGN KEY(invoice_id) REFERENCES invoices(id)
+        );
+    ''')
+
+
+def add_indexes(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS billing_positions_open
+        ON billing_positions (file, date) WHERE invoice_id IS NULL;
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS billing_positions_invoice ON billing_positions (invoice_id, file, date);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS billing_positions_date ON billing_positions (date);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS invoices_date ON invoices (date);')
+
+
+def add_file_index(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('CREATE INDEX IF NOT EXISTS billing_positions_file ON billing_positions (file, date);')
+
+
+def add_statistics_summary(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS billing_statistics (
+            year integer PRIMARY KEY,
+            count_positions integer NOT NULL,
+            total_billed real NOT NULL,
+            total_earned real NOT NULL,
+            total_invoiced real NOT NULL
+        );
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_statistics_insert AFTER INSERT ON billing_positions
+        BEGIN
+            INSERT INTO billing_statistics (year, count_positions, total_billed, total_earned, total_invoiced)
+            VALUES (NEW.date / 10000, 1, IFNULL(NEW.billed_amount, 0), NEW.earned_amount, IFNULL(NEW.invoiced_amount, 0))
+            ON CONFLICT (year) DO UPDATE SET
+                count_positions = count_positions + 1,
+                total_billed = total_billed + excluded.total_billed,
+                total_earned = total_earned + excluded.total_earned,
+                total_invoiced = total_invoiced + excluded.total_invoiced;
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_statistics_delete AFTER DELETE ON billing_positions
+        BEGIN
+            UPDATE billing_statistics SET
+                count_positions = count_positions - 1,
+                total_billed = total_billed - IFNULL(OLD.billed_amount, 0),
+                total_earned = total_earned - OLD.earned_amount,
+                total_invoiced = total_invoiced - IFNULL(OLD.invoiced_amount, 0)
+            WHERE year = OLD.date / 10000;
+            DELETE FROM billing_statistics WHERE year = OLD.date / 10000 AND count_positions <= 0;
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_statistics_update
+        AFTER UPDATE OF date, billed_amount, earned_amount, invoiced_amount ON billing_positions
+        BEGIN
+            UPDATE billing_statistics SET
+                count_positions = count_positions - 1,
+                total_billed = total_billed - IFNULL(OLD.billed_amount, 0),
+                total_earned = total_earned - OLD.earned_amount,
+                total_invoiced = total_invoiced - IFNULL(OLD.invoiced_amount, 0)
+            WHERE year = OLD.date / 10000;
+            INSERT INTO billing_statistics (year, count_positions, total_billed, total_earned, total_invoiced)
+            VALUES (NEW.date / 10000, 1, IFNULL(NEW.billed_amount, 0), NEW.earned_amount, IFNULL(NEW.invoiced_amount, 0))
+            ON CONFLICT (year) DO UPDATE SET
+                count_positions = count_positions + 1,
+                total_billed = total_billed + excluded.total_billed,
+                total_earned = total_earned + excluded.total_earned,
+                total_invoiced = total_invoiced + excluded.total_invoiced;
+            DELETE FROM billing_statistics WHERE year = OLD.date / 10000 AND count_positions <= 0;
+        END;
+    ''')
+
+    cursor.execute('DELETE FROM billing_statistics;')
+    cursor.execute('''
+        INSERT INTO billing_statistics (year, count_positions, total_billed, total_earned, total_invoiced)
+        SELECT date / 10000, count(id), IFNULL(sum(billed_amount), 0), IFNULL(sum(earned_amount), 0), IFNULL(sum(invoiced_amount), 0)
+        FROM billing_positions
+        GROUP BY date / 10000;
+    ''')
+
+
+def add_change_counter(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counter (
+            id integer PRIMARY KEY CHECK (id = 1),
+            version integer NOT NULL
+        );
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO change_counter (id, version) VALUES (1, 0);')
+
+    for table in ('billing_positions', 'invoices'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_change AFTER {event} ON {table}
+                BEGIN
+                    UPDATE change_counter SET version = version + 1 WHERE id = 1;
+                END;
+            ''')
+
+
+def add_cache_tags(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_tags (
+            tag text PRIMARY KEY,
+            generation integer NOT NULL
+        );
+    ''')
+    cursor.executemany(
+        'INSERT OR IGNORE INTO cache_tags (tag, generation) VALUES (?, 0);',
+        [('statistics', ), ('billing', ), ('invoices', )]
+    )
+
+
+def add_file_search(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS billing_files (
+            id integer PRIMARY KEY,
+            file text NOT NULL UNIQUE,
+            count_positions integer NOT NULL
+        );
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS billing_files_nocase ON billing_files (file COLLATE NOCASE);')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS billing_files_fts
+        USING fts5(file, content='billing_files', content_rowid='id', tokenize='trigram');
+    ''')
+
+    # billing_files_fts mirrors billing_files, which in turn counts the positions per file.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_files_fts_insert AFTER INSERT ON billing_files
+        BEGIN
+            INSERT INTO billing_files_fts (rowid, file) VALUES (NEW.id, NEW.file);
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_files_fts_delete AFTER DELETE ON billing_files
+        BEGIN
+            INSERT INTO billing_files_fts (billing_files_fts, rowid, file) VALUES ('delete', OLD.id, OLD.file);
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_files_insert AFTER INSERT ON billing_positions
+        BEGIN
+            INSERT INTO billing_files (file, count_positions) VALUES (NEW.file, 1)
+            ON CONFLICT (file) DO UPDATE SET count_positions = count_positions + 1;
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_files_delete AFTER DELETE ON billing_positions
+        BEGIN
+            UPDATE billing_files SET count_positions = count_positions - 1 WHERE file = OLD.file;
+            DELETE FROM billing_files WHERE file = OLD.file AND count_positions <= 0;
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS billing_files_update AFTER UPDATE OF file ON billing_positions
+        WHEN OLD.file != NEW.file
+        BEGIN
+            UPDATE billing_files SET count_positions = count_positions - 1 WHERE file = OLD.file;
+            DELETE FROM billing_files WHERE file = OLD.file AND count_positions <= 0;
+            INSERT INTO billing_files (file, count_positions) VALUES (NEW.file, 1)
+            ON CONFLICT (file) DO UPDATE SET count_positions = count_positions + 1;
+        END;
+    ''')
+
+    cursor.execute('''
+        INSERT INTO billing_files (file, count_positions)
+        SELECT file, count(id) FROM billing_positions GROUP BY file
+        ON CONFLICT (file) DO UPDATE SET count_positions = excluded.count_positions;
+    ''')
+
+
+def add_file_ledger(cursor: sqlite3.Cursor) -> None:
+    # billing_files also carries the totals per file, so the /files overview reads one row per file.
+    for column, definition in (
+        ('count_open', 'integer NOT NULL DEFAULT 0'),
+        ('total_billed', 'real NOT NULL DEFAULT 0'),
+        ('total_earned', 'real NOT NULL DEFAULT 0'),
+        ('total_invoiced', 'real NOT NULL DEFAULT 0'),
+        ('open_billed', 'real NOT NULL DEFAULT 0'),
+        ('last_date', 'integer'),
+    ):
+        cursor.execute(f'ALTER TABLE billing_files ADD COLUMN {column} {definition};')
+    cursor.execute('CREATE INDEX IF NOT EXISTS billing_files_open ON billing_files (open_billed DESC, file);')
+    cursor.execute('CREATE INDEX IF NOT EXISTS billing_files_activity ON billing_files (last_date DESC, file);')
+
+    for trigger in ('billing_files_insert', 'billing_files_delete', 'billing_files_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger};')
+
+    # Adds or removes a position (NEW or OLD) from the totals of its file.
+    def add(row: str) -> str:
+        return f'''
+            INSERT INTO billing_files (file, count_positions, count_open, total_billed, total_earned, total_invoiced, open_billed, last_date)
+            VALUES (
+                {row}.file, 1, {row}.invoice_id IS NULL, IFNULL({row}.billed_amount, 0), {row}.earned_amount, IFNULL({row}.invoiced_amount, 0),
+                CASE WHEN {row}.invoice_id IS NULL THEN IFNULL({row}.billed_amount, 0) ELSE 0 END, {row}.date
+            )
+            ON CONFLICT (file) DO UPDATE SET
+                count_positions = count_positions + 1,
+                count_open = count_open + excluded.count_open,
+                total_billed = total_billed + excluded.total_billed,
+                total_earned = total_earned + excluded.total_earned,
+                total_invoiced = total_invoiced + excluded.total_invoiced,
+                open_billed = open_billed + excluded.open_billed,
+                last_date = max(IFNULL(last_date, 0), excluded.last_date);
+        '''
+
+    def remove(row: str) -> str:
+        # Triggers run after the change, so the latest remaining date is looked up in billing_positions_file.
+        return f'''
+            UPDATE billing_files SET
+                count_positions = count_positions - 1,
+                count_open = count_open - ({row}.invoice_id IS NULL),
+                total_billed = total_billed - IFNULL({row}.billed_amount, 0),
+                total_earned = total_earned - {row}.earned_amount,
+                total_invoiced = total_invoiced - IFNULL({row}.invoiced_amount, 0),
+                open_billed = open_billed - CASE WHEN {row}.invoice_id IS NULL THEN IFNULL({row}.billed_amount, 0) ELSE 0 END,
+                last_date = (SELECT max(date) FROM billing_positions WHERE file = {row}.file)
+            WHERE file = {row}.file;
+        '''
+
+    cleanup = 'DELETE FROM billing_files WHERE file = OLD.file AND count_positions <= 0;'
+    cursor.execute(f'''
+        CREATE TRIGGER billing_files_insert AFTER INSERT ON billing_positions
+        BEGIN
+            {add('NEW')}
+        END;
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER billing_files_delete AFTER DELETE ON billing_positions
+        BEGIN
+            {remove('OLD')}
+            {cleanup}
+        END;
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER billing_files_update
+        AFTER UPDATE OF date, file, billed_amount, earned_amount, invoiced_amount, invoice_id ON billing_positions
+        BEGIN
+            {remove('OLD')}
+            {add('NEW')}
+            {cleanup}
+        END;
+    ''')
+
+    cursor.execute('''
+        UPDATE billing_files SET
+            count_open = totals.count_open,
+            total_billed = totals.total_billed,
+            total_earned = totals.total_earned,
+            total_invoiced = totals.total_invoiced,
+            open_billed = totals.open_billed,
+            last_date = totals.last_date
+        FROM (
+            SELECT
+                file,
+                IFNULL(sum(invoice_id IS NULL), 0) AS count_open,
+                IFNULL(sum(billed_amount), 0) AS total_billed,
+                IFNULL(sum(earned_amount), 0) AS total_earned,
+                IFNULL(sum(invoiced_amount), 0) AS total_invoiced,
+                IFNULL(sum(CASE WHEN invoice_id IS NULL THEN billed_amount END), 0) AS open_billed,
+                max(date) AS last_date
+            FROM billing_positions
+            GROUP BY file
+        ) AS totals
+        WHERE billing_files.file = totals.file;
+    ''')
+
+
+def convert_money_to_cents(cursor: sqlite3.Cursor) -> None:
+    # Money moves from real columns to integer cents (billed_cents, earned_cents, invoiced_cents) in
+    # billing_positions and both summary tables. SQLite before 3.35 cannot drop columns, so the tables
+    # are rebuilt (https://www.sqlite.org/lang_altertable.html#otheralter) and their triggers and
+    # indexes recreated. money_conversion keeps the yearly totals before and after for comparison.
+    cursor.connection.create_function('to_cents', 1, utils.to_cents, deterministic=True)
+
+    cursor.execute('''
+        CREATE TABLE money_conversion (
+            year integer PRIMARY KEY,
+            count_positions integer NOT NULL,
+            real_billed real NOT NULL,
+            real_earned real NOT NULL,
+            real_invoiced real NOT NULL,
+            billed_cents integer,
+            earned_cents integer,
+            invoiced_cents integer
+        );
+    ''')
+    cursor.execute('''
+        INSERT INTO money_conversion (year, count_positions, real_billed, real_earned, real_invoiced)
+        SELECT date / 10000, count(id), IFNULL(sum(billed_amount), 0), IFNULL(sum(earned_amount), 0), IFNULL(sum(invoiced_amount), 0)
+        FROM billing_positions
+        GROUP BY date / 10000;
+    ''')
+
+    # Renaming a table checks every trigger in the schema, so all triggers touching the rebuilt tables go first.
+    cursor.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'trigger' AND tbl_name IN ('billing_positions', 'billing_files');
+    ''')
+    for (trigger, ) in cursor.fetchall():
+        cursor.execute(f'DROP TRIGGER {trigger};')
+
+    cursor.execute('''
+        CREATE TABLE billing_positions_new (
+            id integer PRIMARY KEY,
+            date integer NOT NULL,
+            file text NOT NULL,
+            hourly_rate real,
+            billed_hours real,
+            billed_cents integer,
+            earned_cents integer NOT NULL,
+            invoiced_cents integer,
+            invoice_id integer,
+            FOREIGN KEY(invoice_id) REFERENCES invoices(id)
+        );
+    ''')
+    cursor.execute('''
+        INSERT INTO billing_positions_new (id, date, file, hourly_rate, billed_hours, billed_cents, earned_cents, invoiced_cents, invoice_id)
+        SELECT id, date, file, hourly_rate, billed_hours, to_cents(billed_amount), to_cents(earned_amount), to_cents(invoiced_amount), invoice_id
+        FROM billing_positions;
+    ''')
+
+    # Every position must have made it across, each amount within half a cent.
+    cursor.execute('''
+        SELECT
+            (SELECT count(*) FROM billing_positions) - (SELECT count(*) FROM billing_positions_new),
+            (
+                SELECT count(*)
+                FROM billing_positions AS old
+                JOIN billing_positions_new AS new ON new.id = old.id
+                WHERE (old.billed_amount IS NULL) != (new.billed_cents IS NULL)
+                    OR (old.invoiced_amount IS NULL) != (new.invoiced_cents IS NULL)
+                    OR abs(new.billed_cents - old.billed_amount * 100) > 0.5 + 1e-6
+                    OR abs(new.earned_cents - old.earned_amount * 100) > 0.5 + 1e-6
+                    OR abs(new.invoiced_cents - old.invoiced_amount * 100) > 0.5 + 1e-6
+            );
+    ''')
+    missing, mismatched = cursor.fetchone()
+    if missing or mismatched:
+        raise sqlite3.IntegrityError(f'Converting amounts to cents lost {missing} and changed {mismatched} billing position(s)')
+
+    cursor.execute('DROP TABLE billing_positions;')
+    cursor.execute('ALTER TABLE billing_positions_new RENAME TO billing_positions;')
+    add_indexes(cursor)
+    add_file_index(cursor)
+
+    cursor.execute('DROP TABLE billing_statistics;')
+    cursor.execute('''
+        CREATE TABLE billing_statistics (
+            year integer PRIMARY KEY,
+            count_positions integer NOT NULL,
+            billed_cents integer NOT NULL,
+            earned_cents integer NOT NULL,
+            invoiced_cents integer NOT NULL
+        );
+    ''')
+    cursor.execute('''
+        INSERT INTO billing_statistics (year, count_positions, billed_cents, earned_cents, invoiced_cents)
+        SELECT date / 10000, count(id), IFNULL(sum(billed_cents), 0), IFNULL(sum(earned_cents), 0), IFNULL(sum(invoiced_cents), 0)
+        FROM billing_positions
+        GROUP BY date / 10000;
+    ''')
+
+    # Same ids as before, so billing_files_fts (an external content index on billing_files) stays valid.
+    cursor.execute('''
+        CREATE TABLE billing_files_new (
+            id integer PRIMARY KEY,
+            file text NOT NULL UNIQUE,
+            count_positions integer NOT NULL,
+            count_open integer NOT NULL DEFAULT 0,
+            billed_cents integer NOT NULL DEFAULT 0,
+            earned_cents integer NOT NULL DEFAULT 0,
+            invoiced_cents integer NOT NULL DEFAULT 0,
+            open_billed_cents integer NOT NULL DEFAULT 0,
+            last_date integer
+        );
+    ''')
+    cursor.execute('''
+        INSERT INTO billing_files_new (id, file, count_positions, count_open, billed_cents, earned_cents, invoiced_cents, open_billed_cents, last_date)
+        SELECT
+            billing_files.id, billing_files.file, count(billing_positions.id),
+            IFNULL(sum(billing_positions.invoice_id IS NULL), 0),
+            IFNULL(sum(billing_positions.billed_cents), 0),
+            IFNULL(sum(billing_positions.earned_cents), 0),
+            IFNULL(sum(billing_positions.invoiced_cents), 0),
+            IFNULL(sum(CASE WHEN billing_positions.invoice_id IS NULL THEN billing_positions.billed_cents END), 0),
+            max(billing_positions.date)
+        FROM billing_files
+        JOIN billing_positions ON billing_positions.file = billing_files.file
+        GROUP BY billing_files.id;
+    ''')
+    cursor.execute('DROP TABLE billing_files;')
+    cursor.execute('ALTER TABLE billing_files_new RENAME TO billing_files;')
+    cursor.execute('CREATE INDEX billing_files_nocase ON billing_files (file COLLATE NOCASE);')
+    cursor.execute('CREATE INDEX billing_files_open ON billing_files (open_billed_cents DESC, file);')
+    cursor.execute('CREATE INDEX billing_files_activity ON billing_files (last_date DESC, file);')
+
+    cursor.execute('''
+        CREATE TRIGGER billing_files_fts_insert AFTER INSERT ON billing_files
+        BEGIN
+            INSERT INTO billing_files_fts (rowid, file) VALUES (NEW.id, NEW.file);
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER billing_files_fts_delete AFTER DELETE ON billing_files
+        BEGIN
+            INSERT INTO billing_files_fts (billing_files_fts, rowid, file) VALUES ('delete', OLD.id, OLD.file);
+        END;
+    ''')
+
+    # Adds or removes a position (NEW or OLD) from both summary tables.
+    def add(row: str) -> str:
+        return f'''
+            INSERT INTO billing_statistics (year, count_positions, billed_cents, earned_cents, invoiced_cents)
+            VALUES ({row}.date / 10000, 1, IFNULL({row}.billed_cents, 0), {row}.earned_cents, IFNULL({row}.invoiced_cents, 0))
+            ON CONFLICT (year) DO UPDATE SET
+                count_positions = count_positions + 1,
+                billed_cents = billed_cents + excluded.billed_cents,
+                earned_cents = earned_cents + excluded.earned_cents,
+                invoiced_cents = invoiced_cents + excluded.invoiced_cents;
+            INSERT INTO billing_files (file, count_positions, count_open, billed_cents, earned_cents, invoiced_cents, open_billed_cents, last_date)
+            VALUES (
+                {row}.file, 1, {row}.invoice_id IS NULL, IFNULL({row}.billed_cents, 0), {row}.earned_cents, IFNULL({row}.invoiced_cents, 0),
+                CASE WHEN {row}.invoice_id IS NULL THEN IFNULL({row}.billed_cents, 0) ELSE 0 END, {row}.date
+            )
+            ON CONFLICT (file) DO UPDATE SET
+                count_positions = count_positions + 1,
+                count_open = count_open + excluded.count_open,
+                billed_cents = billed_cents + excluded.billed_cents,
+                earned_cents = earned_cents + excluded.earned_cents,
+                invoiced_cents = invoiced_cents + excluded.invoiced_cents,
+                open_billed_cents = open_billed_cents + excluded.open_billed_cents,
+                last_date = max(IFNULL(last_date, 0), excluded.last_date);
+        '''
+
+    def remove(row: str) -> str:
+        # Triggers run after the change, so the latest remaining date is looked up in billing_positions_file.
+        return f'''
+            UPDATE billing_statistics SET
+                count_positions = count_positions - 1,
+                billed_cents = billed_cents - IFNULL({row}.billed_cents, 0),
+                earned_cents = earned_cents - {row}.earned_cents,
+                invoiced_cents = invoiced_cents - IFNULL({row}.invoiced_cents, 0)
+            WHERE year = {row}.date / 10000;
+            UPDATE billing_files SET
+                count_positions = count_positions - 1,
+                count_open = count_open - ({row}.invoice_id IS NULL),
+                billed_cents = billed_cents - IFNULL({row}.billed_cents, 0),
+                earned_cents = earned_cents - {row}.earned_cents,
+                invoiced_cents = invoiced_cents - IFNULL({row}.invoiced_cents, 0),
+                open_billed_cents = open_billed_cents - CASE WHEN {row}.invoice_id IS NULL THEN IFNULL({row}.billed_cents, 0) ELSE 0 END,
+                last_date = (SELECT max(date) FROM billing_positions WHERE file = {row}.file)
+            WHERE file = {row}.file;
+        '''
+
+    cleanup = '''
+        DELETE FROM billing_statistics WHERE year = OLD.date / 10000 AND count_positions <= 0;
+        DELETE FROM billing_files WHERE file = OLD.file AND count_positions <= 0;
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER billing_summaries_insert AFTER INSERT ON billing_positions
+        BEGIN
+            {add('NEW')}
+        END;
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER billing_summaries_delete AFTER DELETE ON billing_positions
+        BEGIN
+            {remove('OLD')}
+            {cleanup}
+        END;
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER billing_summaries_update
+        AFTER UPDATE OF date, file, billed_cents, earned_cents, invoiced_cents, invoice_id ON billing_positions
+        BEGIN
+            {remove('OLD')}
+            {add('NEW')}
+            {cleanup}
+        END;
+    ''')
+    # Recreates the change counter triggers on billing_positions.
+    add_change_counter(cursor)
+
+    cursor.execute('''
+        UPDATE money_conversion SET
+            billed_cents = billing_statistics.billed_cents,
+            earned_cents = billing_statistics.earned_cents,
+            invoiced_cents = billing_statistics.invoiced_cents
+        FROM billing_statistics
+        WHERE billing_statistics.year = money_conversion.year;
+    ''')
+    cursor.execute('PRAGMA foreign_key_check (billing_positions);')
+    if cursor.fetchall():
+        raise sqlite3.IntegrityError('billing_positions references missing invoices after converting amounts to cents')
+
+
+def add_archives(cursor: sqlite3.Cursor) -> None:
+    # Bookkeeping for years moved to instance/archive/<year>.sqlite (see archive.py): which years are
+    # archived, their yearly totals and their invoices, so listings and statistics need no ATTACH.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archives (
+            year integer PRIMARY KEY,
+            count_positions integer NOT NULL,
+            count_invoices integer NOT NULL,
+            max_position_id integer,
+            max_invoice_id integer,
+            created integer NOT NULL
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_statistics (
+            year integer PRIMARY KEY,
+            count_positions integer NOT NULL,
+            billed_cents integer NOT NULL,
+            earned_cents integer NOT NULL,
+            invoiced_cents integer NOT NULL
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_invoices (
+            id integer PRIMARY KEY,
+            year integer NOT NULL,
+            date integer NOT NULL,
+            total_cents integer NOT NULL
+        );
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archived_invoices_date ON archived_invoices (date);')
+
+
+def drop_open_index(cursor: sqlite3.Cursor) -> None:
+    # The planner serves get_open_billing_positions from billing_positions_invoice (invoice_id IS NULL,
+    # file, date), so the partial index only cost writes.
+    cursor.execute('DROP INDEX IF EXISTS billing_positions_open;')
+
+
+def add_open_earned(cursor: sqlite3.Cursor) -> None:
+    # Positions with only an earned amount (fixed fees) have no billed amount, so billing_files also
+    # tracks the earned amount of positions not invoiced yet, as the invoicing page and the dashboard
+    # do. The /files overview orders and filters by it.
+    cursor.execute('ALTER TABLE billing_files ADD COLUMN open_earned_cents integer NOT NULL DEFAULT 0;')
+    cursor.execute('''
+        UPDATE billing_files SET open_earned_cents = totals.open_earned_cents
+        FROM (
+            SELECT file, IFNULL(sum(CASE WHEN invoice_id IS NULL THEN earned_cents END), 0) AS open_earned_cents
+            FROM billing_positions
+            GROUP BY file
+        ) AS totals
+        WHERE billing_files.file = totals.file;
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS billing_files_open;')
+    cursor.execute('CREATE INDEX billing_files_open ON billing_files (open_earned_cents DESC, file);')
+
+    for trigger in ('billing_summaries_insert', 'billing_summaries_delete', 'billing_summaries_update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger};')
+
+    # Adds or removes a position (NEW or OLD) from both summary tables.
+    def add(row: str) -> str:
+        return f'''
+            INSERT INTO billing_statistics (year, count_positions, billed_cents, earned_cents, invoiced_cents)
+            VALUES ({row}.date / 10000, 1, IFNULL({row}.billed_cents, 0), {row}.earned_cents, IFNULL({row}.invoiced_cents, 0))
+            ON CONFLICT (year) DO UPDATE SET
+                count_positions = count_positions + 1,
+                billed_cents = billed_cents + excluded.billed_cents,
+                earned_cents = earned_cents + excluded.earned_cents,
+                invoiced_cents = invoiced_cents + excluded.invoiced_cents;
+            INSERT INTO billing_files (file, count_positions, count_open, billed_cents, earned_cents, invoiced_cents, open_billed_cents, open_earned_cents, last_date)
+            VALUES (
+                {row}.file, 1, {row}.invoice_id IS NULL, IFNULL({row}.billed_cents, 0), {row}.earned_cents, IFNULL({row}.invoiced_cents, 0),
+                CASE WHEN {row}.invoice_id IS NULL THEN IFNULL({row}.billed_cents, 0) ELSE 0 END,
+                CASE WHEN {row}.invoice_id IS NULL THEN {row}.earned_cents ELSE 0 END, {row}.date
+            )
+            ON CONFLICT (file) DO UPDATE SET
+                count_positions = count_positions + 1,
+                count_open = count_open + excluded.count_open,
+                billed_cents = billed_cents + excluded.billed_cents,
+                earned_cents = earned_cents + excluded.earned_cents,
+                invoiced_cents = invoiced_cents + excluded.invoiced_cents,
+                open_billed_cents = open_billed_cents + excluded.open_billed_cents,
+                open_earned_cents = open_earned_cents + excluded.open_earned_cents,
+                last_date = max(IFNULL(last_date, 0), excluded.last_date);
+        '''
+
+    def remove(row: str) -> str:
+        # Triggers run after the change, so the latest remaining date is looked up in billing_positions_file.
+        return f'''
+            UPDATE billing_statistics SET
+                count_positions = count_positions - 1,
+                billed_cents = billed_cents - IFNULL({row}.billed_cents, 0),
+                earned_cents = earned_cents - {row}.earned_cents,
+                invoiced_cents = invoiced_cents - IFNULL({row}.invoiced_cents, 0)
+            WHERE year = {row}.date / 10000;
+            UPDATE billing_files SET
+                count_positions = count_positions - 1,
+                count_open = count_open - ({row}.invoice_id IS NULL),
+                billed_cents = billed_cents - IFNULL({row}.billed_cents, 0),
+                earned_cents = earned_cents - {row}.earned_cents,
+                invoiced_cents = invoiced_cents - IFNULL({row}.invoiced_cents, 0),
+                open_billed_cents = open_billed_cents - CASE WHEN {row}.invoice_id IS NULL THEN IFNULL({row}.billed_cents, 0) ELSE 0 END,
+                open_earned_cents = open_earned_cents - CASE WHEN {row}.invoice_id IS NULL THEN {row}.earned_cents ELSE 0 END,
+                last_date = (SELECT max(date) FROM billing_positions WHERE file = {row}.file)
+            WHERE file = {row}.file;
+        '''
+
+    cleanup = '''
+        DELETE FROM billing_statistics WHERE year = OLD.date / 10000 AND count_positions <= 0;
+        DELETE FROM billing_files WHERE file = OLD.file AND count_positions <= 0;
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER billing_summaries_insert AFTER INSERT ON billing_positions
+        BEGIN
+            {add('NEW')}
+        END;
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER billing_summaries_delete AFTER DELETE ON billing_positions
+        BEGIN
+            {remove('OLD')}
+            {cleanup}
+        END;
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER billing_summaries_update
+        AFTER UPDATE OF date, file, billed_cents, earned_cents, invoiced_cents, invoice_id ON billing_positions
+        BEGIN
+            {remove('OLD')}
+            {add('NEW')}
+            {cleanup}
+        END;
+    ''')
+
+
+# Append only: the position in this list is the schema version stored in PRAGMA user_version.
+MIGRATIONS = [
+    create_tables,
+    add_indexes,
+    add_file_index,
+    add_statistics_summary,
+    add_change_counter,
+    add_cache_tags,
+    add_file_search,
+    add_file_ledger,
+    convert_money_to_cents,
+    add_archives,
+    drop_open_index,
+    add_open_earned,
+]
+
+
+def current_version(connection: sqlite3.Connection) -> int:
+    return connection.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def migrate(connection: sqlite3.Connection) -> list[str]:
+    applied = []
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current_version(connection):
+            continue
+
+        cursor = connection.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE;')
+            # Another worker may have migrated while we waited for the write lock.
+            if version <= current_version(connection):
+                cursor.execute('ROLLBACK;')
+                continue
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {version};')
+            cursor.execute('COMMIT;')
+        except BaseException:
+            if connection.in_transaction:
+                cursor.execute('ROLLBACK;')
+            raise
+        applied.append(migration.__name__)
+
+    if applied:
+        connection.execute('PRAGMA optimize;')
+    return applied
@@ -0,0 +1,22 @@
+from flask import Flask, Blueprint, current_app, request, jsonify
+from .db import DB
+from .caching import conditional
+from .utils import optional_int
+
+MAX_RESULTS = 50
+
+def register(app: Flask) -> Blueprint:
+    bp = Blueprint('search', __name__, url_prefix='/search')
+
+    @bp.route('/files')
+    @conditional
+    def files():
+        database = DB(current_app)
+
+        query = request.args.get('q', '')
+        limit = min(optional_int(request.args.get('limit')) or 10, MAX_RESULTS)
+        matches = database.search_files(query, limit) if limit > 0 else []
+        return jsonify(query=query, results=[match._asdict() for match in matches])
+
+    app.register_blueprint(bp)
+    return bp
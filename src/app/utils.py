@@ -1,7 +1,14 @@
-import random
+import hmac
+import secrets
 import hashlib
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
 from datetime import datetime, date
 
+CENT = Decimal('0.01')
+# Amounts, rates and hours must stay below this, so that amounts in cents fit SQLite's 64-bit integers.
+MAX_AMOUNT = Decimal(10) ** 13
+
 def optional_float(number: str) -> float | None:
     if number == '':
         return None
@@ -18,24 +25,62 @@ def optional_int(number: str) -> int | None:
     except:
         return None
     
+def optional_decimal(number: str | float) -> Decimal | None:
+    if number == '' or number is None or isinstance(number, bool):
+        return None
+    try:
+        # Floats go through their shortest repr, so 0.1 becomes Decimal('0.1') and not its binary expansion.
+        value = Decimal(str(number))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return value if value.is_finite() and abs(value) < MAX_AMOUNT else None
+
+def out_of_range(number: str | float | None) -> bool:
+    # True for numbers optional_decimal rejects although they are numbers: infinite, NaN or too large.
+    if number == '' or number is None or isinstance(number, bool):
+        return False
+    try:
+        value = Decimal(str(number))
+    except (InvalidOperation, TypeError, ValueError):
+        return False
+    return not value.is_finite() or abs(value) >= MAX_AMOUNT
+
+def to_cents(amount: Decimal | float | int | None) -> int | None:
+    # Money is stored as integer cents, amounts with more decimals are rounded half up.
+    if amount is None:
+        return None
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int(amount.quantize(CENT, ROUND_HALF_UP).scaleb(2))
+
+def format_money(amount: Decimal | float | None) -> str:
+    if amount is None:
+        return ''
+    return f'{amount:.2f}'
+
+# PBKDF2 rounds of new password hashes; stored hashes keep the rounds they were made with.
+PASSWORD_ROUNDS = 200_000
+
 def randomstr(length: int = 8) -> str:
-    return ''.join(['{:x}'.format(random.randint(0, 15)) for _ in range(length)])
+    return ''.join(['{:x}'.format(secrets.randbelow(16)) for _ in range(length)])
 
-def hexdigest(salt: str, raw_password: str) -> str:
-    hashlib.sha256('{salt}{raw_password}'.format(
-        salt = salt.encode('utf-8'),
-        raw_password = raw_password.encode('utf-8')
-    )).hexdigest()
+def hexdigest(salt: str, raw_password: str, rounds: int = PASSWORD_ROUNDS) -> str:
+    return hashlib.pbkdf2_hmac('sha256', raw_password.encode('utf-8'), salt.encode('utf-8'), rounds).hex()
 
 def hash_password(raw_password: str) -> str:
-    salt = hexdigest(randomstr(8), randomstr(8))[:16]
+    salt = randomstr(16)
     hash = hexdigest(salt, raw_password)
-    return f'{salt}:{hash}'
+    return f'{PASSWORD_ROUNDS}:{salt}:{hash}'
+
+def check_password(hashed_password: str, raw_password: str) -> bool:
+    rounds, salt, hash = hashed_password.split(':')
+    return hmac.compare_digest(hexdigest(salt, raw_password, int(rounds)), hash)
 
 def date_to_int(date: datetime | date) -> int:
     if isinstance(date, datetime):
         date = date.date()
     return int(date.strftime('%Y%m%d'))
             
-def int_to_date(date: int) -> date:
-    return datetime.strptime(f'{date}', '%Y%m%d').date()
\ No newline at end of file
+@lru_cache(maxsize=65536)
+def int_to_date(date_int: int) -> date:
+    return date(date_int // 10000, date_int // 100 % 100, date_int % 100)
\ No newline at end of file
@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future, TimeoutError
+from typing import Callable
+from flask import Flask
+from .db import DB
+
+# Upper bounds of the batch size histogram.
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+class WriteQueue:
+    # Single writer with group commit: DB methods marked @mutation are handed to one thread per
+    # process and database, which runs everything that is pending (waiting up to window seconds for
+    # more) in a single transaction, each mutation in its own savepoint so a failing one does not take
+    # the others down. Callers block until the group is committed, so they still read their own writes.
+    # Each tenant database has its own writer, which exits after idle_timeout seconds without work or
+    # when the database's connection pool is evicted, so there are never more writers than pools.
+
+    def __init__(self, app: Flask, window: float = 0.0, max_batch: int = 64, timeout: float = 30.0, idle_timeout: float = 60.0) -> None:
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._writers = {}
+
+        self.mutations = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.wait_seconds = 0.0
+        self.commit_seconds = 0.0
+        self.batch_sizes = [0] * (len(BATCH_BUCKETS) + 1)
+
+    def ensure_started(self, db_path: str) -> queue.SimpleQueue:
+        # Writers are started lazily, and again after a fork (gunicorn workers, preload_app). Called with
+        # the lock held, so a writer never exits between being looked up here and getting work.
+        if self._pid != os.getpid():
+            self._writers = {}
+            self._pid = os.getpid()
+        pending = self._writers.get(db_path)
+        if pending is None:
+            pending = self._writers[db_path] = queue.SimpleQueue()
+            threading.Thread(target=self.run, args=(db_path, pending), name='db-write-queue', daemon=True).start()
+        return pending
+
+    def submit(self, db_path: str, method: Callable, args: tuple, kwargs: dict):
+        future = Future()
+        with self._lock:
+            pending = self.ensure_started(db_path)
+            pending.put((method, args, kwargs, future, time.perf_counter()))
+        self.max_depth = max(self.max_depth, pending.qsize())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # A mutation still queued is cancelled and never runs. One the writer has started is
+            # waited for, so the caller does not see a failure for a write that gets committed.
+            if future.cancel():
+                raise
+            return future.result()
+
+    def run(self, db_path: str, pending: queue.SimpleQueue) -> None:
+        pool = self.app.extensions['db_pools'].get(db_path)
+        connection = pool.connect()
+        database = DB(self.app, connection, db_path)
+        # The writer runs the statements itself, on its own connection.
+        database.executor = None
+        database.write_queue = None
+        # None in the queue tells the writer to stop.
+        pool.on_close(lambda: pending.put(None))
+
+        try:
+            stopping = False
+            while not stopping:
+                try:
+                    batch = [pending.get(timeout=self.idle_timeout)]
+                except queue.Empty:
+                    with self._lock:
+                        if pending.empty():
+                            del self._writers[db_path]
+                            return
+                    continue
+                deadline = time.perf_counter() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+                    except queue.Empty:
+                        break
+                if any(item is None for item in batch):
+                    # The pool was evicted: later mutations start a new writer, this one commits what
+                    # is already queued and exits.
+                    with self._lock:
+                        if self._writers.get(db_path) is pending:
+                            del self._writers[db_path]
+                    while True:
+                        try:
+                            batch.append(pending.get_nowait())
+                        except queue.Empty:
+                            break
+                    batch = [item for item in batch if item is not None]
+                    stopping = True
+                for start in range(0, len(batch), self.max_batch):
+                    self.commit_group(database, batch[start:start + self.max_batch])
+        finally:
+            connection.close()
+
+    def commit_group(self, database: DB, batch: list) -> None:
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        start = time.perf_counter()
+        results = []
+        try:
+            with database.transaction():
+                for method, args, kwargs, future, enqueued in batch:
+                    self.wait_seconds += start - enqueued
+                    database.execute('SAVEPOINT mutation;')
+                    try:
+                        result = method(database, *args, **kwargs)
+                    except Exception as e:
+                        database.execute('ROLLBACK TO mutation;')
+                        database.execute('RELEASE mutation;')
+                        results.append((future, None, e))
+                    else:
+                        database.execute('RELEASE mutation;')
+                        results.append((future, result, None))
+        except Exception as e:
+            # The commit itself failed, none of the mutations were written.
+            results = [(future, None, e) for _, _, _, future, _ in batch]
+
+        self.batches += 1
+        self.mutations += len(batch)
+        self.batch_sizes[bisect_left(BATCH_BUCKETS, len(batch))] += 1
+        self.commit_seconds += time.perf_counter() - start
+        for future, result, exception in results:
+            if exception is not None:
+                self.failed += 1
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            'depth': sum(pending.qsize() for pending in list(self._writers.values())) if self._pid == os.getpid() else 0,
+            'writers': len(self._writers) if self._pid == os.getpid() else 0,
+            'max_depth': self.max_depth,
+            'mutations': self.mutations,
+            'failed': self.failed,
+            'batches': self.batches,
+            'mean_batch_size': self.mutations / self.batches if self.batches else None,
+            'mean_wait_ms': self.wait_seconds / self.mutations * 1000 if self.mutations else None,
+            'mean_commit_ms': self.commit_seconds / self.batches * 1000 if self.batches else None,
+            'window_ms': self.window * 1000,
+        }
+
+    def exposition(self) -> str:
+        stats = self.stats()
+        lines = [
+            '# HELP app_write_queue_depth Mutations waiting for the writer.',
+            '# TYPE app_write_queue_depth gauge',
+            f'app_write_queue_depth {stats["depth"]}',
+            '# HELP app_write_queue_mutations_total Mutations run by the writer.',
+            '# TYPE app_write_queue_mutations_total counter',
+            f'app_write_queue_mutations_total {self.mutations}',
+            '# HELP app_write_queue_failed_total Mutations that raised and were rolled back.',
+            '# TYPE app_write_queue_failed_total counter',
+            f'app_write_queue_failed_total {self.failed}',
+            '# HELP app_write_queue_wait_seconds_total Time mutations spent queued.',
+            '# TYPE app_write_queue_wait_seconds_total counter',
+            f'app_write_queue_wait_seconds_total {self.wait_seconds}',
+            '# HELP app_write_queue_batch_size Mutations committed per transaction.',
+            '# TYPE app_write_queue_batch_size histogram',
+        ]
+        cumulative = 0
+        for bound, count in zip(BATCH_BUCKETS + ('+Inf', ), self.batch_sizes):
+            cumulative += count
+            lines.append(f'app_write_queue_batch_size_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'app_write_queue_batch_size_sum {self.mutations}')
+        lines.append(f'app_write_queue_batch_size_count {self.batches}')
+        return '\n'.join(lines) + '\n'
+
+
+def init_app(app: Flask) -> None:
+    app.extensions['write_queue'] = WriteQueue(
+        app,
+        app.config.get('WRITE_QUEUE_WINDOW_MS', 0) / 1000,
+        app.config.get('WRITE_QUEUE_MAX_BATCH', 64),
+        app.config.get('WRITE_QUEUE_TIMEOUT', 30),
+        app.config.get('WRITE_QUEUE_IDLE_TIMEOUT', 60)
+    ) if app.config.get('WRITE_QUEUE', True) else None
@@ -6,4 +6,18 @@ worker_tmp_dir = "/dev/shm"
 graceful_timeout = 120
 timeout = 120
 keepalive = 5
-threads = 3
\ No newline at end of file
+threads = 3
+# Import the app and compile its templates once in the master, workers fork from the warm process.
+preload_app = True
+raw_env = ["FLASK_PRECOMPILE_TEMPLATES=true"]
+
+
+def when_ready(server):
+    # The job workers run next to gunicorn's workers, forked from the preloaded master.
+    from app.jobs import start_workers
+    server.job_supervisor = start_workers(server.app.wsgi())
+
+
+def on_exit(server):
+    from app.jobs import stop_workers
+    stop_workers(getattr(server, 'job_supervisor', None))
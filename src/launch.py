@@ -1,7 +1,9 @@
 import os
 from app import make_app
+from app.auth import DEFAULT_SECRET
 
-secret_key = os.environ.get("FLASK_SECRET", "_DEFAULT_SECRET_")
+secret_key = os.environ.get("FLASK_SECRET", DEFAULT_SECRET)
+# Further settings are read from FLASK_* environment variables by make_app (e.g. FLASK_DB_PROFILE).
 app = make_app(secret_key)
 
 if __name__ == "__main__":
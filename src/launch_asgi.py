@@ -0,0 +1,14 @@
+import os
+from app import make_app
+from app.auth import DEFAULT_SECRET
+from app.asgi import WSGIToASGI
+
+secret_key = os.environ.get("FLASK_SECRET", DEFAULT_SECRET)
+# Same app as launch.py; database calls run on the DB executor's threads unless FLASK_DB_EXECUTOR=false.
+os.environ.setdefault("FLASK_DB_EXECUTOR", "true")
+flask_app = make_app(secret_key)
+app = WSGIToASGI(flask_app, flask_app.config.get("ASGI_THREADS", 32))
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8000)